@@ -0,0 +1,77 @@
+import argparse
+import threading
+import time
+
+import testbase
+
+from trpycore.counter.atomic import AtomicCounters
+from trsvcscore.counter.sharded import ShardedCounters
+
+def request(counters):
+    """Update counters as ServiceHandler does for each request.
+
+    Args:
+        counters: counters object
+    """
+    open_requests_counter = counters.get_counter("open_requests")
+    counters.get_counter("requests").increment()
+    open_requests_counter.increment()
+    open_requests_counter.decrement()
+
+def run(seconds, threads, counters):
+    """Simulate requests in multiple threads for seconds.
+
+    Args:
+        seconds: benchmark duration in seconds
+        threads: number of threads
+        counters: counters object
+    Returns:
+        number of simulated requests per second across all threads.
+    """
+    start_event = threading.Event()
+    stop_event = threading.Event()
+
+    def target():
+        start_event.wait()
+        while not stop_event.is_set():
+            for i in range(100):
+                request(counters)
+
+    workers = [threading.Thread(target=target) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+
+    start = time.time()
+    start_event.set()
+    time.sleep(seconds)
+    stop_event.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    return counters["requests"] / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Counter contention benchmark")
+    parser.add_argument("--seconds", type=float, default=2, help="duration of each benchmark")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64], help="thread counts")
+    args = parser.parse_args()
+
+    implementations = [
+        ("atomic", AtomicCounters),
+        ("sharded", ShardedCounters)
+    ]
+
+    for threads in args.threads:
+        for name, counters_class in implementations:
+            counters = counters_class()
+            rate = run(args.seconds, threads, counters)
+            assert counters["open_requests"] == 0
+
+            print "%-10s threads=%-4d requests/sec=%-10.1f" % (
+                    name,
+                    threads,
+                    rate)
+
+if __name__ == "__main__":
+    main()
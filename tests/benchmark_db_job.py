@@ -0,0 +1,103 @@
+import argparse
+import time
+
+from sqlalchemy import create_engine, Boolean, Column, DateTime, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+import testbase
+
+from trsvcscore.db.job import DatabaseJob, DatabaseJobQueue
+
+Base = declarative_base()
+
+class BenchmarkJob(Base):
+    __tablename__ = "benchmark_db_job"
+
+    id = Column(Integer, primary_key=True)
+    owner = Column(String(1024))
+    start = Column(DateTime)
+    end = Column(DateTime)
+    successful = Column(Boolean)
+
+def create_jobs(db_session_factory, jobs):
+    """Create unowned jobs.
+
+    Args:
+        db_session_factory: SQLAlchemy session factory
+        jobs: number of jobs to create
+    Returns:
+        list of job ids.
+    """
+    db_session = db_session_factory()
+    models = [BenchmarkJob() for i in range(jobs)]
+    db_session.add_all(models)
+    db_session.commit()
+    ids = [model.id for model in models]
+    db_session.close()
+    return ids
+
+def run_jobs(db_session_factory, jobs):
+    """Process jobs one at a time with DatabaseJob.
+
+    Args:
+        db_session_factory: SQLAlchemy session factory
+        jobs: number of jobs
+    Returns:
+        number of jobs processed per second.
+    """
+    ids = create_jobs(db_session_factory, jobs)
+
+    start = time.time()
+    for model_id in ids:
+        with DatabaseJob("benchmark", BenchmarkJob, model_id, db_session_factory):
+            pass
+    return jobs / (time.time() - start)
+
+def run_batches(db_session_factory, jobs, batch_size):
+    """Process jobs in batches with DatabaseJobQueue.get_batch().
+
+    Args:
+        db_session_factory: SQLAlchemy session factory
+        jobs: number of jobs
+        batch_size: number of jobs per batch
+    Returns:
+        number of jobs processed per second.
+    """
+    create_jobs(db_session_factory, jobs)
+    db_queue = DatabaseJobQueue(
+            owner="benchmark",
+            model_class=BenchmarkJob,
+            db_session_factory=db_session_factory)
+
+    processed = 0
+    start = time.time()
+    while processed < jobs:
+        with db_queue.get_batch(batch_size) as batch:
+            processed += len(batch.jobs)
+    return jobs / (time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Database job throughput benchmark")
+    parser.add_argument("--connection", default="sqlite:///benchmark_db_job.db", help="database connection, i.e. postgresql+psycopg2://user:password@/database?host=localdev")
+    parser.add_argument("--jobs", type=int, default=1000, help="number of jobs per benchmark")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100], help="batch sizes")
+    args = parser.parse_args()
+
+    engine = create_engine(args.connection)
+    db_session_factory = sessionmaker(bind=engine)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    try:
+        rate = run_jobs(db_session_factory, args.jobs)
+        print "%-10s batch_size=%-6d jobs/sec=%-10.1f" % ("job", 1, rate)
+
+        for batch_size in args.batch_sizes:
+            rate = run_batches(db_session_factory, args.jobs, batch_size)
+            print "%-10s batch_size=%-6d jobs/sec=%-10.1f" % ("batch", batch_size, rate)
+    finally:
+        Base.metadata.drop_all(engine)
+
+if __name__ == "__main__":
+    main()
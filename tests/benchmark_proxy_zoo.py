@@ -0,0 +1,114 @@
+import argparse
+import logging
+import threading
+import time
+
+import testbase
+
+from tridlcore.gen import TRService
+from tridlcore.gen.ttypes import RequestContext
+
+from trsvcscore.proxy.zoo import ZookeeperServiceProxyPool
+from trsvcscore.service.default import DefaultService
+from trsvcscore.service.handler.service import ServiceHandler
+from trsvcscore.service.server.default import ThriftServer
+
+class UnittestService(DefaultService):
+    def __init__(self, port=10090, threads=8):
+        self.handler = ServiceHandler(self, ["localdev:2181"])
+
+        server = ThriftServer(
+                name="unittestsvc-thrift",
+                interface="0.0.0.0",
+                port=port,
+                handler=self.handler,
+                processor=TRService.Processor(self.handler),
+                threads=threads)
+
+        super(UnittestService, self).__init__(
+                name="unittestsvc",
+                version="VERSION",
+                build="BUILD",
+                servers=[server])
+
+def run_threads(thread_count, seconds, target):
+    """Run target in thread_count threads for seconds.
+
+    Args:
+        thread_count: number of threads
+        seconds: benchmark duration in seconds
+        target: method taking no arguments to invoke repeatedly.
+    Returns:
+        total number of target invocations.
+    """
+    counts = [0] * thread_count
+    stop = threading.Event()
+
+    def worker(index):
+        count = 0
+        while not stop.is_set():
+            target()
+            count += 1
+        counts[index] = count
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts)
+
+def main():
+    parser = argparse.ArgumentParser(description="ZookeeperServiceProxyPool contention benchmark")
+    parser.add_argument("--threads", type=int, default=32, help="number of client threads")
+    parser.add_argument("--pool-size", type=int, default=32, help="proxy pool size")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each benchmark")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    service = UnittestService()
+    service.start()
+    time.sleep(1)
+
+    zookeeper_client = service.handler.zookeeper_client
+    request_context = RequestContext(
+            userId=0,
+            impersonatingUserId=0,
+            sessionId="dummy_session_id",
+            context="")
+
+    pool = ZookeeperServiceProxyPool(
+            zookeeper_client,
+            service.name(),
+            size=args.pool_size,
+            keepalive=True)
+
+    #Proxy attribute access only, which isolates the cost of
+    #the proxy hot path from the cost of the rpc itself.
+    def attribute():
+        with pool.get() as proxy:
+            proxy.getVersion
+
+    def rpc():
+        with pool.get() as proxy:
+            proxy.getVersion(request_context)
+
+    try:
+        for name, target in [("attribute", attribute), ("rpc", rpc)]:
+            total = run_threads(args.threads, args.seconds, target)
+            print "%-10s threads=%d pool_size=%d ops=%d ops/sec=%.1f" % (
+                    name,
+                    args.threads,
+                    args.pool_size,
+                    total,
+                    total / args.seconds)
+    finally:
+        pool.release()
+        service.stop()
+        service.join()
+
+if __name__ == "__main__":
+    main()
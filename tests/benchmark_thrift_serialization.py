@@ -0,0 +1,106 @@
+import argparse
+import time
+
+import testbase
+
+from thrift.protocol import TBinaryProtocol, TCompactProtocol
+from thrift.transport import TTransport
+
+from tridlcore.gen import TRService
+from tridlcore.gen.ttypes import RequestContext
+
+from trsvcscore.thrift.negotiation import fastbinary
+
+def serialize(obj, protocol_class):
+    """Serialize Thrift object.
+
+    Args:
+        obj: Thrift object
+        protocol_class: Thrift protocol class
+    Returns:
+        serialized string
+    """
+    transport = TTransport.TMemoryBuffer()
+    obj.write(protocol_class(transport))
+    return transport.getvalue()
+
+def deserialize(obj, data, protocol_class):
+    """Deserialize Thrift object.
+
+    Note that TMemoryBuffer is a CReadableTransport,
+    which is required for the accelerated protocol.
+
+    Args:
+        obj: empty Thrift object to populate
+        data: serialized string
+        protocol_class: Thrift protocol class
+    Returns:
+        populated obj
+    """
+    transport = TTransport.TMemoryBuffer(data)
+    obj.read(protocol_class(transport))
+    return obj
+
+def run(seconds, target):
+    """Run target repeatedly for seconds.
+
+    Args:
+        seconds: benchmark duration in seconds
+        target: method taking no arguments to invoke repeatedly.
+    Returns:
+        number of target invocations per second.
+    """
+    count = 0
+    start = time.time()
+    end = start + seconds
+    while time.time() < end:
+        for i in range(100):
+            target()
+        count += 100
+    return count / (time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Thrift serialization benchmark")
+    parser.add_argument("--seconds", type=float, default=2, help="duration of each benchmark")
+    parser.add_argument("--counters", type=int, default=100, help="number of counters in getCounters result")
+    args = parser.parse_args()
+
+    protocols = [
+        ("binary", TBinaryProtocol.TBinaryProtocol),
+        ("compact", TCompactProtocol.TCompactProtocol)
+    ]
+    if fastbinary is not None:
+        protocols.append(("accelerated", TBinaryProtocol.TBinaryProtocolAccelerated))
+    else:
+        print "fastbinary not installed, skipping accelerated protocol"
+
+    #Representative request argument and response structs
+    structs = [
+        ("RequestContext", RequestContext, RequestContext(
+            userId=1,
+            impersonatingUserId=2,
+            sessionId="dummy_session_id",
+            context="dummy_context")),
+        ("getCounters_result", TRService.getCounters_result, TRService.getCounters_result(
+            success=dict(("counter_%d" % i, i) for i in range(args.counters))))
+    ]
+
+    for struct_name, struct_class, obj in structs:
+        for protocol_name, protocol_class in protocols:
+            data = serialize(obj, protocol_class)
+            assert deserialize(struct_class(), data, protocol_class) == obj
+
+            write_rate = run(args.seconds,
+                    lambda: serialize(obj, protocol_class))
+            read_rate = run(args.seconds,
+                    lambda: deserialize(struct_class(), data, protocol_class))
+
+            print "%-20s %-12s bytes=%-6d write/sec=%-10.1f read/sec=%-10.1f" % (
+                    struct_name,
+                    protocol_name,
+                    len(data),
+                    write_rate,
+                    read_rate)
+
+if __name__ == "__main__":
+    main()
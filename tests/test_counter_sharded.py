@@ -0,0 +1,48 @@
+import gc
+import threading
+import unittest
+
+import testbase
+
+from trsvcscore.counter.sharded import ShardedCounters
+
+class TestShardedCounters(unittest.TestCase):
+
+    def test_counters(self):
+        counters = ShardedCounters()
+        self.assertNotIn("requests", counters)
+
+        counter = counters.get_counter("requests")
+        self.assertIs(counters.get_counter("requests"), counter)
+        counter.increment()
+        counter.increment(2)
+        counter.decrement()
+        self.assertEqual(counter.get(), 2)
+        self.assertEqual(counters["requests"], 2)
+        self.assertEqual(counters.as_dict(), {"requests": 2})
+
+    def test_threads(self):
+        counters = ShardedCounters()
+
+        def target():
+            for i in range(1000):
+                counters.get_counter("requests").increment()
+                counters.get_counter("open_requests").increment()
+                counters.get_counter("open_requests").decrement()
+
+        threads = [threading.Thread(target=target) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gc.collect()
+
+        self.assertEqual(counters["requests"], 10000)
+        self.assertEqual(counters["open_requests"], 0)
+
+        #Shards of exited threads are retired
+        counter = counters.get_counter("requests")
+        self.assertLess(len(counter.shards), 10)
+
+if __name__ == "__main__":
+    unittest.main()
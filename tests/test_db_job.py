@@ -10,7 +10,7 @@ from sqlalchemy.orm import sessionmaker
 
 import testbase
 from trpycore.timezone import tz
-from trsvcscore.db.job import DatabaseJobQueue, QueueEmpty, QueueStopped
+from trsvcscore.db.job import DatabaseJobQueue, QueueEmpty, QueueStopped, notify_jobs
 from trsvcscore.db.models import ChatArchiveJob
 
 #Database settings
@@ -158,5 +158,208 @@ class TestDatabaseJob(unittest.TestCase):
 
         self.db_queue.start()
 
+class TestDatabaseJobClaim(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.engine = create_engine(DATABASE_CONNECTION)
+        cls.db_session_factory = sessionmaker(bind=cls.engine)
+        cls.db_queues = [
+            DatabaseJobQueue(
+                owner="unittest%d" % i,
+                model_class = ChatArchiveJob,
+                db_session_factory=cls.db_session_factory,
+                poll_seconds=1,
+                claim_batch_size=2)
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        self.session = self.db_session_factory()
+        self.jobs = [ChatArchiveJob(created=tz.utcnow(), not_before=tz.utcnow(), retries_remaining=0)
+                for i in range(3)]
+        self.session.add_all(self.jobs)
+        self.session.commit()
+        for db_queue in self.db_queues:
+            db_queue.start()
+
+    def tearDown(self):
+        for db_queue in self.db_queues:
+            db_queue.stop()
+            db_queue.join()
+        for job in self.jobs:
+            self.session.delete(job)
+        self.session.commit()
+        self.session.close()
+
+    def test_claim(self):
+        time.sleep(2)
+
+        #Each job is claimed by exactly one queue
+        claimed = {}
+        for db_queue in self.db_queues:
+            try:
+                while True:
+                    with db_queue.get(False) as db_job:
+                        self.assertEqual(db_job.owner, db_queue.owner)
+                        claimed[db_job.id] = db_queue.owner
+            except QueueEmpty:
+                pass
+        self.assertEqual(sorted(claimed), sorted([job.id for job in self.jobs]))
+
+        for job in self.jobs:
+            self.session.refresh(job)
+            self.assertTrue(job.successful)
+            self.assertEqual(job.owner, claimed[job.id])
+
+    def test_release(self):
+        time.sleep(2)
+
+        #Unconsumed jobs are released when the queue is stopped
+        for db_queue in self.db_queues:
+            db_queue.stop()
+            db_queue.join()
+        for job in self.jobs:
+            self.session.refresh(job)
+            self.assertIsNone(job.owner)
+            self.assertIsNone(job.start)
+
+class TestDatabaseJobNotify(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.engine = create_engine(DATABASE_CONNECTION)
+        cls.db_session_factory = sessionmaker(bind=cls.engine)
+        cls.db_queue = DatabaseJobQueue(
+                owner="unittest",
+                model_class = ChatArchiveJob,
+                db_session_factory=cls.db_session_factory,
+                poll_seconds=60,
+                notify_channel="unittest_chat_archive_job")
+        cls.db_queue.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_queue.stop()
+        cls.db_queue.join()
+
+    def test_notify(self):
+        time.sleep(1)
+        with self.assertRaises(QueueEmpty):
+            self.db_queue.get(False)
+
+        session = self.db_session_factory()
+        job = ChatArchiveJob(created=tz.utcnow(), not_before=tz.utcnow(), retries_remaining=0)
+        try:
+            session.add(job)
+            notify_jobs(session, "unittest_chat_archive_job")
+            session.commit()
+
+            #Job is polled well before poll_seconds
+            with self.db_queue.get(True, 5) as db_job:
+                self.assertEqual(job.id, db_job.id)
+                self.assertEqual(db_job.owner, "unittest")
+        finally:
+            session.delete(job)
+            session.commit()
+            session.close()
+
+class TestDatabaseJobPrefetch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.engine = create_engine(DATABASE_CONNECTION)
+        cls.db_session_factory = sessionmaker(bind=cls.engine)
+        cls.db_queue = DatabaseJobQueue(
+                owner="unittest",
+                model_class = ChatArchiveJob,
+                db_session_factory=cls.db_session_factory,
+                poll_seconds=1,
+                consumers=1)
+
+    def setUp(self):
+        self.session = self.db_session_factory()
+        self.jobs = [ChatArchiveJob(created=tz.utcnow(), not_before=tz.utcnow(), retries_remaining=0)
+                for i in range(5)]
+        self.session.add_all(self.jobs)
+        self.session.commit()
+        self.db_queue.start()
+
+    def tearDown(self):
+        self.db_queue.stop()
+        self.db_queue.join()
+        for job in self.jobs:
+            self.session.delete(job)
+        self.session.commit()
+        self.session.close()
+
+    def test_prefetch(self):
+        #Polls do not queue jobs already queued locally,
+        #or more than the prefetch limit.
+        time.sleep(3)
+        limit = DatabaseJobQueue.PREFETCH_PER_CONSUMER
+        self.assertEqual(self.db_queue.queue.qsize(), limit)
+        self.assertEqual(len(self.db_queue.queued_ids), limit)
+
+        ids = []
+        for i in range(len(self.jobs)):
+            with self.db_queue.get(True, 5) as db_job:
+                ids.append(db_job.id)
+        self.assertEqual(sorted(ids), sorted([job.id for job in self.jobs]))
+
+class TestDatabaseJobBatch(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.engine = create_engine(DATABASE_CONNECTION)
+        cls.db_session_factory = sessionmaker(bind=cls.engine)
+        cls.db_queue = DatabaseJobQueue(
+                owner="unittest",
+                model_class = ChatArchiveJob,
+                db_session_factory=cls.db_session_factory)
+
+    def setUp(self):
+        self.session = self.db_session_factory()
+        self.jobs = [ChatArchiveJob(created=tz.utcnow(), not_before=tz.utcnow(), retries_remaining=0)
+                for i in range(3)]
+        self.session.add_all(self.jobs)
+        self.session.commit()
+
+    def tearDown(self):
+        for job in self.jobs:
+            self.session.delete(job)
+        self.session.commit()
+        self.session.close()
+
+    def test_batch(self):
+        with self.db_queue.get_batch(2) as batch:
+            self.assertEqual(len(batch.jobs), 2)
+            for job in batch.jobs:
+                self.assertEqual(job.owner, "unittest")
+            batch.failed(batch.jobs[0])
+        failed_id = batch.jobs[0].id
+
+        #Remaining jobs succeed unless an exception is raised
+        with self.assertRaises(RuntimeError):
+            with self.db_queue.get_batch(2) as remaining:
+                self.assertEqual(len(remaining.jobs), 1)
+                raise RuntimeError("failed")
+
+        for job in self.jobs:
+            self.session.refresh(job)
+            self.assertIsNotNone(job.end)
+            if job.id in [failed_id, remaining.jobs[0].id]:
+                self.assertFalse(job.successful)
+            else:
+                self.assertTrue(job.successful)
+
+        #Empty batches are not updated
+        with self.db_queue.get_batch(2) as batch:
+            self.assertEqual(batch.jobs, [])
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,70 @@
+import logging
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+import testbase
+from trsvcscore.db.pool import PoolMetrics, instrument_pool, instrumented_pool_class
+
+#Database settings
+DATABASE_HOST = "localdev"
+DATABASE_NAME = "localdev_techresidents"
+DATABASE_USERNAME = "techresidents"
+DATABASE_PASSWORD = "techresidents"
+DATABASE_CONNECTION = "postgresql+psycopg2://%s:%s@/%s?host=%s" % (DATABASE_USERNAME, DATABASE_PASSWORD, DATABASE_NAME, DATABASE_HOST)
+
+class TestDatabasePool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.metrics = PoolMetrics()
+        self.engine = create_engine(
+                DATABASE_CONNECTION,
+                poolclass=instrumented_pool_class(QueuePool, self.metrics),
+                pool_size=1,
+                max_overflow=2)
+        instrument_pool(self.engine, self.metrics, pre_ping=True)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_occupancy(self):
+        connections = [self.engine.connect() for i in range(3)]
+        counters = self.metrics.counters()
+        self.assertEqual(counters["database_pool_checkouts"], 3)
+        self.assertEqual(counters["database_pool_connects"], 3)
+        self.assertEqual(counters["database_pool_overflow_connects"], 2)
+        self.assertEqual(counters["database_pool_checked_out"], 3)
+        self.assertIn("database_pool_checkout_wait_p99_us", counters)
+
+        for connection in connections:
+            connection.close()
+        counters = self.metrics.counters()
+        self.assertEqual(counters["database_pool_checked_out"], 0)
+        self.assertEqual(counters["database_pool_checked_in"], 1)
+
+    def test_invalidate(self):
+        connection = self.engine.connect()
+        connection.invalidate()
+        connection.close()
+        self.assertEqual(self.metrics.invalidations, 1)
+
+    def test_pre_ping(self):
+        connection = self.engine.connect()
+        connection.close()
+
+        #Close the pooled DBAPI connection, as a database
+        #restart would, and verify that it's replaced.
+        self.engine.pool._pool.queue[0].connection.close()
+        connection = self.engine.connect()
+        self.assertEqual(connection.execute("SELECT 1").scalar(), 1)
+        connection.close()
+        self.assertEqual(self.metrics.invalidations, 1)
+        self.assertEqual(self.metrics.connects, 2)
+
+if __name__ == "__main__":
+    unittest.main()
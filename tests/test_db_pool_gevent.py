@@ -0,0 +1,82 @@
+import logging
+import unittest
+
+import gevent
+from sqlalchemy import create_engine, exc
+
+import testbase
+from trpycore import psycopg2_gevent
+from trsvcscore.db.pool import PoolMetrics, instrument_pool, instrumented_pool_class
+from trsvcscore.db_gevent.pool import GQueuePool
+
+#Database settings
+DATABASE_HOST = "localdev"
+DATABASE_NAME = "localdev_techresidents"
+DATABASE_USERNAME = "techresidents"
+DATABASE_PASSWORD = "techresidents"
+DATABASE_CONNECTION = "postgresql+psycopg2://%s:%s@/%s?host=%s" % (DATABASE_USERNAME, DATABASE_PASSWORD, DATABASE_NAME, DATABASE_HOST)
+
+class TestDatabasePool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+    def setUp(self):
+        self.metrics = PoolMetrics()
+        self.engine = create_engine(
+                DATABASE_CONNECTION,
+                poolclass=instrumented_pool_class(GQueuePool, self.metrics),
+                pool_size=1,
+                max_overflow=1,
+                pool_timeout=1)
+        instrument_pool(self.engine, self.metrics)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_bounded(self):
+        results = []
+        def query(index):
+            connection = self.engine.connect()
+            results.append(index)
+            gevent.sleep(0.1)
+            connection.close()
+
+        #Connections are bounded by pool_size + max_overflow,
+        #and waiting greenlets are served in order.
+        greenlets = [gevent.spawn(query, i) for i in range(6)]
+        gevent.sleep(0.05)
+        counters = self.metrics.counters()
+        self.assertEqual(counters["database_pool_checked_out"], 2)
+        self.assertEqual(counters["database_pool_waiting"], 4)
+
+        gevent.joinall(greenlets)
+        self.assertEqual(results, range(6))
+        self.assertEqual(self.metrics.connects, 2)
+        self.assertEqual(self.metrics.overflow_connects, 1)
+
+        counters = self.metrics.counters()
+        self.assertEqual(counters["database_pool_checked_out"], 0)
+        self.assertEqual(counters["database_pool_checked_in"], 1)
+        self.assertEqual(counters["database_pool_overflow"], 0)
+
+    def test_timeout(self):
+        connections = [self.engine.connect() for i in range(2)]
+        with self.assertRaises(exc.TimeoutError):
+            self.engine.connect()
+        self.assertEqual(self.metrics.timeouts, 1)
+        self.assertEqual(self.metrics.counters()["database_pool_waiting"], 0)
+
+        for connection in connections:
+            connection.close()
+        connection = self.engine.connect()
+        connection.close()
+
+    def test_recreate(self):
+        pool = self.engine.pool.recreate()
+        self.assertIs(pool.__class__, self.engine.pool.__class__)
+        self.assertEqual(pool.size(), 1)
+
+if __name__ == "__main__":
+    unittest.main()
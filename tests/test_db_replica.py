@@ -0,0 +1,72 @@
+import logging
+import unittest
+
+from sqlalchemy import create_engine
+
+import testbase
+from trsvcscore.db.replica import Balancing, ReplicaRouter
+
+#Database settings
+DATABASE_HOST = "localdev"
+DATABASE_NAME = "localdev_techresidents"
+DATABASE_USERNAME = "techresidents"
+DATABASE_PASSWORD = "techresidents"
+DATABASE_CONNECTION = "postgresql+psycopg2://%s:%s@/%s?host=%s" % (DATABASE_USERNAME, DATABASE_PASSWORD, DATABASE_NAME, DATABASE_HOST)
+UNAVAILABLE_DATABASE_CONNECTION = "postgresql+psycopg2://%s:%s@/%s?host=%s" % (DATABASE_USERNAME, DATABASE_PASSWORD, "unavailable_techresidents", DATABASE_HOST)
+
+class TestReplicaRouter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.primary = create_engine(DATABASE_CONNECTION)
+        cls.replicas = [create_engine(DATABASE_CONNECTION) for i in range(2)]
+        cls.unavailable = create_engine(UNAVAILABLE_DATABASE_CONNECTION)
+
+    def test_round_robin(self):
+        router = ReplicaRouter(self.primary, self.replicas)
+        engines = [router.engine() for i in range(4)]
+        self.assertEqual(engines, self.replicas * 2)
+        self.assertEqual(router.counters()["database_replica_sessions"], 4)
+
+    def test_least_connections(self):
+        router = ReplicaRouter(self.primary, self.replicas,
+                balancing=Balancing.LEAST_CONNECTIONS)
+        connection = self.replicas[0].connect()
+        try:
+            self.assertIs(router.engine(), self.replicas[1])
+        finally:
+            connection.close()
+
+    def test_unhealthy(self):
+        router = ReplicaRouter(self.primary, [self.unavailable, self.replicas[0]])
+        for i in range(2):
+            self.assertIs(router.engine(), self.replicas[0])
+        self.assertEqual(router.counters()["database_replicas_healthy"], 1)
+
+        #Fall back to the primary if no replica is healthy
+        router = ReplicaRouter(self.primary, [self.unavailable])
+        self.assertIs(router.engine(), self.primary)
+        self.assertEqual(router.counters()["database_replica_fallbacks"], 1)
+
+        #Unhealthy replicas are retried after retry_seconds
+        router.retry_seconds = 0
+        router.mark_unhealthy(self.unavailable)
+        self.assertEqual(router.healthy_replicas(), [self.unavailable])
+
+    def test_saturated(self):
+        saturated = create_engine(DATABASE_CONNECTION,
+                pool_size=1, max_overflow=0, pool_timeout=1)
+        router = ReplicaRouter(self.primary, [saturated, self.replicas[0]])
+        connection = saturated.connect()
+        try:
+            #Saturated replicas are skipped, but remain healthy
+            self.assertIs(router.engine(), self.replicas[0])
+            counters = router.counters()
+            self.assertEqual(counters["database_replica_fallbacks"], 1)
+            self.assertEqual(counters["database_replicas_healthy"], 2)
+        finally:
+            connection.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import testbase
+from trpycore.timezone import tz
+from trsvcscore.db.job import DatabaseJobQueue
+from trsvcscore.db.models import ChatArchiveJob
+from trsvcscore.db.runner import DatabaseJobRunner
+
+#Database settings
+DATABASE_HOST = "localdev"
+DATABASE_NAME = "localdev_techresidents"
+DATABASE_USERNAME = "techresidents"
+DATABASE_PASSWORD = "techresidents"
+DATABASE_CONNECTION = "postgresql+psycopg2://%s:%s@/%s?host=%s" % (DATABASE_USERNAME, DATABASE_PASSWORD, DATABASE_NAME, DATABASE_HOST)
+
+class TestDatabaseJobRunner(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.engine = create_engine(DATABASE_CONNECTION)
+        cls.db_session_factory = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.db_session_factory()
+        self.jobs = [ChatArchiveJob(created=tz.utcnow(), not_before=tz.utcnow(), retries_remaining=0)
+                for i in range(6)]
+        self.session.add_all(self.jobs)
+        self.session.commit()
+
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.failed_id = self.jobs[0].id
+
+        self.db_queue = DatabaseJobQueue(
+                owner="unittest",
+                model_class=ChatArchiveJob,
+                db_session_factory=self.db_session_factory,
+                poll_seconds=1,
+                consumers=4)
+        self.runner = DatabaseJobRunner(
+                db_queue=self.db_queue,
+                process=self.process,
+                workers=4,
+                name="archive",
+                job_type=lambda job: "archive",
+                max_concurrency={"archive": 2})
+        self.runner.start()
+
+    def tearDown(self):
+        self.runner.stop()
+        self.runner.join()
+        for job in self.jobs:
+            self.session.delete(job)
+        self.session.commit()
+        self.session.close()
+
+    def process(self, job):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.1)
+        with self.lock:
+            self.active -= 1
+        if job.id == self.failed_id:
+            raise RuntimeError("failed")
+
+    def test_runner(self):
+        time.sleep(3)
+
+        for job in self.jobs:
+            self.session.refresh(job)
+            self.assertEqual(job.successful, job.id != self.failed_id)
+        self.assertEqual(self.max_active, 2)
+
+        counters = self.runner.counters()
+        self.assertEqual(counters["job_runner_archive_processed"], len(self.jobs))
+        self.assertEqual(counters["job_runner_archive_failed"], 1)
+        self.assertEqual(counters["job_runner_archive_workers"], 4)
+        self.assertGreater(counters["job_runner_archive_jobs_per_sec"], 0)
+        self.assertGreater(counters["job_runner_archive_lag_max_us"], 0)
+
+    def test_stop(self):
+        self.runner.stop()
+        self.runner.join()
+        for worker in self.runner.worker_list:
+            self.assertFalse(worker.is_alive())
+
+class TestDatabaseJobRunnerJobTypes(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.engine = create_engine(DATABASE_CONNECTION)
+        cls.db_session_factory = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.db_session_factory()
+        self.jobs = [ChatArchiveJob(created=tz.utcnow(), not_before=tz.utcnow(), retries_remaining=0)
+                for i in range(6)]
+        self.session.add_all(self.jobs)
+        self.session.commit()
+
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.slow_started = threading.Event()
+
+        #More workers than the slow job type's capacity
+        self.db_queue = DatabaseJobQueue(
+                owner="unittest",
+                model_class=ChatArchiveJob,
+                db_session_factory=self.db_session_factory,
+                poll_seconds=1,
+                consumers=2)
+        self.runner = DatabaseJobRunner(
+                db_queue=self.db_queue,
+                process=self.process,
+                workers=2,
+                name="archive",
+                job_type=self.job_type,
+                max_concurrency={"slow": 1})
+        self.runner.start()
+
+    def tearDown(self):
+        self.runner.stop()
+        self.runner.join()
+        for job in self.jobs:
+            self.session.delete(job)
+        self.session.commit()
+        self.session.close()
+
+    def job_type(self, job):
+        return "slow" if job.id % 2 else "fast"
+
+    def process(self, job):
+        if self.job_type(job) == "slow":
+            with self.lock:
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            self.slow_started.set()
+            time.sleep(1.5)
+            with self.lock:
+                self.active -= 1
+
+    def successful(self, job_type):
+        result = []
+        for job in self.jobs:
+            if self.job_type(job) == job_type:
+                self.session.refresh(job)
+                result.append(job.successful)
+        return result
+
+    def test_job_type_capacity(self):
+        #verify fast jobs are processed while a slow job
+        #occupies the slow job type's capacity
+        self.assertTrue(self.slow_started.wait(5))
+        time.sleep(1)
+        self.assertEqual(self.successful("fast"), [True] * 3)
+        self.assertEqual(self.successful("slow").count(True), 0)
+        self.session.commit()
+
+        #verify deferred slow jobs are processed one at a time
+        for i in range(20):
+            if self.successful("slow") == [True] * 3:
+                break
+            self.session.commit()
+            time.sleep(0.5)
+        self.assertEqual(self.successful("slow"), [True] * 3)
+        self.assertEqual(self.max_active, 1)
+
+        counters = self.runner.counters()
+        self.assertEqual(counters["job_runner_archive_processed"], len(self.jobs))
+        self.assertEqual(counters["job_runner_archive_failed"], 0)
+        self.assertGreater(counters["job_runner_archive_deferred"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
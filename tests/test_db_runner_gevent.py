@@ -0,0 +1,83 @@
+import logging
+import unittest
+
+import gevent
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import testbase
+from trpycore import psycopg2_gevent
+from trpycore.timezone import tz
+from trsvcscore.db.models import ChatArchiveJob
+from trsvcscore.db_gevent.job import GDatabaseJobQueue
+from trsvcscore.db_gevent.pool import GQueuePool
+from trsvcscore.db_gevent.runner import GDatabaseJobRunner
+
+#Database settings
+DATABASE_HOST = "localdev"
+DATABASE_NAME = "localdev_techresidents"
+DATABASE_USERNAME = "techresidents"
+DATABASE_PASSWORD = "techresidents"
+DATABASE_CONNECTION = "postgresql+psycopg2://%s:%s@/%s?host=%s" % (DATABASE_USERNAME, DATABASE_PASSWORD, DATABASE_NAME, DATABASE_HOST)
+
+class TestGDatabaseJobRunner(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.engine = create_engine(DATABASE_CONNECTION, poolclass=GQueuePool)
+        cls.db_session_factory = sessionmaker(bind=cls.engine)
+
+    def setUp(self):
+        self.session = self.db_session_factory()
+        self.jobs = [ChatArchiveJob(created=tz.utcnow(), not_before=tz.utcnow(), retries_remaining=0)
+                for i in range(6)]
+        self.session.add_all(self.jobs)
+        self.session.commit()
+
+        self.active = 0
+        self.max_active = 0
+
+        self.db_queue = GDatabaseJobQueue(
+                owner="unittest",
+                model_class=ChatArchiveJob,
+                db_session_factory=self.db_session_factory,
+                poll_seconds=1,
+                consumers=4)
+        self.runner = GDatabaseJobRunner(
+                db_queue=self.db_queue,
+                process=self.process,
+                workers=4,
+                name="archive",
+                job_type=lambda job: "archive",
+                max_concurrency={"archive": 2})
+        self.runner.start()
+
+    def tearDown(self):
+        self.runner.stop()
+        self.runner.join()
+        for job in self.jobs:
+            self.session.delete(job)
+        self.session.commit()
+        self.session.close()
+
+    def process(self, job):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        gevent.sleep(0.1)
+        self.active -= 1
+
+    def test_runner(self):
+        gevent.sleep(3)
+
+        for job in self.jobs:
+            self.session.refresh(job)
+            self.assertTrue(job.successful)
+        self.assertEqual(self.max_active, 2)
+
+        counters = self.runner.counters()
+        self.assertEqual(counters["job_runner_archive_processed"], len(self.jobs))
+        self.assertEqual(counters["job_runner_archive_failed"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
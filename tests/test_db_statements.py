@@ -0,0 +1,81 @@
+import logging
+import unittest
+
+from sqlalchemy import create_engine, exc
+
+import testbase
+from trsvcscore.db.instrument import instrument_engine
+from trsvcscore.db.statements import current_statements, instrument_statements, \
+        statement_shape, track_statements
+
+#Database settings
+DATABASE_HOST = "localdev"
+DATABASE_NAME = "localdev_techresidents"
+DATABASE_USERNAME = "techresidents"
+DATABASE_PASSWORD = "techresidents"
+DATABASE_CONNECTION = "postgresql+psycopg2://%s:%s@/%s?host=%s" % (DATABASE_USERNAME, DATABASE_PASSWORD, DATABASE_NAME, DATABASE_HOST)
+
+class TestStatementShape(unittest.TestCase):
+
+    def test_shape(self):
+        self.assertEqual(
+                statement_shape("SELECT chat.id FROM chat\n WHERE chat.id = %(id_1)s"),
+                "SELECT chat.id FROM chat WHERE chat.id = ?")
+        self.assertEqual(
+                statement_shape("select * from t1 where name = 'it''s' limit 5"),
+                "select * from t1 where name = ? limit ?")
+        self.assertEqual(
+                statement_shape("SELECT * FROM t WHERE id IN (%(id_1)s, %(id_2)s)"),
+                statement_shape("SELECT * FROM t WHERE id IN (%(id_1)s)"))
+        self.assertEqual(
+                statement_shape("SELECT id::text FROM t"),
+                "SELECT id::text FROM t")
+
+class TestTrackStatements(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+        cls.engine = create_engine(DATABASE_CONNECTION)
+        instrument_engine(cls.engine)
+        instrument_statements(cls.engine)
+
+    def test_repeated(self):
+        self.assertIsNone(current_statements())
+
+        with track_statements("outer", repeat_threshold=3) as outer:
+            with track_statements("inner", repeat_threshold=3) as inner:
+                for i in range(5):
+                    self.engine.execute("SELECT %(id)s", id=i)
+            self.engine.execute("SELECT 1")
+        
+        self.assertIsNone(current_statements())
+        self.assertEqual(inner.queries, 5)
+        self.assertEqual(outer.queries, 6)
+        self.assertGreater(outer.duration, 0)
+
+        repeated = outer.repeated()
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][:2], ("SELECT ?", 6))
+        self.assertEqual(outer.log_repeated(), 1)
+
+        #Untracked statements are not recorded
+        self.engine.execute("SELECT 1")
+        self.assertEqual(outer.queries, 6)
+
+    def test_failed_statement(self):
+        connection = self.engine.connect()
+        try:
+            with track_statements("failed") as stats:
+                with self.assertRaises(exc.DBAPIError):
+                    connection.execute("SELECT * FROM missing_table")
+                connection.execute("SELECT 1")
+
+            #Failed statements leave no state on the connection
+            self.assertEqual(stats.queries, 1)
+            self.assertNotIn("statement_start", connection.info)
+        finally:
+            connection.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import random
+import time
+import unittest
+
+import testbase
+
+from trsvcscore.counter.sharded import ShardedCounters
+from trsvcscore.metrics.exposition import metric_name, render
+from trsvcscore.metrics.histogram import Histogram
+from trsvcscore.metrics.method import MethodMetrics
+from trsvcscore.metrics.slow import SlowRequestLog
+from trsvcscore.metrics.timing import begin_request, current_request, end_request, timed
+
+class TestHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.count, 0)
+        self.assertEqual(histogram.percentile(99), 0)
+        self.assertEqual(histogram.mean(), 0)
+
+    def test_percentiles(self):
+        histogram = Histogram(sub_buckets=8)
+        values = [random.uniform(1, 100000) for i in range(10000)]
+        for value in values:
+            histogram.record(value)
+        values.sort()
+
+        self.assertEqual(histogram.count, len(values))
+        self.assertEqual(histogram.max, values[-1])
+        self.assertEqual(histogram.percentile(100), values[-1])
+
+        #Percentiles are accurate to within one sub bucket
+        for percentile in [50, 90, 99]:
+            expected = values[int(len(values) * percentile / 100.0) - 1]
+            actual = histogram.percentile(percentile)
+            self.assertGreaterEqual(actual, expected)
+            self.assertLessEqual(actual, expected * (1 + 1.0 / 8) + 1)
+
+    def test_out_of_range(self):
+        histogram = Histogram(max_value=1000)
+        histogram.record(0)
+        histogram.record(1000000)
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.percentile(100), 1000000)
+        self.assertEqual(len(histogram.buckets), histogram.size)
+
+    def test_snapshot(self):
+        histogram = Histogram()
+        for value in [10, 100, 1000]:
+            histogram.record(value)
+
+        count, total, counts = histogram.snapshot([50, 500, 5000])
+        self.assertEqual(count, 3)
+        self.assertEqual(total, 1110)
+        self.assertEqual(counts, [1, 2, 3])
+        self.assertEqual(counts, histogram.cumulative_counts([50, 500, 5000]))
+
+class TestMethodMetrics(unittest.TestCase):
+
+    def test_method_metrics(self):
+        metrics = MethodMetrics()
+        metric = metrics.get_metric("getVersion")
+        self.assertIs(metrics.get_metric("getVersion"), metric)
+
+        metric.record(0.001)
+        metric.record(0.002, error=True)
+
+        counters = metrics.counters()
+        self.assertEqual(counters["method_getVersion_requests"], 2)
+        self.assertEqual(counters["method_getVersion_errors"], 1)
+        self.assertEqual(counters["method_getVersion_latency_max_us"], 2000)
+        self.assertIn("method_getVersion_latency_p99_us", counters)
+        self.assertIn("getVersion: requests=2 errors=1", metrics.summary())
+
+        #Methods which have not been called are not reported
+        metrics.get_metric("getStatus")
+        self.assertNotIn("method_getStatus_requests", metrics.counters())
+
+class TestExposition(unittest.TestCase):
+
+    class Handler(object):
+        def __init__(self):
+            self.counters = ShardedCounters()
+            self.method_metrics = MethodMetrics()
+            self.counter_providers = [
+                self.method_metrics.counters,
+                lambda: {"thrift_pool_occupancy": 2}
+            ]
+
+    def test_metric_name(self):
+        self.assertEqual(metric_name("thrift_pool-size"), "thrift_pool_size")
+        self.assertEqual(metric_name("2xx"), "_2xx")
+
+    def test_render(self):
+        handler = self.Handler()
+        handler.counters.get_counter("requests").increment()
+        handler.method_metrics.get_metric("getVersion").record(0.002)
+        handler.method_metrics.get_metric("getStatus")
+
+        chunks = list(render(handler))
+        self.assertGreater(len(chunks), 1)
+        lines = "".join(chunks).splitlines()
+
+        self.assertIn("requests 1", lines)
+        self.assertIn("thrift_pool_occupancy 2", lines)
+        self.assertIn('service_method_latency_seconds_bucket{method="getVersion",le="0.001"} 0', lines)
+        self.assertIn('service_method_latency_seconds_bucket{method="getVersion",le="0.0025"} 1', lines)
+        self.assertIn('service_method_latency_seconds_count{method="getVersion"} 1', lines)
+        self.assertIn('service_method_errors_total{method="getVersion"} 0', lines)
+
+        #Method metrics are rendered as histograms only, and
+        #methods which have not been called are excluded.
+        self.assertFalse([line for line in lines if line.startswith("method_")])
+        self.assertFalse([line for line in lines if "getStatus" in line])
+
+class TestRequestTiming(unittest.TestCase):
+
+    def test_timing(self):
+        self.assertIsNone(current_request())
+
+        timing = begin_request("getVersion")
+        self.assertIs(current_request(), timing)
+        with timed("proxy"):
+            time.sleep(0.01)
+
+        #Time spent in nested requests is not added to the outer request
+        nested = begin_request("getStatus")
+        with timed("db"):
+            pass
+        end_request(nested)
+        self.assertIs(current_request(), timing)
+
+        end_request(timing)
+        self.assertIsNone(current_request())
+        self.assertGreaterEqual(timing.times["proxy"], 0.01)
+        self.assertNotIn("db", timing.times)
+        self.assertIn("db", nested.times)
+        self.assertGreaterEqual(timing.duration, timing.times["proxy"])
+
+class TestSlowRequestLog(unittest.TestCase):
+
+    def test_slow_request_log(self):
+        log = SlowRequestLog(threshold=0.01, size=2, max_arguments_length=10)
+
+        timing = begin_request("getVersion")
+        end_request(timing)
+        self.assertFalse(log.record(timing))
+
+        for method in ["first", "second", "third"]:
+            timing = begin_request(method)
+            timing.add("db", 0.005)
+            time.sleep(0.01)
+            end_request(timing)
+            self.assertTrue(log.record(timing, ["x" * 20]))
+
+        #Only the most recent requests are retained
+        requests = log.requests()
+        self.assertEqual([request.method for request, arguments in requests], ["third", "second"])
+        self.assertEqual(requests[0][1], "'xxxxxxxxx...")
+
+        summary = log.summary()
+        self.assertIn("third('xxxxxxxxx...)", summary)
+        self.assertIn("db=5ms", summary)
+
+        log.clear()
+        self.assertEqual(log.summary(), "")
+
+if __name__ == "__main__":
+    unittest.main()
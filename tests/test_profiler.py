@@ -0,0 +1,66 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import testbase
+
+from trsvcscore.profiler.sampling import SamplingProfiler, parse_bool, parse_rate
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        sum(range(100))
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def test_profiler(self):
+        profiler = SamplingProfiler(rate=200)
+        profiler.start()
+        self.assertTrue(profiler.is_running())
+
+        thread = threading.Thread(target=busy, args=(0.5,), name="busy")
+        thread.start()
+        thread.join()
+
+        profiler.stop()
+        time.sleep(0.1)
+        self.assertFalse(profiler.is_running())
+        self.assertGreater(profiler.sample_count, 0)
+
+        busy_stacks = [line for line in profiler.collapsed().splitlines()
+                if line.startswith("busy;")]
+        self.assertTrue(busy_stacks)
+        self.assertIn("busy (%s" % __file__.replace(".pyc", ".py"), busy_stacks[0])
+
+        profiler.reset()
+        self.assertEqual(profiler.collapsed(), "")
+
+    def test_duration(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            profiler = SamplingProfiler(rate=200, idle=True)
+            profiler.start(duration=0.2, output=path)
+            time.sleep(0.5)
+            self.assertFalse(profiler.is_running())
+            with open(path) as output:
+                self.assertEqual(output.read().strip(), profiler.collapsed())
+        finally:
+            os.remove(path)
+
+    def test_parse_bool(self):
+        for value in ["1", "true", "True", "yes", "on"]:
+            self.assertTrue(parse_bool(value))
+        for value in ["0", "false", "", "no"]:
+            self.assertFalse(parse_bool(value))
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("50"), 50.0)
+        for value in ["0", "-1", "", "fast", None]:
+            with self.assertRaises(ValueError):
+                parse_rate(value)
+
+if __name__ == "__main__":
+    unittest.main()
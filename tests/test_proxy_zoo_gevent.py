@@ -11,7 +11,8 @@ from tridlcore.gen.ttypes import RequestContext
 from trpycore.zookeeper_gevent.client import GZookeeperClient
 from trpycore.zookeeper_gevent.util import expire_zookeeper_client_session
 from trsvcscore.proxy.base import ServiceProxyException
-from trsvcscore.proxy.zoo import ZookeeperServiceProxy
+from trsvcscore.proxy.zoo import ZookeeperServiceProxy, ZookeeperServiceProxyPool
+from trsvcscore.registrar.zoo import ZookeeperServiceRegistrar
 from trsvcscore.service_gevent.default import GDefaultService
 from trsvcscore.service_gevent.handler.service import GServiceHandler
 from trsvcscore.service_gevent.server.default import GThriftServer
@@ -70,6 +71,25 @@ class TestZookeeperProxy(unittest.TestCase):
         version = proxy.getVersion(self.request_context)
         self.assertEqual(version, "VERSION")
 
+    def test_proxy_pool(self):
+        pool = ZookeeperServiceProxyPool(
+                self.zookeeper_client,
+                self.service.info().name,
+                size=5,
+                is_gevent=True)
+
+        #verify all proxies share a single registry watch
+        registrar = ZookeeperServiceRegistrar.shared(self.zookeeper_client)
+        watch = registrar.registry_watches[self.service.info().name]
+        self.assertTrue(len(watch.observers) >= 5)
+        ZookeeperServiceRegistrar.release_shared(self.zookeeper_client)
+        
+        with pool.get() as proxy:
+            version = proxy.getVersion(self.request_context)
+            self.assertEqual(version, "VERSION")
+
+        pool.release()
+
 class TestZookeeperProxyServiceUnavailable(unittest.TestCase):
 
     @classmethod
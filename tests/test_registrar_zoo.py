@@ -1,4 +1,5 @@
 import logging
+import threading
 import unittest
 import time
 
@@ -8,7 +9,7 @@ from tridlcore.gen import TRService
 
 from trpycore.zookeeper.client import ZookeeperClient
 from trpycore.zookeeper.util import expire_zookeeper_client_session
-from trsvcscore.registrar.zoo import ZookeeperServiceRegistrar
+from trsvcscore.registrar.zoo import ZookeeperServiceRegistrar, ZookeeperServiceRegistryWatch
 from trsvcscore.service.default import DefaultService
 from trsvcscore.service.handler.service import ServiceHandler
 from trsvcscore.service.server.default import ThriftServer
@@ -133,6 +134,104 @@ class TestZookeeperServiceRegistrar(unittest.TestCase):
         self.assertEqual(service_info.default_endpoint().port, 10090)
         self.assertEqual(len(self.registrar.find_services("unittestsvc")), 1)
 
+    def test_registry_observer(self):
+        events = []
+        def observer(watch, event):
+            events.append(event)
+
+        watch = self.registrar.add_registry_observer("unittestsvc", observer)
+        services = watch.services()
+        self.assertEqual(len(services), 1)
+        self.assertEqual(services[0].name, "unittestsvc")
+
+        #verify unregistration and re-registration within the
+        #coalesce window are coalesced into a single event
+        self.registrar.unregister_service(self.service)
+        self.registrar.register_service(self.service)
+        self.registrar.unregister_service(self.service)
+        time.sleep(2)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(len(events[0].removed_services), 1)
+        self.assertEqual(len(events[0].added_services), 0)
+        self.assertEqual(len(watch.services()), 0)
+
+        #verify re-registration
+        self.registrar.register_service(self.service)
+        time.sleep(2)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(len(events[1].added_services), 1)
+        self.assertEqual(len(watch.services()), 1)
+
+        self.registrar.remove_registry_observer("unittestsvc", observer)
+        self.assertNotIn("unittestsvc", self.registrar.registry_watches)
+
+    def test_shared_registrar(self):
+        registrar = ZookeeperServiceRegistrar.shared(self.zookeeper_client)
+        self.assertIs(ZookeeperServiceRegistrar.shared(self.zookeeper_client), registrar)
+
+        def observer(watch, event):
+            pass
+        watch = registrar.add_registry_observer("unittestsvc", observer)
+        self.assertEqual(watch.running, True)
+
+        #verify the registrar is kept until all references are released
+        ZookeeperServiceRegistrar.release_shared(self.zookeeper_client)
+        self.assertEqual(watch.running, True)
+        self.assertIs(ZookeeperServiceRegistrar.shared(self.zookeeper_client), registrar)
+        ZookeeperServiceRegistrar.release_shared(self.zookeeper_client)
+        ZookeeperServiceRegistrar.release_shared(self.zookeeper_client)
+
+        #verify the last release closes the registrar
+        self.assertEqual(watch.running, False)
+        self.assertEqual(len(registrar.registry_watches), 0)
+        self.assertNotIn(self.zookeeper_client, ZookeeperServiceRegistrar._shared_registrars)
+
+        registrar = ZookeeperServiceRegistrar.shared(self.zookeeper_client)
+        self.assertEqual(len(registrar.registry_watches), 0)
+        ZookeeperServiceRegistrar.release_shared(self.zookeeper_client)
+
+    def test_registry_watch_update_serialized(self):
+        watch = ZookeeperServiceRegistryWatch(
+                self.zookeeper_client, "unittestsvc", coalesce_seconds=0)
+        watch.start()
+
+        #block the next registry read to hold an update in progress
+        read_children = watch._read_children
+        blocked = threading.Event()
+        unblock = threading.Event()
+        reads = []
+        active = []
+        def blocking_read_children():
+            active.append(1)
+            try:
+                reads.append(len(active))
+                if len(reads) == 1:
+                    blocked.set()
+                    unblock.wait(5)
+                return read_children()
+            finally:
+                active.pop()
+        watch._read_children = blocking_read_children
+
+        thread = threading.Thread(target=watch._update)
+        thread.start()
+        blocked.wait(5)
+
+        #fire watch events during the blocked update
+        watch._watch(None)
+        watch._watch(None)
+        self.assertEqual(len(reads), 1)
+
+        #verify the events are processed by a single update
+        #following the blocked update
+        unblock.set()
+        thread.join(5)
+        self.assertEqual(reads, [1, 1])
+        self.assertEqual(watch.updating, False)
+        self.assertEqual(watch.update_again, False)
+        self.assertEqual(len(watch.services()), 1)
+        watch.stop()
+
 
 
 class TestZookeeperServiceRegistrarSessionExpiration(unittest.TestCase):
@@ -135,6 +135,37 @@ class TestZookeeperServiceRegistrar(unittest.TestCase):
         self.assertEqual(service_info.default_endpoint().port, 10090)
         self.assertEqual(len(self.registrar.find_services("unittestsvc")), 1)
 
+    def test_registry_observer(self):
+        events = []
+        def observer(watch, event):
+            events.append(event)
+
+        watch = self.registrar.add_registry_observer("unittestsvc", observer)
+        services = watch.services()
+        self.assertEqual(len(services), 1)
+        self.assertEqual(services[0].name, "unittestsvc")
+
+        #verify unregistration and re-registration within the
+        #coalesce window are coalesced into a single event
+        self.registrar.unregister_service(self.service)
+        self.registrar.register_service(self.service)
+        self.registrar.unregister_service(self.service)
+        gevent.sleep(2)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(len(events[0].removed_services), 1)
+        self.assertEqual(len(events[0].added_services), 0)
+        self.assertEqual(len(watch.services()), 0)
+
+        #verify re-registration
+        self.registrar.register_service(self.service)
+        gevent.sleep(2)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(len(events[1].added_services), 1)
+        self.assertEqual(len(watch.services()), 1)
+
+        self.registrar.remove_registry_observer("unittestsvc", observer)
+        self.assertNotIn("unittestsvc", self.registrar.registry_watches)
+
 
 
 class TestZookeeperServiceRegistrarSessionExpiration(unittest.TestCase):
@@ -1,21 +1,28 @@
 import logging
 import time
 import unittest
+import urllib2
 
 import testbase
 
+from thrift.protocol import TBinaryProtocol, TCompactProtocol
+
 from tridlcore.gen import TRService
-from tridlcore.gen.ttypes import RequestContext
+from tridlcore.gen.ttypes import RequestContext, Status
 
 from trpycore.zookeeper.util import expire_zookeeper_client_session
 from trsvcscore.proxy.base import ServiceProxyException
+from trsvcscore.proxy.basic import BasicServiceProxy
 from trsvcscore.proxy.zoo import ZookeeperServiceProxy
 from trsvcscore.service.default import DefaultService
 from trsvcscore.service.handler.service import ServiceHandler
+from trsvcscore.service.server.base import ThriftProtocol, ThriftTransport
 from trsvcscore.service.server.default import ThriftServer
+from trsvcscore.service.server.metrics import MetricsServer
+from trsvcscore.thrift.admission import is_overloaded
 
 class UnittestService(DefaultService):
-    def __init__(self, port=10090):
+    def __init__(self, port=10090, metrics_port=None, **kwargs):
         self.handler = ServiceHandler(self, ["localdev:2181"])
         
         server = ThriftServer(
@@ -24,13 +31,22 @@ class UnittestService(DefaultService):
                 port=port,
                 handler=self.handler,
                 processor=TRService.Processor(self.handler),
-                threads=1)
+                threads=1,
+                **kwargs)
+        servers = [server]
+
+        if metrics_port is not None:
+            servers.append(MetricsServer(
+                name="unittestsvc-metrics",
+                interface="0.0.0.0",
+                port=metrics_port,
+                handler=self.handler))
         
         super(UnittestService, self).__init__(
                 name="unittestsvc",
                 version="VERSION",
                 build="BUILD",
-                servers=[server])
+                servers=servers)
 
 class TestService(unittest.TestCase):
 
@@ -65,6 +81,289 @@ class TestService(unittest.TestCase):
         version = proxy.getVersion(self.request_context)
         self.assertEqual(version, "VERSION")
 
+    def test_method_metrics(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name)
+
+        for i in range(10):
+            proxy.getVersion(self.request_context)
+
+        counters = proxy.getCounters(self.request_context)
+        self.assertGreaterEqual(counters["method_getVersion_requests"], 10)
+        self.assertEqual(counters["method_getVersion_errors"], 0)
+        self.assertLessEqual(
+                counters["method_getVersion_latency_p50_us"],
+                counters["method_getVersion_latency_max_us"])
+
+        details = proxy.getStatusDetails(self.request_context)
+        self.assertIn("getVersion: requests=", details)
+
+    def test_profiler(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name)
+
+        proxy.setOption(self.request_context, "profile.idle", "true")
+        proxy.setOption(self.request_context, "profile.enable", "true")
+        self.assertEqual(proxy.getOption(self.request_context, "profile.enable"), "true")
+        time.sleep(0.5)
+
+        proxy.setOption(self.request_context, "profile.enable", "false")
+        self.assertEqual(proxy.getOption(self.request_context, "profile.enable"), "false")
+
+        collapsed = proxy.getOption(self.request_context, "profile.collapsed")
+        self.assertTrue(collapsed)
+        for line in collapsed.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+
+    def test_protocol_negotiation(self):
+        endpoint = self.service.info().default_endpoint()
+        self.assertIn(ThriftProtocol.COMPACT, endpoint.thrift_protocols)
+        self.assertIn(ThriftTransport.FRAMED, endpoint.thrift_transports)
+
+        #negotiated protocol and transport
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name)
+        version = proxy.getVersion(self.request_context)
+        self.assertEqual(version, "VERSION")
+
+        #clients without negotiation
+        for protocol_class in [TBinaryProtocol.TBinaryProtocol, TCompactProtocol.TCompactProtocol]:
+            proxy = BasicServiceProxy(
+                    self.service.info().name,
+                    endpoint.address,
+                    endpoint.port,
+                    protocol_class=protocol_class)
+            version = proxy.getVersion(self.request_context)
+            self.assertEqual(version, "VERSION")
+
+class TestMultiplexedService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+        cls.service = UnittestService(multiplex=True)
+        cls.service.start()
+        time.sleep(1)
+
+        cls.zookeeper_client = cls.service.handler.zookeeper_client
+
+        cls.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.service.join()
+        cls.zookeeper_client.stop()
+        cls.zookeeper_client.join()
+    
+    def test_endpoint(self):
+        endpoint = self.service.info().default_endpoint()
+        self.assertEqual(endpoint.thrift_transports, [ThriftTransport.FRAMED])
+        self.assertIn(ThriftProtocol.BINARY, endpoint.thrift_protocols)
+        self.assertIn(ThriftProtocol.COMPACT, endpoint.thrift_protocols)
+
+    def test_connections(self):
+        #More keepalive connections than worker threads
+        proxies = []
+        for i in range(5):
+            proxy = ZookeeperServiceProxy(
+                    self.zookeeper_client,
+                    self.service.info().name,
+                    keepalive=True)
+            proxies.append(proxy)
+
+        for proxy in proxies:
+            version = proxy.getVersion(self.request_context)
+            self.assertEqual(version, "VERSION")
+
+        for proxy in proxies:
+            proxy.close_transport()
+            proxy.release()
+
+class TestPreforkService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+        cls.service = UnittestService(processes=2)
+        cls.service.start()
+        time.sleep(2)
+
+        cls.zookeeper_client = cls.service.handler.zookeeper_client
+
+        cls.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.service.join()
+        cls.zookeeper_client.stop()
+        cls.zookeeper_client.join()
+    
+    def test_counters(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name)
+
+        #Each request uses a new connection, which
+        #may be accepted by either worker.
+        for i in range(10):
+            version = proxy.getVersion(self.request_context)
+            self.assertEqual(version, "VERSION")
+
+        #Counters are aggregated across workers
+        counters = proxy.getCounters(self.request_context)
+        self.assertGreaterEqual(counters["requests"], 11)
+        self.assertGreaterEqual(self.service.handler.counters["requests"], 11)
+
+class TestElasticService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+        cls.service = UnittestService(max_threads=4)
+        cls.service.start()
+        time.sleep(1)
+
+        cls.zookeeper_client = cls.service.handler.zookeeper_client
+
+        cls.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.service.join()
+        cls.zookeeper_client.stop()
+        cls.zookeeper_client.join()
+    
+    def test_pool_growth(self):
+        #Keepalive connections each occupy a worker thread,
+        #so the pool must grow beyond its single thread.
+        proxies = []
+        for i in range(3):
+            proxy = ZookeeperServiceProxy(
+                    self.zookeeper_client,
+                    self.service.info().name,
+                    keepalive=True)
+            proxies.append(proxy)
+
+        for proxy in proxies:
+            version = proxy.getVersion(self.request_context)
+            self.assertEqual(version, "VERSION")
+
+        counters = proxies[0].getCounters(self.request_context)
+        self.assertGreaterEqual(counters["thrift_worker_threads"], 3)
+        self.assertLessEqual(counters["thrift_worker_threads"], 4)
+        self.assertIn("thrift_worker_queue_depth", counters)
+
+        for proxy in proxies:
+            proxy.close_transport()
+            proxy.release()
+
+class TestAdmissionControl(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+        #Admit no requests other than getStatus
+        cls.service = UnittestService(
+                max_in_flight=0,
+                exempt_methods=["getStatus"])
+        cls.service.start()
+        time.sleep(1)
+
+        cls.zookeeper_client = cls.service.handler.zookeeper_client
+
+        cls.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.service.join()
+        cls.zookeeper_client.stop()
+        cls.zookeeper_client.join()
+    
+    def test_load_shedding(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name)
+
+        with self.assertRaises(Exception) as context:
+            proxy.getVersion(self.request_context)
+        self.assertTrue(is_overloaded(context.exception))
+
+        #Exempt methods are always admitted
+        status = proxy.getStatus(self.request_context)
+        self.assertEqual(status, Status.ALIVE)
+
+        counters = self.service.handler.counters
+        self.assertEqual(counters["shed_requests"], 1)
+        self.assertEqual(counters["shed_requests_in_flight"], 1)
+
+class TestMetricsServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+        cls.service = UnittestService(metrics_port=10091)
+        cls.service.start()
+        time.sleep(1)
+
+        cls.zookeeper_client = cls.service.handler.zookeeper_client
+
+        cls.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.service.join()
+        cls.zookeeper_client.stop()
+        cls.zookeeper_client.join()
+    
+    def test_metrics(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name)
+        proxy.getVersion(self.request_context)
+
+        response = urllib2.urlopen("http://localhost:10091/metrics")
+        self.assertTrue(response.info()["Content-Type"].startswith("text/plain"))
+        lines = response.read().splitlines()
+        self.assertIn("# TYPE requests untyped", lines)
+        self.assertIn('service_method_errors_total{method="getVersion"} 0', lines)
+
+        with self.assertRaises(urllib2.HTTPError):
+            urllib2.urlopen("http://localhost:10091/unknown")
+
 class TestServiceUnavailable(unittest.TestCase):
 
     @classmethod
@@ -1,22 +1,29 @@
 import logging
 import unittest
+import urllib2
 
 import gevent
 
 import testbase
 
+from thrift.protocol import TBinaryProtocol, TCompactProtocol
+
 from tridlcore.gen import TRService
-from tridlcore.gen.ttypes import RequestContext
+from tridlcore.gen.ttypes import RequestContext, Status
 
 from trpycore.zookeeper_gevent.util import expire_zookeeper_client_session
 from trsvcscore.proxy.base import ServiceProxyException
+from trsvcscore.proxy.basic import BasicServiceProxy
 from trsvcscore.proxy.zoo import ZookeeperServiceProxy
+from trsvcscore.service.server.base import Backpressure, ThriftProtocol, ThriftTransport
 from trsvcscore.service_gevent.default import GDefaultService
 from trsvcscore.service_gevent.handler.service import GServiceHandler
 from trsvcscore.service_gevent.server.default import GThriftServer
+from trsvcscore.service_gevent.server.metrics import GMetricsServer
+from trsvcscore.thrift.admission import is_overloaded
 
 class UnittestService(GDefaultService):
-    def __init__(self, port=10090):
+    def __init__(self, port=10090, metrics_port=None, **kwargs):
         self.handler = GServiceHandler(self, ["localdev:2181"])
         
         server = GThriftServer(
@@ -25,13 +32,23 @@ class UnittestService(GDefaultService):
                 port=port,
                 handler=self.handler,
                 processor=TRService.Processor(self.handler),
-                address="localhost")
+                address="localhost",
+                **kwargs)
+        servers = [server]
+
+        if metrics_port is not None:
+            servers.append(GMetricsServer(
+                name="unittestsvc-metrics",
+                interface="0.0.0.0",
+                port=metrics_port,
+                handler=self.handler,
+                address="localhost"))
         
         super(UnittestService, self).__init__(
                 name="unittestsvc",
                 version="VERSION",
                 build="BUILD",
-                servers=[server],
+                servers=servers,
                 hostname="localhost")
 
 class TestService(unittest.TestCase):
@@ -68,6 +85,196 @@ class TestService(unittest.TestCase):
         version = proxy.getVersion(self.request_context)
         self.assertEqual(version, "VERSION")
 
+    def test_method_metrics(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name,
+                is_gevent=True)
+
+        for i in range(10):
+            proxy.getVersion(self.request_context)
+
+        counters = proxy.getCounters(self.request_context)
+        self.assertGreaterEqual(counters["method_getVersion_requests"], 10)
+        self.assertEqual(counters["method_getVersion_errors"], 0)
+        self.assertLessEqual(
+                counters["method_getVersion_latency_p50_us"],
+                counters["method_getVersion_latency_max_us"])
+
+        details = proxy.getStatusDetails(self.request_context)
+        self.assertIn("getVersion: requests=", details)
+
+    def test_profiler(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name,
+                is_gevent=True)
+
+        proxy.setOption(self.request_context, "profile.idle", "true")
+        proxy.setOption(self.request_context, "profile.enable", "true")
+        self.assertEqual(proxy.getOption(self.request_context, "profile.enable"), "true")
+        gevent.sleep(0.5)
+
+        proxy.setOption(self.request_context, "profile.enable", "false")
+        self.assertEqual(proxy.getOption(self.request_context, "profile.enable"), "false")
+
+        collapsed = proxy.getOption(self.request_context, "profile.collapsed")
+        self.assertTrue(collapsed)
+        for line in collapsed.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+
+    def test_protocol_negotiation(self):
+        endpoint = self.service.info().default_endpoint()
+        self.assertIn(ThriftProtocol.COMPACT, endpoint.thrift_protocols)
+        self.assertIn(ThriftTransport.FRAMED, endpoint.thrift_transports)
+
+        #negotiated protocol and transport
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name)
+        version = proxy.getVersion(self.request_context)
+        self.assertEqual(version, "VERSION")
+
+        #clients without negotiation
+        for protocol_class in [TBinaryProtocol.TBinaryProtocol, TCompactProtocol.TCompactProtocol]:
+            proxy = BasicServiceProxy(
+                    self.service.info().name,
+                    endpoint.address,
+                    endpoint.port,
+                    protocol_class=protocol_class,
+                    is_gevent=True)
+            version = proxy.getVersion(self.request_context)
+            self.assertEqual(version, "VERSION")
+
+class TestAdmissionControl(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+        #Admit no requests other than getStatus
+        cls.service = UnittestService(
+                max_in_flight=0,
+                exempt_methods=["getStatus"])
+        cls.service.start()
+        gevent.sleep(1)
+
+        cls.zookeeper_client = cls.service.handler.zookeeper_client
+
+        cls.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.service.join()
+        cls.zookeeper_client.stop()
+        cls.zookeeper_client.join()
+    
+    def test_load_shedding(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name)
+
+        with self.assertRaises(Exception) as context:
+            proxy.getVersion(self.request_context)
+        self.assertTrue(is_overloaded(context.exception))
+
+        #Exempt methods are always admitted
+        status = proxy.getStatus(self.request_context)
+        self.assertEqual(status, Status.ALIVE)
+
+        counters = self.service.handler.counters
+        self.assertEqual(counters["shed_requests"], 1)
+        self.assertEqual(counters["shed_requests_in_flight"], 1)
+
+class TestConnectionPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+        cls.service = UnittestService(
+                pool_size=2,
+                backpressure=Backpressure.REJECT)
+        cls.service.start()
+        gevent.sleep(1)
+
+        cls.zookeeper_client = cls.service.handler.zookeeper_client
+
+        cls.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.service.join()
+        cls.zookeeper_client.stop()
+        cls.zookeeper_client.join()
+    
+    def test_pool_occupancy(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name,
+                is_gevent=True)
+
+        version = proxy.getVersion(self.request_context)
+        self.assertEqual(version, "VERSION")
+
+        counters = proxy.getCounters(self.request_context)
+        self.assertEqual(counters["thrift_pool_size"], 2)
+        self.assertGreaterEqual(counters["thrift_pool_occupancy"], 1)
+        self.assertEqual(
+                counters["thrift_pool_occupancy"] + counters["thrift_pool_free"], 2)
+
+class TestMetricsServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        logging.basicConfig(level=logging.DEBUG)
+
+        cls.service = UnittestService(metrics_port=10091)
+        cls.service.start()
+        gevent.sleep(1)
+
+        cls.zookeeper_client = cls.service.handler.zookeeper_client
+
+        cls.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.service.join()
+        cls.zookeeper_client.stop()
+        cls.zookeeper_client.join()
+    
+    def test_metrics(self):
+        proxy = ZookeeperServiceProxy(
+                self.zookeeper_client,
+                self.service.info().name,
+                is_gevent=True)
+        proxy.getVersion(self.request_context)
+
+        response = urllib2.urlopen("http://localhost:10091/metrics")
+        self.assertTrue(response.info()["Content-Type"].startswith("text/plain"))
+        lines = response.read().splitlines()
+        self.assertIn("# TYPE requests untyped", lines)
+        self.assertIn('service_method_errors_total{method="getVersion"} 0', lines)
+
+        with self.assertRaises(urllib2.HTTPError):
+            urllib2.urlopen("http://localhost:10091/unknown")
+
 class TestServiceUnavailable(unittest.TestCase):
 
     @classmethod
@@ -0,0 +1,179 @@
+import json
+import os
+import random
+import socket
+import tempfile
+import time
+import unittest
+
+import testbase
+
+from tridlcore.gen.ttypes import RequestContext
+
+from trsvcscore.metrics.timing import begin_request, end_request
+from trsvcscore.tracing.exporter import FileSpanSink, SpanExporter, UdpSpanSink
+from trsvcscore.tracing.tracer import Tracer, extract, inject, new_id, parse_sample_rate, set_tracer, traced_call
+
+class ListSpanSink(object):
+    def __init__(self):
+        self.spans = []
+
+    def send(self, spans):
+        self.spans.extend(spans)
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.request_context = RequestContext(
+                userId=0,
+                impersonatingUserId=0,
+                sessionId="dummy_session_id",
+                context="application_context")
+
+    def tearDown(self):
+        set_tracer(None)
+
+    def test_propagation(self):
+        tracer = Tracer("unittestsvc", SpanExporter(ListSpanSink()), sample_rate=1.0)
+        span = tracer.start_span("getVersion", "client")
+        self.assertTrue(span.sampled)
+
+        context = inject(self.request_context, span.context)
+        self.assertEqual(self.request_context.context, "application_context")
+
+        context, span_context = extract(context)
+        self.assertEqual(context.context, "application_context")
+        self.assertEqual(span_context.trace_id, span.trace_id)
+        self.assertEqual(span_context.span_id, span.span_id)
+        self.assertTrue(span_context.sampled)
+
+        #Contexts without trace headers are returned as is
+        context, span_context = extract(self.request_context)
+        self.assertIs(context, self.request_context)
+        self.assertIsNone(span_context)
+
+    def test_sampling(self):
+        sink = ListSpanSink()
+        exporter = SpanExporter(sink)
+        tracer = Tracer("unittestsvc", exporter, sample_rate=0.0)
+
+        #Sampling decisions are inherited from the parent
+        parent = tracer.start_span("getVersion", "server")
+        self.assertFalse(parent.sampled)
+        child = tracer.start_span("getStatus", "client", parent)
+        self.assertFalse(child.sampled)
+        self.assertEqual(child.trace_id, parent.trace_id)
+        self.assertEqual(child.parent_id, parent.span_id)
+        child.finish()
+        parent.finish()
+
+        tracer.sample_rate = 1.0
+        tracer.start_span("getVersion", "server").finish(error=True)
+
+        exporter.flush()
+        self.assertEqual(len(sink.spans), 1)
+        self.assertTrue(sink.spans[0]["error"])
+        self.assertEqual(sink.spans[0]["service"], "unittestsvc")
+
+    def test_traced_call(self):
+        sink = ListSpanSink()
+        exporter = SpanExporter(sink)
+        tracer = Tracer("unittestsvc", exporter, sample_rate=1.0)
+        set_tracer(tracer)
+
+        contexts = []
+        def getVersion(request_context):
+            contexts.append(request_context)
+            return "VERSION"
+
+        #Client spans are children of the current server span
+        timing = begin_request("getVersion", self.request_context)
+        timing.span = tracer.start_span("getVersion", "server")
+        result = traced_call("getVersion", getVersion, (self.request_context,), {})
+        end_request(timing)
+        timing.span.finish()
+
+        self.assertEqual(result, "VERSION")
+        context, span_context = extract(contexts[0])
+        self.assertEqual(context.context, "application_context")
+
+        exporter.flush()
+        client, server = sink.spans
+        self.assertEqual(client["kind"], "client")
+        self.assertEqual(client["id"], span_context.span_id)
+        self.assertEqual(client["parentId"], server["id"])
+        self.assertEqual(client["traceId"], server["traceId"])
+
+    def test_after_fork(self):
+        tracer = Tracer("unittestsvc", SpanExporter(ListSpanSink()), sample_rate=0.5)
+
+        #Ids and sampling decisions differ between forked processes
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read_fd)
+                tracer.after_fork()
+                os.write(write_fd, json.dumps([new_id(), random.random()]))
+            finally:
+                os._exit(0)
+
+        os.close(write_fd)
+        child_id, child_random = json.loads(os.read(read_fd, 1024))
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(len(child_id), 16)
+        self.assertNotEqual(child_id, new_id())
+        self.assertNotEqual(child_random, random.random())
+
+    def test_parse_sample_rate(self):
+        self.assertEqual(parse_sample_rate("0.25"), 0.25)
+        self.assertEqual(parse_sample_rate("1"), 1.0)
+        for value in ["", "none", "-0.1", "1.5", "nan", None]:
+            with self.assertRaises(ValueError):
+                parse_sample_rate(value)
+
+class TestSpanExporter(unittest.TestCase):
+
+    def test_file_sink(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            exporter = SpanExporter(FileSpanSink(path), batch_size=2, flush_interval=0.1)
+            exporter.start()
+            for i in range(5):
+                exporter.export({"id": i})
+            time.sleep(0.5)
+            exporter.stop()
+            exporter.join()
+
+            with open(path) as output:
+                spans = [json.loads(line) for line in output]
+            self.assertEqual([span["id"] for span in spans], range(5))
+            self.assertEqual(exporter.exported, 5)
+        finally:
+            os.remove(path)
+
+    def test_udp_sink(self):
+        collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        collector.bind(("127.0.0.1", 0))
+        collector.settimeout(1)
+        try:
+            sink = UdpSpanSink("127.0.0.1", collector.getsockname()[1], max_datagram_size=15)
+            sink.send([{"id": 1}, {"id": 2}])
+
+            #Spans exceeding max_datagram_size are sent separately
+            self.assertEqual(json.loads(collector.recv(65536)), {"id": 1})
+            self.assertEqual(json.loads(collector.recv(65536)), {"id": 2})
+        finally:
+            collector.close()
+
+    def test_dropped(self):
+        exporter = SpanExporter(ListSpanSink(), max_queue_size=2)
+        for i in range(3):
+            exporter.export({"id": i})
+        self.assertEqual(exporter.dropped, 1)
+
+if __name__ == "__main__":
+    unittest.main()
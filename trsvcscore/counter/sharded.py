@@ -0,0 +1,153 @@
+import threading
+import weakref
+
+class _ShardOwner(object):
+    """Thread local reference to a counter shard.
+
+    When the owning thread exits, its thread local data is
+    released, and the shard is retired via weakref callback.
+    """
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class ShardedCounter(object):
+    """Counter sharded by thread.
+
+    Each thread updates its own shard without locking, since only
+    the owning thread writes to a shard. Reading the counter sums
+    all shards. Shards of exited threads are folded into a retired
+    total, so memory is bounded by the number of live threads.
+
+    If threading has been monkey patched by gevent, shards
+    are per greenlet.
+    """
+
+    def __init__(self):
+        """ShardedCounter constructor."""
+        self.local = threading.local()
+        #Reentrant, since shards may be retired by garbage
+        #collection while the lock is held.
+        self.lock = threading.RLock()
+        self.shards = []
+        self.owners = {}
+        self.retired = 0
+
+    @property
+    def value(self):
+        """Counter total across all shards."""
+        with self.lock:
+            return self.retired + sum([shard[0] for shard in self.shards])
+
+    def get(self):
+        """Get counter total across all shards.
+
+        Returns:
+            counter total
+        """
+        return self.value
+
+    def increment(self, value=1):
+        """Increment the current thread's shard.
+
+        Args:
+            value: increment amount
+        """
+        try:
+            self.local.owner.shard[0] += value
+        except AttributeError:
+            self._create_shard()[0] += value
+
+    def decrement(self, value=1):
+        """Decrement the current thread's shard.
+
+        Args:
+            value: decrement amount
+        """
+        try:
+            self.local.owner.shard[0] -= value
+        except AttributeError:
+            self._create_shard()[0] -= value
+
+    def _create_shard(self):
+        """Create shard for the current thread.
+
+        Returns:
+            shard, a single element list containing
+            the thread's value.
+        """
+        shard = [0]
+        owner = _ShardOwner(shard)
+        with self.lock:
+            self.shards.append(shard)
+            self.owners[id(shard)] = weakref.ref(owner,
+                    lambda ref, shard=shard: self._retire(shard))
+        self.local.owner = owner
+        return shard
+
+    def _retire(self, shard):
+        """Fold the shard of an exited thread into the retired total.
+
+        Args:
+            shard: shard to retire
+        """
+        with self.lock:
+            self.retired += shard[0]
+            self.shards.remove(shard)
+            del self.owners[id(shard)]
+
+
+class ShardedCounters(object):
+    """Counters sharded by thread.
+
+    Drop-in replacement for AtomicCounters which does not take a
+    lock when counters are updated, so that worker threads do not
+    contend with one another on hot paths such as service method
+    calls. Counters are summed across threads when read.
+
+    Example usage:
+        counters = ShardedCounters()
+        counters.get_counter("requests").increment()
+        counters.as_dict()
+    """
+
+    def __init__(self):
+        """ShardedCounters constructor."""
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get_counter(self, name):
+        """Get counter, creating it if needed.
+
+        Args:
+            name: counter name
+        Returns:
+            ShardedCounter object
+        """
+        counter = self.counters.get(name)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.get(name)
+                if counter is None:
+                    counter = ShardedCounter()
+                    self.counters[name] = counter
+        return counter
+
+    def as_dict(self):
+        """Get counter totals.
+
+        Returns:
+            dict of counter name to total.
+        """
+        result = {}
+        for name, counter in self.counters.items():
+            result[name] = counter.value
+        return result
+
+    def __contains__(self, name):
+        return name in self.counters
+
+    def __getitem__(self, name):
+        return self.counters[name].value
@@ -0,0 +1,206 @@
+import ctypes
+import multiprocessing
+import threading
+
+class SharedCounter(object):
+    """Counter stored in shared memory.
+
+    Each process updates its own value, and reading the
+    counter returns the total across all processes.
+    """
+
+    def __init__(self, counters, slot):
+        """SharedCounter constructor.
+
+        Args:
+            counters: SharedCounters object
+            slot: counter slot index
+        """
+        self.counters = counters
+        self.slot = slot
+
+    @property
+    def value(self):
+        """Counter total across all processes."""
+        return self.counters._total(self.slot)
+
+    def get(self):
+        """Get counter total across all processes.
+
+        Returns:
+            counter total
+        """
+        return self.value
+
+    def increment(self, value=1):
+        """Increment the current process's counter value.
+
+        Args:
+            value: increment amount
+        """
+        self.counters._add(self.slot, value)
+
+    def decrement(self, value=1):
+        """Decrement the current process's counter value.
+
+        Args:
+            value: decrement amount
+        """
+        self.counters._add(self.slot, -value)
+
+
+class SharedCounters(object):
+    """Counters shared across forked processes.
+
+    Counter values are stored in anonymous shared memory allocated
+    before forking, with one row of values per process, so that
+    processes never contend with one another when updating
+    counters. Reading a counter sums its values across all
+    processes.
+
+    SharedCounters must be created in the parent process, and each
+    forked process must call set_process_index() with a unique
+    index before updating counters. The parent process uses
+    index 0 by default.
+
+    Example usage:
+        counters = SharedCounters(processes=5)
+        #fork
+        counters.set_process_index(worker_index + 1)
+        counters.get_counter("requests").increment()
+        counters.as_dict()
+    """
+
+    def __init__(self, processes, max_counters=256, max_name_length=64):
+        """SharedCounters constructor.
+
+        Args:
+            processes: maximum number of processes, including the parent.
+            max_counters: maximum number of distinct counters
+            max_name_length: maximum counter name length
+        """
+        self.processes = processes
+        self.max_counters = max_counters
+        self.max_name_length = max_name_length
+        self.process_index = 0
+
+        #Shared counter name table, protected by the cross-process lock.
+        self.lock = multiprocessing.Lock()
+        self.count = multiprocessing.RawValue(ctypes.c_int, 0)
+        self.names = multiprocessing.RawArray(ctypes.c_char, max_counters * max_name_length)
+
+        #Shared counter values, one row per process. Each row is
+        #only updated by its process, so the local lock suffices.
+        self.values = multiprocessing.RawArray(ctypes.c_longlong, processes * max_counters)
+        self.local_lock = threading.Lock()
+
+        #Process local cache of counter name to slot
+        self.slots = {}
+
+    def set_process_index(self, index):
+        """Set the current process's index.
+
+        This must be called in each forked process prior to
+        updating counters.
+
+        Args:
+            index: unique process index less than processes.
+        """
+        if index < 0 or index >= self.processes:
+            raise ValueError("invalid process index (%d)" % index)
+        self.process_index = index
+
+    def get_counter(self, name):
+        """Get counter, creating it if needed.
+
+        Args:
+            name: counter name
+        Returns:
+            SharedCounter object
+        Raises:
+            ValueError if the name is too long, or RuntimeError
+            if max_counters has been reached.
+        """
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self._get_slot(name, create=True)
+        return SharedCounter(self, slot)
+
+    def as_dict(self):
+        """Get counter totals across all processes.
+
+        Returns:
+            dict of counter name to total.
+        """
+        self._refresh_slots()
+        result = {}
+        for name, slot in self.slots.items():
+            result[name] = self._total(slot)
+        return result
+
+    def __contains__(self, name):
+        return self._get_slot(name) is not None
+
+    def __getitem__(self, name):
+        slot = self._get_slot(name)
+        if slot is None:
+            raise KeyError(name)
+        return self._total(slot)
+
+    def _name(self, slot):
+        """Get counter name from the shared name table."""
+        start = slot * self.max_name_length
+        return self.names[start:start + self.max_name_length].rstrip("\0")
+
+    def _refresh_slots(self):
+        """Update local slot cache from the shared name table."""
+        for slot in range(len(self.slots), self.count.value):
+            self.slots[self._name(slot)] = slot
+
+    def _get_slot(self, name, create=False):
+        """Get counter slot.
+
+        Args:
+            name: counter name
+            create: if True, the counter will be added to the
+                shared name table if it does not exist.
+        Returns:
+            slot index, or None if counter does not exist
+            and create is False.
+        """
+        slot = self.slots.get(name)
+        if slot is None:
+            self._refresh_slots()
+            slot = self.slots.get(name)
+        if slot is not None or not create:
+            return slot
+
+        if len(name) > self.max_name_length:
+            raise ValueError("counter name too long (%s)" % name)
+
+        with self.lock:
+            self._refresh_slots()
+            slot = self.slots.get(name)
+            if slot is None:
+                slot = self.count.value
+                if slot >= self.max_counters:
+                    raise RuntimeError("max counters exceeded (%d)" % self.max_counters)
+                start = slot * self.max_name_length
+                self.names[start:start + self.max_name_length] = \
+                        name.ljust(self.max_name_length, "\0")
+                self.count.value = slot + 1
+                self.slots[name] = slot
+        return slot
+
+    def _add(self, slot, value):
+        """Add value to the current process's counter value."""
+        index = self.process_index * self.max_counters + slot
+        with self.local_lock:
+            self.values[index] += value
+
+    def _total(self, slot):
+        """Get counter total across all processes."""
+        total = 0
+        for index in range(slot, len(self.values), self.max_counters):
+            total += self.values[index]
+        return total
@@ -0,0 +1,56 @@
+import time
+import weakref
+
+from sqlalchemy import event
+
+from trsvcscore.metrics.timing import add_time
+
+#Map of engine to list of statement observers
+_observers = weakref.WeakKeyDictionary()
+
+def _before_cursor_execute(connection, cursor, statement,
+        parameters, context, executemany):
+    #Statements on a connection never nest, so a single start time
+    #is kept. after_cursor_execute is not invoked for statements
+    #which raise, whose start time is replaced by the next statement.
+    connection.info["statement_start"] = time.time()
+
+def _after_cursor_execute(connection, cursor, statement,
+        parameters, context, executemany):
+    start = connection.info.pop("statement_start", None)
+    if start is not None:
+        seconds = time.time() - start
+        for observer in _observers.get(connection.engine, []):
+            observer(statement, seconds)
+
+def add_statement_observer(engine, observer):
+    """Add observer of statements executed by engine.
+
+    A single pair of event listeners is added to each engine,
+    regardless of the number of observers.
+
+    Args:
+        engine: SQLAlchemy engine
+        observer: method taking the statement, and the time in
+            seconds taken to execute it.
+    """
+    observers = _observers.get(engine)
+    if observers is None:
+        observers = _observers[engine] = []
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    observers.append(observer)
+
+def _add_db_time(statement, seconds):
+    add_time("db", seconds)
+
+def instrument_engine(engine):
+    """Instrument SQLAlchemy engine.
+
+    Time spent executing statements is added to the current
+    service request's timing in the "db" category.
+
+    Args:
+        engine: SQLAlchemy engine
+    """
+    add_statement_observer(engine, _add_db_time)
@@ -1,8 +1,11 @@
 import logging
+import select
 import threading
 import Queue
 
-from sqlalchemy.sql import func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import and_, case, func
+from sqlalchemy.sql.expression import Select
 
 from trpycore.timezone import tz
 
@@ -18,6 +21,77 @@ class JobOwned(Exception):
     """Job owned exception."""
     pass
 
+class JobDeferred(Exception):
+    """Job deferred exception.
+
+    Raised within the scope of the DatabaseJob context manager
+    to release the job, rather than abort it, so that it may be
+    started again.
+    """
+    pass
+
+class _SkipLockedSelect(Select):
+    """SELECT ... FOR UPDATE SKIP LOCKED.
+
+    Rows locked by other transactions are skipped rather than
+    waited for. SKIP LOCKED requires PostgreSQL 9.5 or later.
+    Other dialects fall back to their FOR UPDATE, if any.
+    """
+    pass
+
+@compiles(_SkipLockedSelect)
+def _compile_select(element, compiler, **kwargs):
+    return compiler.visit_select(element, **kwargs)
+
+@compiles(_SkipLockedSelect, "postgresql")
+def _compile_skip_locked_select(element, compiler, **kwargs):
+    return "%s SKIP LOCKED" % compiler.visit_select(element, **kwargs)
+
+
+def notify_jobs(db_session, channel, payload=""):
+    """Notify job queues listening on channel of new jobs.
+
+    The notification is delivered when db_session is committed,
+    so it should be sent in the transaction adding the jobs.
+
+    Args:
+        db_session: SQLAlchemy session
+        channel: PostgreSQL notification channel name
+        payload: optional notification payload string
+    """
+    db_session.execute("SELECT pg_notify(:channel, :payload)",
+            {"channel": channel, "payload": payload})
+
+def create_notify_trigger(db_session, model_class, channel):
+    """Create trigger notifying channel of inserted jobs.
+
+    Once created, job queues listening on channel are notified of
+    jobs inserted by any client, without the need for notify_jobs().
+    The trigger, and its function, are named <table>_notify, and
+    replaced if they already exist.
+
+    Args:
+        db_session: SQLAlchemy session
+        model_class: SQLAlchemy database model class
+        channel: PostgreSQL notification channel name
+    """
+    table = model_class.__tablename__
+    db_session.execute("""
+        CREATE OR REPLACE FUNCTION {0}_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{1}', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """.format(table, channel.replace("'", "''")))
+    db_session.execute("DROP TRIGGER IF EXISTS {0}_notify ON {0}".format(table))
+    db_session.execute("""
+        CREATE TRIGGER {0}_notify AFTER INSERT ON {0}
+        FOR EACH STATEMENT EXECUTE PROCEDURE {0}_notify()
+        """.format(table))
+    db_session.commit()
+
+
 class DatabaseJob(object):
     """Database job class.
 
@@ -31,7 +105,9 @@ class DatabaseJob(object):
     Upon exiting the context manager the model is update with
     the values returned from self._end_update_values(),
     if not exception is raised during processed, or
-    self._abort_update_values() otherwise.
+    self._abort_update_values() otherwise. If JobDeferred
+    is raised, the values set on enter are cleared instead,
+    releasing the job, and the exception is propagated.
 
     This class is easily designed to be customized for various tables
     by subclassing and extending self._start_update_values(),
@@ -54,7 +130,8 @@ class DatabaseJob(object):
     See DatabaseJobQueue for usage examples.
     """
 
-    def __init__(self, owner, model_class, model_id,  db_session_factory):
+    def __init__(self, owner, model_class, model_id,  db_session_factory,
+            claimed=False):
         """DatabaseJob constructor.
 
         Args:
@@ -66,10 +143,14 @@ class DatabaseJob(object):
             db_session_factory: SQLAlchemy database session factory
                 in the form of a method requiring no parameters and
                 returning an instance of a SQLAlchemy session.
+            claimed: if True, the job was already claimed for owner,
+                i.e. by DatabaseJobQueue in claim mode, and the
+                start update values were already applied.
         """
         self.owner = owner
         self.model_class = model_class
         self.model_id = model_id
+        self.claimed = claimed
         self.model = None
         self.db_session_factory = db_session_factory
         self.db_session = None
@@ -102,7 +183,9 @@ class DatabaseJob(object):
                 within the scope of the context manager, None otherwise.
         """
         try:
-            if exc_type is not None:
+            if exc_type is not None and issubclass(exc_type, JobDeferred):
+                self._release()
+            elif exc_type is not None:
                 self._abort()
             else:
                 self._end()
@@ -190,16 +273,17 @@ class DatabaseJob(object):
 
     def _start(self):
         """Start database job."""
-        # This query.update generates the following sql:
-        # UPDATE <table> SET owner='<owner>' WHERE
-        # <table>.id = <id> AND <table>.owner IS NULL
-        rows_updated = self._start_query(self.db_session).\
-            update(self._start_update_values())
-
-        if not rows_updated:
-            raise JobOwned("%s(id=%s) already owned") % (self.model_class, self.model_id)
-        
-        self.db_session.commit()
+        if not self.claimed:
+            # This query.update generates the following sql:
+            # UPDATE <table> SET owner='<owner>' WHERE
+            # <table>.id = <id> AND <table>.owner IS NULL
+            rows_updated = self._start_query(self.db_session).\
+                update(self._start_update_values())
+
+            if not rows_updated:
+                raise JobOwned("%s(id=%s) already owned" % (self.model_class, self.model_id))
+            
+            self.db_session.commit()
 
         model = self.db_session.query(self.model_class)\
                 .get(self.model_id)
@@ -227,6 +311,166 @@ class DatabaseJob(object):
                 setattr(self.model, attribute, value)
         self.db_session.commit()
 
+    def _release(self):
+        """Release database job, so that it may be started again."""
+        for attribute in self._start_update_values():
+            if hasattr(self.model_class, attribute):
+                setattr(self.model, attribute, None)
+        self.db_session.commit()
+
+
+class DatabaseJobBatch(object):
+    """Database job batch class.
+
+    DatabaseJobBatch is a context manager for processing a batch of
+    jobs, claimed by DatabaseJobQueue.get_batch(), with a constant
+    number of database round trips per batch rather than per job.
+
+    Upon entering the context manager, the batch's jobs are loaded
+    with a single query, and returned as a list of detached models.
+    Upon exiting the context manager, all jobs are updated with a
+    single statement, with each job's outcome determined as follows:
+        Marked with succeeded() or failed(): the marked outcome.
+        Not marked, and no exception raised: successful.
+        Not marked, and exception raised: failed.
+
+    Update values are those of the db_job_class, i.e. DatabaseJob's
+    _end_update_values() and _abort_update_values().
+
+    Example usage:
+        with db_queue.get_batch(100) as batch:
+            for job in batch.jobs:
+                try:
+                    process(job)
+                except Exception:
+                    batch.failed(job)
+    """
+
+    def __init__(self, owner, model_class, model_ids, db_session_factory,
+            db_job_class=None):
+        """DatabaseJobBatch constructor.
+
+        Args:
+            owner: string identifying the owner of the claimed jobs.
+            model_class: SQLAlchemy database model class
+            model_ids: list of claimed model primary keys
+            db_session_factory: SQLAlchemy database session factory
+            db_job_class: optional database job class determining
+                update values. Defaults to DatabaseJob.
+        """
+        self.owner = owner
+        self.model_class = model_class
+        self.model_ids = model_ids
+        self.db_session_factory = db_session_factory
+        self.db_job_class = db_job_class or DatabaseJob
+        self.jobs = []
+        self.outcomes = {}
+
+    def __enter__(self):
+        """Context manager enter method.
+
+        Returns:
+            self, with jobs loaded.
+        """
+        if self.model_ids:
+            db_session = self.db_session_factory()
+            try:
+                self.jobs = db_session.query(self.model_class)\
+                        .filter(self.model_class.id.in_(self.model_ids))\
+                        .order_by(self.model_class.id)\
+                        .all()
+                db_session.expunge_all()
+                db_session.commit()
+            finally:
+                db_session.close()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Context manager exit method.
+
+        Args:
+            exc_type: exception type if an exception was raised
+                within the scope of the context manager, None otherwise.
+            exc_value: exception value if an exception was raised
+                within the scope of the context manager, None otherwise.
+            traceback: exception traceback if an exception was raised
+                within the scope of the context manager, None otherwise.
+        """
+        if not self.model_ids:
+            return
+
+        default = exc_type is None
+        successful_ids = [model_id for model_id in self.model_ids
+                if self.outcomes.get(model_id, default)]
+
+        db_session = self.db_session_factory()
+        try:
+            self._end(db_session, successful_ids)
+            db_session.commit()
+        except:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+
+    def _end(self, db_session, successful_ids):
+        """End database jobs.
+
+        Args:
+            db_session: SQLAlchemy session
+            successful_ids: ids of successful jobs
+        """
+        table = self.model_class.__table__
+        db_job = self.db_job_class(
+                owner=self.owner,
+                model_class=self.model_class,
+                model_id=None,
+                db_session_factory=self.db_session_factory)
+
+        if len(successful_ids) == len(self.model_ids):
+            values = db_job._end_update_values()
+        elif not successful_ids:
+            values = db_job._abort_update_values()
+        else:
+            #Values which differ by outcome are set per row, i.e.
+            #SET successful = CASE WHEN id IN (<successful ids>)
+            #THEN true ELSE false END
+            end_values = db_job._end_update_values()
+            abort_values = db_job._abort_update_values()
+            values = {}
+            for name in set(end_values) | set(abort_values):
+                end_value = end_values.get(name)
+                abort_value = abort_values.get(name)
+                if str(end_value) == str(abort_value):
+                    values[name] = end_value
+                else:
+                    values[name] = case(
+                            [(table.c.id.in_(successful_ids), end_value)],
+                            else_=abort_value)
+
+        values = dict((name, value) for name, value in values.items()
+                if hasattr(self.model_class, name))
+        if values:
+            db_session.execute(table.update()\
+                    .where(table.c.id.in_(self.model_ids))\
+                    .values(**values))
+
+    def succeeded(self, job):
+        """Mark job successful.
+
+        Args:
+            job: job model
+        """
+        self.outcomes[job.id] = True
+
+    def failed(self, job):
+        """Mark job failed.
+
+        Args:
+            job: job model
+        """
+        self.outcomes[job.id] = False
+
 
 class DatabaseJobQueue(object):
     """Database job queue.
@@ -250,6 +494,26 @@ class DatabaseJobQueue(object):
     DatabaseJobQueue through the db_job_class constructor
     argument.
 
+    By default, every consumer races to claim each polled job when
+    entering the DatabaseJob context manager, and all but one fail
+    with JobOwned. In claim mode, enabled through claim_batch_size,
+    each poll instead claims a batch of jobs with a single statement:
+        UPDATE <table> SET owner='<owner>', ... WHERE id IN
+        (SELECT id FROM <table> WHERE <poll filters> ORDER BY priority
+        LIMIT <n> FOR UPDATE SKIP LOCKED) RETURNING id
+    so concurrent queues claim disjoint jobs without waiting on each
+    other, and only jobs owned by this queue are returned by get().
+    Claimed jobs which have not been returned by get() when the
+    queue is stopped are released.
+
+    Jobs may be polled for as soon as they are added, rather than
+    waiting up to poll_seconds, by providing a PostgreSQL notification
+    channel through notify_channel. The queue will LISTEN on the
+    channel, and poll for new jobs upon each notification, so
+    poll_seconds only serves as a safety net, i.e. for missed
+    notifications. Notifications are sent by notify_jobs(), or
+    by a trigger created with create_notify_trigger().
+
     Example usage:
         db_queue = DatabaseJobQueue(
             owner="archivesvc",
@@ -273,17 +537,33 @@ class DatabaseJobQueue(object):
             except Exception:
                 #failure during processing.
                 #handle error and possibly create new job in db to retry.
+
+    See trsvcscore.db.runner.DatabaseJobRunner, which runs this
+    loop with multiple workers.
     """
     
     #Stop item to signal to blocked waiters that the queue is being stopped.
     STOP_ITEM = object()
 
+    #Jobs queued locally per consumer, if consumers is provided
+    PREFETCH_PER_CONSUMER = 2
+
+    #Seconds to wait for notifications before checking for stop()
+    LISTEN_TIMEOUT = 1
+
+    #Seconds to wait before reconnecting the notification listener
+    LISTEN_RETRY_SECONDS = 5
+
     def __init__(self,
             owner,
             model_class,
             db_session_factory,
             poll_seconds=60,
-            db_job_class=None):
+            db_job_class=None,
+            db_poll_session_factory=None,
+            claim_batch_size=None,
+            notify_channel=None,
+            consumers=None):
         """DatabaseJobQueue constructor.
 
         Args:
@@ -300,16 +580,47 @@ class DatabaseJobQueue(object):
             db_job_class: optional database job class to wrap job
                 model in prior to returning it. If not specified
                 this defaults to DatabaseJob.
+            db_poll_session_factory: optional SQLAlchemy database
+                session factory used to poll for new jobs, i.e. one
+                returning read replica sessions. Jobs are always
+                claimed through db_session_factory, so jobs found
+                through a lagging replica which are already owned
+                raise JobOwned when claimed. Defaults to
+                db_session_factory.
+            claim_batch_size: optional maximum number of jobs to
+                claim per poll. If provided, jobs are claimed
+                atomically by the queue, as described above, and
+                db_poll_session_factory is not used. Claiming
+                requires PostgreSQL 9.5 or later for SKIP LOCKED.
+            notify_channel: optional PostgreSQL notification channel
+                to LISTEN on for new jobs. Requires psycopg2.
+            consumers: optional number of threads consuming jobs
+                through get(). If provided, at most consumers *
+                PREFETCH_PER_CONSUMER jobs are queued locally, so
+                that a backlog of jobs does not result in unbounded
+                memory use, or in consumers racing for jobs queued
+                long ago. Not applicable in claim mode, in which
+                claim_batch_size bounds the jobs queued locally.
         """
         self.owner = owner
         self.model_class = model_class
         self.db_session_factory = db_session_factory
         self.poll_seconds = poll_seconds
         self.db_job_class = db_job_class or DatabaseJob
+        self.db_poll_session_factory = db_poll_session_factory or db_session_factory
+        self.claim_batch_size = claim_batch_size
+        self.notify_channel = notify_channel
+        self.consumers = consumers
         self.queue = Queue.Queue()
+
+        #Ids of jobs queued locally, which are skipped when polling
+        self.queued_ids = set()
+        self.queued_ids_lock = threading.Lock()
         self.exit = threading.Event()
+        self.wakeup = threading.Event()
         self.running = False
         self.thread = None
+        self.listen_thread = None
     
     def _query_filters(self):
         """Get job poll query filters.
@@ -340,6 +651,116 @@ class DatabaseJobQueue(object):
             query = query.order_by(self.model_class.priority)
         return query
     
+    def _claim_query(self, limit):
+        """Get job claim query.
+
+        Args:
+            limit: maximum number of jobs to claim
+        Returns:
+            SQLAlchemy select of the ids of claimable jobs, which
+            locks the selected rows and skips locked rows.
+        """
+        order_by = None
+        if hasattr(self.model_class, "priority"):
+            order_by = [self.model_class.priority]
+        return _SkipLockedSelect(
+                [self.model_class.id],
+                and_(*self._query_filters()),
+                order_by=order_by,
+                limit=limit,
+                for_update=True)
+
+    def _start_update_values(self):
+        """Get model attributes/values to be updated when jobs are claimed.
+
+        Returns:
+            dict of model {attribute: value} per the db_job_class.
+        """
+        db_job = self.db_job_class(
+                owner=self.owner,
+                model_class=self.model_class,
+                model_id=None,
+                db_session_factory=self.db_session_factory)
+        return db_job._start_update_values()
+
+    def _claim(self, db_session, limit):
+        """Atomically claim jobs.
+
+        Args:
+            db_session: SQLAlchemy session
+            limit: maximum number of jobs to claim
+        Returns:
+            list of claimed job ids.
+        """
+        table = self.model_class.__table__
+        claim_query = self._claim_query(limit)
+        update = table.update()\
+                .where(table.c.id.in_(claim_query))\
+                .values(**self._start_update_values())
+
+        if db_session.get_bind(self.model_class).dialect.implicit_returning:
+            result = db_session.execute(update.returning(table.c.id))
+            ids = [row[0] for row in result]
+        else:
+            #Dialects without RETURNING select ids in the same
+            #transaction, relying on FOR UPDATE, if supported.
+            ids = [row[0] for row in db_session.execute(claim_query)]
+            if ids:
+                db_session.execute(table.update()\
+                        .where(table.c.id.in_(ids))\
+                        .values(**self._start_update_values()))
+        db_session.commit()
+        return ids
+
+    def _release(self, db_session, ids):
+        """Release claimed jobs which were not consumed.
+
+        Args:
+            db_session: SQLAlchemy session
+            ids: list of job ids claimed by this queue
+        """
+        table = self.model_class.__table__
+        values = dict((name, None) for name in self._start_update_values())
+        db_session.execute(table.update()\
+                .where(and_(table.c.id.in_(ids), table.c.owner == self.owner))\
+                .values(**values))
+        if self.notify_channel:
+            notify_jobs(db_session, self.notify_channel)
+        db_session.commit()
+
+    def _remove_claimed_items(self):
+        """Remove claimed jobs from queue.
+
+        Returns:
+            list of removed job ids.
+        """
+        ids = []
+        stop_items = []
+        try:
+            while True:
+                item = self.queue.get(block=False)
+                if item is self.STOP_ITEM:
+                    stop_items.append(item)
+                else:
+                    ids.append(item.model_id)
+        except Queue.Empty:
+            for item in stop_items:
+                self.queue.put(item)
+        return ids
+
+    def _prefetch_limit(self):
+        """Get maximum number of jobs to queue locally.
+
+        Returns:
+            maximum number of jobs, or None if unbounded.
+        """
+        if self.claim_batch_size:
+            return self.claim_batch_size
+        elif self.consumers:
+            return self.consumers * self.PREFETCH_PER_CONSUMER
+        else:
+            return None
+
     def _add_stop_items(self):
         """Helper method to add STOP_ITEM's to queue.
 
@@ -389,44 +810,239 @@ class DatabaseJobQueue(object):
             result = self.queue.get(block, timeout)
             if result is self.STOP_ITEM:
                 raise QueueStopped()
-            return result
         except Queue.Empty:
             raise QueueEmpty()
 
+        with self.queued_ids_lock:
+            self.queued_ids.discard(result.model_id)
+
+        #Refill the local queue once half of it has been consumed,
+        #rather than waiting for the next poll.
+        limit = self._prefetch_limit()
+        if limit is not None and self.queue.qsize() <= limit // 2:
+            self.wakeup.set()
+        return result
+
+    def get_batch(self, size):
+        """Claim a batch of jobs.
+
+        Up to size jobs are claimed atomically, as in claim mode,
+        regardless of whether the queue is running or its claim
+        mode. Claimed jobs should be processed through the returned
+        DatabaseJobBatch context manager, which updates them all upon
+        exit. Claiming requires PostgreSQL 9.5 or later.
+
+        Args:
+            size: maximum number of jobs to claim
+        Returns:
+            DatabaseJobBatch object, whose jobs are empty
+            if no jobs are available.
+        """
+        db_session = self.db_session_factory()
+        try:
+            model_ids = self._claim(db_session, size)
+        except:
+            db_session.rollback()
+            raise
+        finally:
+            db_session.close()
+
+        return DatabaseJobBatch(
+                owner=self.owner,
+                model_class=self.model_class,
+                model_ids=model_ids,
+                db_session_factory=self.db_session_factory,
+                db_job_class=self.db_job_class)
+
     def start(self):
         """Start polling database for new jobs."""
         if not self.running:
             self.exit.clear()
+            self.wakeup.clear()
             self._remove_stop_items()
             self.running = True
-            self.thread = threading.Thread(target=self.run)
-            self.thread.start()
+            self.thread = self._spawn(self.run)
+            if self.notify_channel:
+                self.listen_thread = self._spawn(self.listen)
+
+    def _spawn(self, target):
+        """Run target in a new thread.
+
+        Args:
+            target: method taking no parameters
+        Returns:
+            started threading.Thread object.
+        """
+        thread = threading.Thread(target=target)
+        thread.start()
+        return thread
 
     def run(self):
         """Database polling method."""
+        if self.claim_batch_size:
+            self._run_claim()
+            return
 
-        session = self.db_session_factory()
+        session = self.db_poll_session_factory()
 
         while self.running:
             try:
-                for job in self._query(session):
-                    database_job = self.db_job_class(
-                            owner=self.owner,
-                            model_class=self.model_class,
-                            model_id=job.id,
-                            db_session_factory=self.db_session_factory)
-                    self.queue.put(database_job)
+                self._poll(session)
                 session.commit()
 
             except Exception as error:
                 session.rollback()
                 logging.exception(error)
             finally:
-                self.exit.wait(self.poll_seconds)
+                self._wait()
 
         self.running = False
         session.close()
     
+    def _poll(self, db_session):
+        """Poll for new jobs, skipping jobs already queued locally.
+
+        Args:
+            db_session: SQLAlchemy session
+        """
+        limit = self._prefetch_limit()
+        if limit is not None:
+            limit -= self.queue.qsize()
+            if limit <= 0:
+                return
+
+        with self.queued_ids_lock:
+            queued_ids = list(self.queued_ids)
+
+        query = self._query(db_session)
+        if queued_ids:
+            query = query.filter(~self.model_class.id.in_(queued_ids))
+        if limit is not None:
+            query = query.limit(limit)
+
+        for job in query:
+            with self.queued_ids_lock:
+                if job.id in self.queued_ids:
+                    continue
+                self.queued_ids.add(job.id)
+            database_job = self.db_job_class(
+                    owner=self.owner,
+                    model_class=self.model_class,
+                    model_id=job.id,
+                    db_session_factory=self.db_session_factory)
+            self.queue.put(database_job)
+
+    def _run_claim(self):
+        """Database polling method in claim mode."""
+
+        session = self.db_session_factory()
+
+        while self.running:
+            try:
+                limit = self.claim_batch_size - self.queue.qsize()
+                if limit > 0:
+                    for job_id in self._claim(session, limit):
+                        database_job = self.db_job_class(
+                                owner=self.owner,
+                                model_class=self.model_class,
+                                model_id=job_id,
+                                db_session_factory=self.db_session_factory,
+                                claimed=True)
+                        self.queue.put(database_job)
+
+            except Exception as error:
+                session.rollback()
+                logging.exception(error)
+            finally:
+                self._wait()
+
+        try:
+            ids = self._remove_claimed_items()
+            if ids:
+                self._release(session, ids)
+        except Exception as error:
+            session.rollback()
+            logging.exception(error)
+        finally:
+            self.running = False
+            session.close()
+
+    def _wait(self):
+        """Wait poll_seconds, or until woken by a notification."""
+        self.wakeup.wait(self.poll_seconds)
+        self.wakeup.clear()
+
+    def _listen_connection(self):
+        """Create connection listening on notify_channel.
+
+        Returns:
+            psycopg2 connection, detached from the engine's pool.
+        """
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        session = self.db_session_factory()
+        try:
+            engine = session.get_bind(self.model_class)
+        finally:
+            session.close()
+
+        connection = engine.raw_connection()
+        connection.detach()
+        connection = connection.connection
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = connection.cursor()
+        cursor.execute('LISTEN "%s"' % self.notify_channel.replace('"', '""'))
+        cursor.close()
+        return connection
+
+    def listen(self):
+        """Notification listener method.
+
+        Wakes the polling thread upon each notification on
+        notify_channel, and after (re)connecting, since
+        notifications may have been missed.
+        """
+        connection = None
+
+        while self.running:
+            try:
+                if connection is None:
+                    connection = self._listen_connection()
+                    self.wakeup.set()
+
+                #Timeout so that stop() is observed
+                if self._wait_readable(connection, self.LISTEN_TIMEOUT):
+                    connection.poll()
+                    if connection.notifies:
+                        del connection.notifies[:]
+                        self.wakeup.set()
+
+            except Exception as error:
+                logging.exception(error)
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                    connection = None
+                self.exit.wait(self.LISTEN_RETRY_SECONDS)
+
+        if connection is not None:
+            connection.close()
+
+    def _wait_readable(self, connection, timeout):
+        """Wait for connection to become readable.
+
+        Args:
+            connection: psycopg2 connection
+            timeout: timeout in seconds
+        Returns:
+            True if connection is readable, False on timeout.
+        """
+        readable, writable, errors = select.select(
+                [connection], [], [], timeout)
+        return bool(readable)
+
     def stop(self):
         """Stop polling database for new jobs.
 
@@ -436,6 +1052,7 @@ class DatabaseJobQueue(object):
         if self.running:
             self.running = False
             self.exit.set()
+            self.wakeup.set()
             self._add_stop_items()
 
     def join(self, timeout=None):
@@ -446,3 +1063,5 @@ class DatabaseJobQueue(object):
         """
         if self.thread is not None:
             self.thread.join(timeout)
+        if self.listen_thread is not None:
+            self.listen_thread.join(timeout)
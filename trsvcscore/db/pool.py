@@ -0,0 +1,142 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+
+from trsvcscore.metrics.histogram import Histogram
+
+class PoolMetrics(object):
+    """Database connection pool metrics.
+
+    Tracks connection checkouts, the time spent waiting for a
+    connection, in microseconds, checkout timeouts, new and
+    overflow connections, and invalidated connections. Pool occupancy is read from
+    the engine's current pool when counters are requested.
+    """
+
+    def __init__(self):
+        """PoolMetrics constructor."""
+        self.engine = None
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.overflow_connects = 0
+        self.invalidations = 0
+        self.checkout_wait = Histogram()
+
+    def increment(self, name):
+        """Increment count.
+
+        Args:
+            name: count attribute name, i.e. "checkouts"
+        """
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def counters(self):
+        """Get pool counters.
+
+        Returns:
+            dict of counter name to value.
+        """
+        result = {
+            "database_pool_checkouts": self.checkouts,
+            "database_pool_timeouts": self.timeouts,
+            "database_pool_connects": self.connects,
+            "database_pool_overflow_connects": self.overflow_connects,
+            "database_pool_invalidations": self.invalidations
+        }
+
+        for percentile, value in self.checkout_wait.percentiles([50, 99]).items():
+            result["database_pool_checkout_wait_p%d_us" % percentile] = int(value)
+        result["database_pool_checkout_wait_max_us"] = int(self.checkout_wait.max or 0)
+
+        #Occupancy is only provided by QueuePool and GQueuePool
+        pool = self.engine.pool if self.engine is not None else None
+        for name, method in [
+                ("database_pool_size", "size"),
+                ("database_pool_checked_out", "checkedout"),
+                ("database_pool_checked_in", "checkedin"),
+                ("database_pool_overflow", "overflow"),
+                ("database_pool_waiting", "waiting")]:
+            if callable(getattr(pool, method, None)):
+                result[name] = getattr(pool, method)()
+        return result
+
+
+def instrumented_pool_class(pool_class, metrics):
+    """Create pool class which records checkout wait time.
+
+    Checkout timeouts, and overflow connections, created by
+    QueuePool or GQueuePool when all pooled connections are
+    in use, are counted as well.
+
+    The class should be passed to create_engine() as poolclass.
+    Since Pool.recreate() creates pools of the same class,
+    pools recreated after fork remain instrumented.
+
+    Args:
+        pool_class: SQLAlchemy pool class, i.e. QueuePool or GQueuePool
+        metrics: PoolMetrics object
+    Returns:
+        pool_class subclass
+    """
+    class InstrumentedPool(pool_class):
+        def _do_get(self):
+            start = time.time()
+            overflow = getattr(self, "overflow", None)
+            before = overflow() if overflow is not None else None
+            try:
+                return pool_class._do_get(self)
+            except exc.TimeoutError:
+                metrics.increment("timeouts")
+                raise
+            finally:
+                metrics.checkout_wait.record((time.time() - start) * 1000000)
+                if before is not None and overflow() > max(before, 0):
+                    metrics.increment("overflow_connects")
+
+    #Retain the pool class's logger, which is named by module
+    InstrumentedPool.__module__ = pool_class.__module__
+    InstrumentedPool.__name__ = "Instrumented%s" % pool_class.__name__
+    return InstrumentedPool
+
+def instrument_pool(engine, metrics, pre_ping=False):
+    """Add pool event listeners to engine.
+
+    Args:
+        engine: SQLAlchemy engine
+        metrics: PoolMetrics object
+        pre_ping: if True, connections are tested with a
+            "SELECT 1" when checked out of the pool, and stale
+            connections are replaced, rather than failing the
+            first request which uses them.
+    """
+    metrics.engine = engine
+
+    def on_connect(dbapi_connection, connection_record):
+        metrics.increment("connects")
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.increment("checkouts")
+        if pre_ping:
+            try:
+                cursor = dbapi_connection.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+            except Exception as error:
+                #The pool will invalidate the connection and
+                #retry the checkout with a new connection.
+                metrics.increment("invalidations")
+                raise exc.DisconnectionError(str(error))
+
+    def on_checkin(dbapi_connection, connection_record):
+        #Invalidated connections are checked in without
+        #their DBAPI connection.
+        if dbapi_connection is None:
+            metrics.increment("invalidations")
+
+    event.listen(engine, "connect", on_connect)
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
@@ -0,0 +1,161 @@
+import itertools
+import logging
+import threading
+import time
+
+from sqlalchemy import exc
+
+class Balancing(object):
+    """Replica balancing strategy enum.
+
+    ROUND_ROBIN selects replicas in turn.
+    LEAST_CONNECTIONS selects the replica with the fewest
+    connections checked out of its pool.
+    """
+    ROUND_ROBIN = "round_robin"
+    LEAST_CONNECTIONS = "least_connections"
+
+class ReplicaRouter(object):
+    """Database read replica router.
+
+    Selects the engine to bind read-only database sessions to.
+    Replicas which can not be connected to are considered unhealthy
+    and skipped for retry_seconds, after which they're tried again.
+    If no replica is healthy, the primary engine is selected.
+
+    Note that replicas may lag the primary, so sessions which
+    read data they've just written, or which lock rows, should
+    not be routed to replicas.
+    """
+
+    def __init__(self, primary, replicas,
+            balancing=Balancing.ROUND_ROBIN, retry_seconds=30):
+        """ReplicaRouter constructor.
+
+        Args:
+            primary: primary SQLAlchemy engine
+            replicas: list of replica SQLAlchemy engines
+            balancing: Balancing enum value
+            retry_seconds: seconds to skip unhealthy replicas
+        """
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.balancing = balancing
+        self.retry_seconds = retry_seconds
+        self.unhealthy = {}
+        self.next_index = itertools.count()
+        self.lock = threading.Lock()
+        self.replica_sessions = 0
+        self.fallbacks = 0
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def _checked_out(self, engine):
+        checkedout = getattr(engine.pool, "checkedout", None)
+        return checkedout() if callable(checkedout) else 0
+
+    def _saturated(self, engine):
+        """Determine if all of the engine's pool connections are in use.
+
+        Checking out of a saturated pool would wait for the pool
+        timeout, so saturated replicas are skipped without waiting.
+
+        Args:
+            engine: replica SQLAlchemy engine
+        Returns:
+            True if the pool is bounded, and no connection is
+            idle nor may be created, False otherwise.
+        """
+        pool = engine.pool
+        max_overflow = getattr(pool, "_max_overflow", None)
+        if max_overflow is None or max_overflow < 0 or \
+                not callable(getattr(pool, "checkedin", None)):
+            return False
+        return pool.checkedin() == 0 and pool.overflow() >= max_overflow
+
+    def _increment(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def healthy_replicas(self):
+        """Get healthy replicas.
+
+        Returns:
+            list of replica engines which are not currently
+            considered unhealthy.
+        """
+        now = time.time()
+        return [replica for replica in self.replicas
+                if self.unhealthy.get(replica, 0) <= now]
+
+    def candidates(self):
+        """Get healthy replicas in the order they should be tried.
+
+        Returns:
+            list of replica engines.
+        """
+        replicas = self.healthy_replicas()
+        if not replicas:
+            return replicas
+
+        if self.balancing == Balancing.LEAST_CONNECTIONS:
+            return sorted(replicas, key=self._checked_out)
+        else:
+            start = self.next_index.next() % len(replicas)
+            return replicas[start:] + replicas[:start]
+
+    def mark_unhealthy(self, engine):
+        """Skip replica for retry_seconds.
+
+        Args:
+            engine: replica SQLAlchemy engine
+        """
+        self.unhealthy[engine] = time.time() + self.retry_seconds
+
+    def engine(self):
+        """Select engine for a read-only session.
+
+        Replicas are verified by checking a connection out of, and
+        back in to, the replica's pool. This does not require a
+        database round trip for pooled connections, unless the
+        pool pre-pings connections.
+
+        Replicas whose pools are saturated, or time out, are
+        skipped, without being considered unhealthy. Skipped
+        replicas, and use of the primary, are counted as fallbacks.
+
+        Returns:
+            replica SQLAlchemy engine, or the primary engine
+            if no replica is healthy.
+        """
+        for replica in self.candidates():
+            if self._saturated(replica):
+                self._increment("fallbacks")
+                continue
+            try:
+                replica.connect().close()
+                self.unhealthy.pop(replica, None)
+                self._increment("replica_sessions")
+                return replica
+            except exc.TimeoutError as error:
+                self.log.warning("replica %s/%s saturated: %s" % (
+                        replica.url.host, replica.url.database, error))
+                self._increment("fallbacks")
+            except (exc.DBAPIError, exc.DisconnectionError) as error:
+                self.log.warning("replica %s/%s unhealthy: %s" % (
+                        replica.url.host, replica.url.database, error))
+                self.mark_unhealthy(replica)
+
+        self._increment("fallbacks")
+        return self.primary
+
+    def counters(self):
+        """Get replica counters.
+
+        Returns:
+            dict of counter name to value.
+        """
+        return {
+            "database_replica_sessions": self.replica_sessions,
+            "database_replica_fallbacks": self.fallbacks,
+            "database_replicas_healthy": len(self.healthy_replicas())
+        }
@@ -0,0 +1,269 @@
+import datetime
+import logging
+import threading
+import time
+
+from trpycore.timezone import tz
+from trsvcscore.db.job import JobDeferred, JobOwned, QueueStopped
+from trsvcscore.metrics.histogram import Histogram
+
+class DatabaseJobRunner(object):
+    """Database job runner.
+
+    DatabaseJobRunner consumes jobs from a DatabaseJobQueue with
+    multiple worker threads, replacing the consumer loop described
+    in DatabaseJobQueue. Each job is processed by the process
+    method, within the job's context manager, so jobs are marked
+    failed if process raises an exception.
+
+    Concurrency may be capped per job type, i.e. so that slow jobs
+    of one type can not occupy all workers, through job_type and
+    max_concurrency. Since a job's type is only known once the job
+    is owned, jobs of a type at capacity are released back to the
+    queue, rather than waited on, so workers remain available for
+    other types. Workers which release a job back off for
+    DEFER_SECONDS before taking another job.
+
+    The queue should be created with consumers equal to workers,
+    so that jobs queued locally are bounded by the number of workers.
+
+    Example usage:
+        db_queue = DatabaseJobQueue(
+            owner="archivesvc",
+            model_class=ChatArchiveJob,
+            db_session_factory=db_session_factory,
+            consumers=4)
+
+        runner = DatabaseJobRunner(
+            db_queue=db_queue,
+            process=archive,
+            workers=4)
+        runner.start()
+        handler.add_counter_provider(runner.counters)
+    """
+
+    #Seconds over which jobs per second are computed
+    RATE_SECONDS = 60
+
+    #Seconds a worker waits after releasing a job of a
+    #type at capacity before taking another job
+    DEFER_SECONDS = 0.1
+
+    def __init__(self,
+            db_queue,
+            process,
+            workers=1,
+            name=None,
+            job_type=None,
+            max_concurrency=None):
+        """DatabaseJobRunner constructor.
+
+        Args:
+            db_queue: DatabaseJobQueue object, which is started
+                and stopped by the runner.
+            process: method taking a job model, which processes
+                the job. Exceptions mark the job failed.
+            workers: number of workers consuming jobs.
+            name: optional name used in counter names. Defaults
+                to the queue model's table name.
+            job_type: optional method taking a job model, and
+                returning its type, i.e. lambda job: job.type.
+            max_concurrency: optional dict of job type to the
+                maximum number of jobs of that type to process
+                concurrently. Job types which are not included
+                are not limited.
+        """
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+        self.db_queue = db_queue
+        self.process = process
+        self.workers = workers
+        self.name = name or db_queue.model_class.__tablename__
+        self.job_type = job_type
+        self.semaphores = {}
+        for key, limit in (max_concurrency or {}).items():
+            self.semaphores[key] = self._create_semaphore(limit)
+        self.running = False
+        self.worker_list = []
+
+        self.lock = threading.Lock()
+        self.started = None
+        self.processed = 0
+        self.failed = 0
+        self.owned = 0
+        self.deferred = 0
+        self.lag = Histogram()
+        self.rate_seconds = [0] * self.RATE_SECONDS
+        self.rate_counts = [0] * self.RATE_SECONDS
+
+    def _create_semaphore(self, limit):
+        """Create semaphore limiting job type concurrency.
+
+        Args:
+            limit: maximum number of concurrent jobs
+        Returns:
+            threading.BoundedSemaphore object.
+        """
+        return threading.BoundedSemaphore(limit)
+
+    def _spawn(self, target):
+        """Run target in a new thread.
+
+        Args:
+            target: method taking no parameters
+        Returns:
+            started threading.Thread object.
+        """
+        thread = threading.Thread(target=target)
+        thread.start()
+        return thread
+
+    def _sleep(self, seconds):
+        """Sleep the current worker.
+
+        Args:
+            seconds: time in seconds
+        """
+        time.sleep(seconds)
+
+    def _record_lag(self, job):
+        """Record time between the job's not_before and now.
+
+        Args:
+            job: job model
+        """
+        not_before = getattr(job, "not_before", None)
+        if not_before is not None:
+            if not_before.tzinfo is None:
+                now = datetime.datetime.utcnow()
+            else:
+                now = tz.utcnow()
+            lag = (now - not_before).total_seconds()
+            self.lag.record(max(lag, 0) * 1000000)
+
+    def _record_completion(self, failed):
+        """Record processed job.
+
+        Args:
+            failed: True if the job failed
+        """
+        second = int(time.time())
+        index = second % self.RATE_SECONDS
+        with self.lock:
+            self.processed += 1
+            if failed:
+                self.failed += 1
+            if self.rate_seconds[index] != second:
+                self.rate_seconds[index] = second
+                self.rate_counts[index] = 0
+            self.rate_counts[index] += 1
+
+    def _process(self, job):
+        """Process job if its job type has capacity.
+
+        Args:
+            job: job model
+        Raises:
+            JobDeferred if the job type is at capacity.
+        """
+        semaphore = None
+        if self.job_type is not None:
+            semaphore = self.semaphores.get(self.job_type(job))
+
+        if semaphore is not None and not semaphore.acquire(False):
+            raise JobDeferred("%s(id=%s) type at capacity" % (job.__class__, job.id))
+
+        self._record_lag(job)
+        try:
+            self.process(job)
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def jobs_per_second(self):
+        """Get jobs processed per second over the last RATE_SECONDS.
+
+        Returns:
+            jobs per second.
+        """
+        now = time.time()
+        second = int(now)
+        with self.lock:
+            count = sum(rate_count for rate_second, rate_count
+                    in zip(self.rate_seconds, self.rate_counts)
+                    if second - self.RATE_SECONDS < rate_second <= second)
+
+        #Prior to RATE_SECONDS since start only elapsed time counts
+        seconds = self.RATE_SECONDS
+        if self.started is not None:
+            seconds = max(min(seconds, now - self.started), 1)
+        return count / float(seconds)
+
+    def counters(self):
+        """Get runner counters.
+
+        Returns:
+            dict of counter name to value.
+        """
+        prefix = "job_runner_%s" % self.name
+        result = {
+            "%s_workers" % prefix: len(self.worker_list),
+            "%s_processed" % prefix: self.processed,
+            "%s_failed" % prefix: self.failed,
+            "%s_owned" % prefix: self.owned,
+            "%s_deferred" % prefix: self.deferred,
+            "%s_jobs_per_sec" % prefix: self.jobs_per_second()
+        }
+
+        for percentile, value in self.lag.percentiles([50, 99]).items():
+            result["%s_lag_p%d_us" % (prefix, percentile)] = int(value)
+        result["%s_lag_max_us" % prefix] = int(self.lag.max or 0)
+        return result
+
+    def start(self):
+        """Start queue and workers."""
+        if not self.running:
+            self.running = True
+            self.started = time.time()
+            self.db_queue.start()
+            self.worker_list = [self._spawn(self.run) for i in range(self.workers)]
+
+    def run(self):
+        """Worker method."""
+        while self.running:
+            try:
+                with self.db_queue.get() as job:
+                    self._process(job)
+                self._record_completion(failed=False)
+            except JobOwned:
+                #Job claimed by another consumer
+                with self.lock:
+                    self.owned += 1
+            except JobDeferred:
+                #Job released since its type is at capacity
+                with self.lock:
+                    self.deferred += 1
+                self._sleep(self.DEFER_SECONDS)
+            except QueueStopped:
+                break
+            except Exception as error:
+                self._record_completion(failed=True)
+                self.log.exception(error)
+
+    def stop(self):
+        """Stop queue and workers.
+
+        Workers finish jobs in progress before exiting.
+        """
+        if self.running:
+            self.running = False
+            self.db_queue.stop()
+
+    def join(self, timeout=None):
+        """Join queue and workers.
+
+        Args:
+            timeout: optional timeout in seconds.
+        """
+        self.db_queue.join(timeout)
+        for worker in self.worker_list:
+            worker.join(timeout)
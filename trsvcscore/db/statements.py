@@ -0,0 +1,191 @@
+import logging
+import re
+from contextlib import contextmanager
+
+from trsvcscore.db.instrument import add_statement_observer
+
+#Statements are tracked per greenlet if greenlet is installed,
+#and per thread otherwise, as are service request timings.
+try:
+    from greenlet import getcurrent as _current
+except ImportError:
+    from thread import get_ident as _current
+
+#Current StatementStats by greenlet or thread
+_scopes = {}
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w%])-?\d+(?:\.\d+)?\b")
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\?|(?<!:):\w+")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+def statement_shape(statement):
+    """Get statement shape.
+
+    Statements which differ only in parameters, literals,
+    the length of IN lists, or whitespace, have the same shape.
+
+    Args:
+        statement: SQL statement string
+    Returns:
+        normalized statement string
+    """
+    shape = _STRING.sub("?", statement)
+    shape = _PARAMETER.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    shape = _PARAMETER_LIST.sub("(?)", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class StatementStats(object):
+    """Statement statistics for a request or unit of work.
+
+    Counts statements, the time spent executing them, and the
+    number of executions of each statement shape. Shapes executed
+    more than repeat_threshold times, typically the result of
+    lazy loading relationships in a loop, i.e. N+1 queries, are
+    reported by repeated() and log_repeated().
+    """
+
+    def __init__(self, name, repeat_threshold=10):
+        """StatementStats constructor.
+
+        Args:
+            name: request or unit of work name,
+                i.e. the service method name.
+            repeat_threshold: number of executions of a
+                single statement shape above which it's
+                considered repeated.
+        """
+        self.name = name
+        self.repeat_threshold = repeat_threshold
+        self.queries = 0
+        self.duration = 0
+        self.shapes = {}
+        self.previous = None
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def record(self, statement, seconds):
+        """Record statement execution.
+
+        Args:
+            statement: SQL statement string
+            seconds: execution time
+        """
+        shape = statement_shape(statement)
+        count, duration = self.shapes.get(shape, (0, 0))
+        self.shapes[shape] = (count + 1, duration + seconds)
+        self.queries += 1
+        self.duration += seconds
+
+    def repeated(self):
+        """Get repeated statement shapes.
+
+        Returns:
+            list of (shape, count, seconds) tuples for shapes
+            executed more than repeat_threshold times, most
+            executed first.
+        """
+        result = [(shape, count, seconds) for shape, (count, seconds)
+                in self.shapes.items() if count > self.repeat_threshold]
+        result.sort(key=lambda entry: entry[1], reverse=True)
+        return result
+
+    def log_repeated(self):
+        """Log a warning for each repeated statement shape.
+
+        Returns:
+            number of repeated statement shapes.
+        """
+        repeated = self.repeated()
+        for shape, count, seconds in repeated:
+            self.log.warning("%s executed statement %d times (%dms), possible N+1 query: %s" % (
+                self.name, count, seconds * 1000, shape))
+        return len(repeated)
+
+
+def begin_statements(name, repeat_threshold=10):
+    """Begin tracking statements in the current thread or greenlet.
+
+    Args:
+        name: request or unit of work name
+        repeat_threshold: number of executions of a single
+            statement shape above which it's considered repeated.
+    Returns:
+        StatementStats object, which must be passed to end_statements().
+    """
+    key = _current()
+    stats = StatementStats(name, repeat_threshold)
+    stats.previous = _scopes.get(key)
+    _scopes[key] = stats
+    return stats
+
+def end_statements(stats):
+    """End tracking statements.
+
+    Restores the enclosing StatementStats, if any, so nested
+    units of work are supported. Statements executed within
+    nested units of work are included in enclosing units of work.
+
+    Args:
+        stats: StatementStats object returned by begin_statements().
+    """
+    key = _current()
+    if stats.previous is not None:
+        _scopes[key] = stats.previous
+    else:
+        _scopes.pop(key, None)
+    stats.previous = None
+
+def current_statements():
+    """Get statement stats for the current thread or greenlet.
+
+    Returns:
+        StatementStats object, or None if statements are not tracked.
+    """
+    return _scopes.get(_current())
+
+@contextmanager
+def track_statements(name, repeat_threshold=10):
+    """Context manager tracking statements for a unit of work.
+
+    Repeated statement shapes are logged when the unit of work ends.
+    Statements are only tracked for engines instrumented with
+    instrument_statements().
+
+    Example usage:
+        with track_statements("archive_chat") as stats:
+            session = handler.get_database_session()
+            ...
+        stats.queries
+
+    Args:
+        name: unit of work name
+        repeat_threshold: number of executions of a single
+            statement shape above which it's considered repeated.
+    """
+    stats = begin_statements(name, repeat_threshold)
+    try:
+        yield stats
+    finally:
+        end_statements(stats)
+        stats.log_repeated()
+
+def _record_statement(statement, seconds):
+    stats = _scopes.get(_current())
+    while stats is not None:
+        stats.record(statement, seconds)
+        stats = stats.previous
+
+def instrument_statements(engine):
+    """Instrument SQLAlchemy engine to track statements.
+
+    Statements executed within begin_statements() and
+    end_statements(), or track_statements(), in the
+    same thread or greenlet are recorded.
+
+    Args:
+        engine: SQLAlchemy engine
+    """
+    add_statement_observer(engine, _record_statement)
@@ -0,0 +1,52 @@
+import gevent
+import gevent.coros
+import gevent.queue
+import gevent.select
+from gevent.event import Event
+
+from trsvcscore.db.job import DatabaseJobQueue
+
+class GDatabaseJobQueue(DatabaseJobQueue):
+    """Gevent database job queue.
+
+    Drop-in replacement for DatabaseJobQueue in gevent services.
+    Polling and notification listening run in greenlets, and
+    consumers wait for jobs in get() on a gevent queue, rather
+    than on threading primitives, which block the gevent hub.
+
+    Note that database access blocks the gevent hub unless the
+    database driver is gevent compatible, i.e. psycopg2 patched
+    by trpycore.psycopg2_gevent, as done by GServiceHandler.
+
+    See DatabaseJobQueue for usage and constructor arguments.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(GDatabaseJobQueue, self).__init__(*args, **kwargs)
+        self.queue = gevent.queue.Queue()
+        self.queued_ids_lock = gevent.coros.Semaphore()
+        self.exit = Event()
+        self.wakeup = Event()
+
+    def _spawn(self, target):
+        """Run target in a new greenlet.
+
+        Args:
+            target: method taking no parameters
+        Returns:
+            started gevent.Greenlet object.
+        """
+        return gevent.spawn(target)
+
+    def _wait_readable(self, connection, timeout):
+        """Wait for connection to become readable.
+
+        Args:
+            connection: psycopg2 connection
+            timeout: timeout in seconds
+        Returns:
+            True if connection is readable, False on timeout.
+        """
+        readable, writable, errors = gevent.select.select(
+                [connection], [], [], timeout)
+        return bool(readable)
@@ -0,0 +1,151 @@
+import collections
+
+import gevent
+from gevent.event import AsyncResult
+
+from sqlalchemy import exc
+from sqlalchemy.pool import Pool
+
+class GQueuePool(Pool):
+    """Gevent SQLAlchemy connection pool.
+
+    Drop-in replacement for QueuePool in gevent services. QueuePool
+    waits for connections on threading primitives, which block the
+    gevent hub, and requires max_overflow=-1, i.e. an unbounded
+    number of connections, to avoid deadlocks. GQueuePool bounds
+    the number of connections to pool_size + max_overflow, and
+    greenlets wait for connections using gevent primitives.
+
+    Waiting greenlets are served in FIFO order. Connections which
+    are returned to the pool are handed directly to the longest
+    waiting greenlet, so newly arriving greenlets can not take
+    connections ahead of it.
+
+    Note that the pool must only be used from a single thread.
+    """
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, timeout=30, **kwargs):
+        """GQueuePool constructor.
+
+        Args:
+            creator: callable returning new DBAPI connections
+            pool_size: maximum number of idle connections to retain.
+            max_overflow: maximum number of connections in excess
+                of pool_size. If -1, the number of connections
+                is unbounded.
+            timeout: seconds to wait for a connection before
+                raising sqlalchemy.exc.TimeoutError.
+            kwargs: additional sqlalchemy.pool.Pool arguments
+        """
+        Pool.__init__(self, creator, **kwargs)
+        self._pool_size = pool_size
+        self._max_overflow = max_overflow
+        self._timeout = timeout
+
+        #Idle connection records
+        self._idle = collections.deque()
+        
+        #AsyncResult objects of waiting greenlets, which are set
+        #to a connection record, or to None, if the greenlet
+        #should create a new connection.
+        self._waiters = collections.deque()
+
+        #Number of open connections, both idle and checked out
+        self._size = 0
+    
+    def recreate(self):
+        self.logger.info("Pool recreating")
+        return self.__class__(self._creator,
+                pool_size=self._pool_size,
+                max_overflow=self._max_overflow,
+                timeout=self._timeout,
+                recycle=self._recycle,
+                echo=self.echo,
+                logging_name=self._orig_logging_name,
+                use_threadlocal=self._use_threadlocal,
+                _dispatch=self.dispatch)
+
+    def _is_full(self):
+        return self._max_overflow > -1 and \
+                self._size >= self._pool_size + self._max_overflow
+
+    def _create(self):
+        """Create connection record for an acquired connection slot."""
+        try:
+            return self._create_connection()
+        except:
+            self._release()
+            raise
+
+    def _release(self):
+        """Release connection slot, transferring it to a waiter if any."""
+        if self._waiters:
+            self._waiters.popleft().set(None)
+        else:
+            self._size -= 1
+
+    def _do_get(self):
+        if self._idle:
+            return self._idle.pop()
+
+        if not self._is_full():
+            self._size += 1
+            return self._create()
+        
+        waiter = AsyncResult()
+        self._waiters.append(waiter)
+        try:
+            record = waiter.get(timeout=self._timeout)
+        except gevent.Timeout:
+            #Connection may have been handed off concurrently
+            #with the timeout expiring.
+            if not waiter.ready():
+                self._waiters.remove(waiter)
+                raise exc.TimeoutError(
+                        "GQueuePool limit of size %d overflow %d reached, "
+                        "connection timed out, timeout %s" %
+                        (self.size(), self.overflow(), self._timeout))
+            record = waiter.get()
+        
+        if record is None:
+            record = self._create()
+        return record
+
+    def _do_return_conn(self, conn):
+        if self._waiters:
+            self._waiters.popleft().set(conn)
+        elif len(self._idle) < self._pool_size:
+            self._idle.append(conn)
+        else:
+            conn.close()
+            self._release()
+
+    def dispose(self):
+        while self._idle:
+            self._idle.pop().close()
+            self._release()
+        self.logger.info("Pool disposed. %s", self.status())
+
+    def status(self):
+        return "Pool size: %d  Connections in pool: %d "\
+                "Current Overflow: %d Current Checked out "\
+                "connections: %d Waiting: %d" % (self.size(),
+                                    self.checkedin(),
+                                    self.overflow(),
+                                    self.checkedout(),
+                                    self.waiting())
+
+    def size(self):
+        return self._pool_size
+
+    def checkedin(self):
+        return len(self._idle)
+
+    def overflow(self):
+        return self._size - self._pool_size
+
+    def checkedout(self):
+        return self._size - len(self._idle)
+
+    def waiting(self):
+        return len(self._waiters)
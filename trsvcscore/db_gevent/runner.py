@@ -0,0 +1,41 @@
+import gevent
+import gevent.coros
+
+from trsvcscore.db.runner import DatabaseJobRunner
+
+class GDatabaseJobRunner(DatabaseJobRunner):
+    """Gevent database job runner.
+
+    Consumes jobs from a GDatabaseJobQueue with multiple worker
+    greenlets, and caps job type concurrency with gevent semaphores.
+
+    See DatabaseJobRunner for usage and constructor arguments.
+    """
+
+    def _create_semaphore(self, limit):
+        """Create semaphore limiting job type concurrency.
+
+        Args:
+            limit: maximum number of concurrent jobs
+        Returns:
+            gevent.coros.BoundedSemaphore object.
+        """
+        return gevent.coros.BoundedSemaphore(limit)
+
+    def _spawn(self, target):
+        """Run target in a new greenlet.
+
+        Args:
+            target: method taking no parameters
+        Returns:
+            started gevent.Greenlet object.
+        """
+        return gevent.spawn(target)
+
+    def _sleep(self, seconds):
+        """Sleep the current greenlet.
+
+        Args:
+            seconds: time in seconds
+        """
+        gevent.sleep(seconds)
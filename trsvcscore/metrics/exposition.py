@@ -0,0 +1,111 @@
+import re
+
+#Content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#Method latency histogram bucket bounds in seconds
+LATENCY_BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+]
+
+#Characters which are invalid in metric names
+_INVALID_NAME = re.compile(r"[^a-zA-Z0-9_:]")
+
+def metric_name(name):
+    """Convert counter name to a valid metric name.
+
+    Args:
+        name: counter name
+    Returns:
+        metric name with invalid characters replaced by "_".
+    """
+    name = _INVALID_NAME.sub("_", name)
+    if name[:1].isdigit():
+        name = "_" + name
+    return name
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def _render_untyped(name, value):
+    name = metric_name(name)
+    return "# TYPE %s untyped\n%s %s\n" % (name, name, _format_value(value))
+
+def render_counters(handler):
+    """Render handler counters and counter providers.
+
+    Method metrics are excluded, since they are
+    rendered as histograms by render_method_metrics().
+
+    Args:
+        handler: ServiceHandler or GServiceHandler object
+    Returns:
+        generator yielding one metric at a time.
+    """
+    for name, value in sorted(handler.counters.as_dict().items()):
+        yield _render_untyped(name, value)
+
+    method_metrics = getattr(handler, "method_metrics", None)
+    for provider in list(handler.counter_providers):
+        if method_metrics is not None and provider == method_metrics.counters:
+            continue
+        for name, value in sorted(provider().items()):
+            yield _render_untyped(name, value)
+
+def render_method_metrics(handler):
+    """Render service method latency histograms and errors.
+
+    Histograms are kept per process, so in pre-fork mode
+    only the rendering process's methods are included.
+
+    Args:
+        handler: ServiceHandler or GServiceHandler object
+    Returns:
+        generator yielding one method at a time.
+    """
+    method_metrics = getattr(handler, "method_metrics", None)
+    if method_metrics is None:
+        return
+
+    #Only methods which have been called are included
+    metrics = [(name, metric) for name, metric
+            in sorted(method_metrics.metrics.items()) if metric.requests]
+
+    latency = "service_method_latency_seconds"
+    errors = "service_method_errors_total"
+    yield "# TYPE %s histogram\n" % latency
+    for name, metric in metrics:
+        histogram = metric.latency
+        count, total, counts = histogram.snapshot(
+                [bound * 1000000 for bound in LATENCY_BUCKETS])
+
+        lines = []
+        for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+            lines.append('%s_bucket{method="%s",le="%s"} %d\n' % (latency, name, bound, bucket_count))
+        lines.append('%s_bucket{method="%s",le="+Inf"} %d\n' % (latency, name, count))
+        lines.append('%s_sum{method="%s"} %s\n' % (latency, name, repr(total / 1000000.0)))
+        lines.append('%s_count{method="%s"} %d\n' % (latency, name, count))
+        yield "".join(lines)
+
+    yield "# TYPE %s counter\n" % errors
+    for name, metric in metrics:
+        yield '%s{method="%s"} %d\n' % (errors, name, metric.errors)
+
+def render(handler):
+    """Render handler metrics in the text exposition format.
+
+    Metrics are rendered incrementally, so that large responses
+    can be written as they are rendered, without holding locks,
+    or the CPU in the case of gevent, for the entire response.
+
+    Args:
+        handler: ServiceHandler or GServiceHandler object
+    Returns:
+        generator yielding response chunks.
+    """
+    for renderer in [render_counters, render_method_metrics]:
+        for chunk in renderer(handler):
+            yield chunk
@@ -0,0 +1,167 @@
+import math
+import threading
+
+class Histogram(object):
+    """Fixed memory log-linear histogram.
+
+    Values are counted in buckets whose width grows with the value,
+    similar to an HDR histogram. Each power of two range is divided
+    into sub_buckets linear buckets, so percentiles are accurate to
+    within 1 / sub_buckets of the value, regardless of magnitude,
+    while memory is bounded by the number of buckets.
+
+    Values are expected to be non-negative. Values less than 1 are
+    counted in the first bucket, and values greater than max_value
+    in the last bucket.
+
+    Example usage:
+        histogram = Histogram()
+        histogram.record(1250)
+        histogram.percentile(99)
+    """
+
+    def __init__(self, sub_buckets=8, max_value=2**36):
+        """Histogram constructor.
+
+        Args:
+            sub_buckets: number of linear buckets per power of two.
+                Must be a power of two.
+            max_value: maximum distinguishable value. The default,
+                in microseconds, is approximately 19 hours.
+        """
+        if sub_buckets < 1 or sub_buckets & (sub_buckets - 1):
+            raise ValueError("sub_buckets must be a power of two")
+
+        self.sub_buckets = sub_buckets
+        self.max_value = max_value
+        self.size = self._index(max_value) + 1
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all recorded values."""
+        with self.lock:
+            self.buckets = [0] * self.size
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = None
+
+    def record(self, value):
+        """Record value.
+
+        Args:
+            value: non-negative value
+        """
+        index = self._index(value)
+        with self.lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def mean(self):
+        """Get mean of recorded values.
+
+        Returns:
+            mean value, or 0 if no values have been recorded.
+        """
+        if not self.count:
+            return 0
+        return float(self.total) / self.count
+
+    def percentile(self, percentile):
+        """Get value at percentile.
+
+        Args:
+            percentile: percentile between 0 and 100
+        Returns:
+            upper bound of the bucket containing the percentile,
+            limited to the maximum recorded value, or 0 if
+            no values have been recorded.
+        """
+        with self.lock:
+            if not self.count:
+                return 0
+            target = max(1, int(math.ceil(self.count * percentile / 100.0)))
+            seen = 0
+            for index, count in enumerate(self.buckets):
+                seen += count
+                if seen >= target:
+                    if index == self.size - 1:
+                        return self.max
+                    return min(self._upper_bound(index), self.max)
+            return self.max
+
+    def percentiles(self, percentiles):
+        """Get values at several percentiles.
+
+        Args:
+            percentiles: list of percentiles between 0 and 100
+        Returns:
+            dict of percentile to value.
+        """
+        return dict((p, self.percentile(p)) for p in percentiles)
+
+    def cumulative_counts(self, bounds):
+        """Get the number of values less than or equal to each bound.
+
+        Counts are approximate, since values are attributed
+        to a bound only if their bucket lies entirely below it.
+
+        Args:
+            bounds: sorted list of bounds
+        Returns:
+            list of counts corresponding to bounds.
+        """
+        with self.lock:
+            buckets = list(self.buckets)
+        return self._cumulative_counts(buckets, bounds)
+
+    def snapshot(self, bounds):
+        """Get a consistent snapshot of the histogram.
+
+        The count, total, and cumulative counts are read under
+        a single lock acquisition, so that concurrently recorded
+        values are reflected in all or none of them.
+
+        Args:
+            bounds: sorted list of bounds
+        Returns:
+            (count, total, cumulative counts) tuple, where cumulative
+            counts are as returned by cumulative_counts().
+        """
+        with self.lock:
+            count = self.count
+            total = self.total
+            buckets = list(self.buckets)
+        return count, total, self._cumulative_counts(buckets, bounds)
+
+    def _cumulative_counts(self, buckets, bounds):
+        """Get cumulative counts of buckets at each bound."""
+        result = []
+        index = 0
+        count = 0
+        for bound in bounds:
+            while index < len(buckets) - 1 and self._upper_bound(index) <= bound:
+                count += buckets[index]
+                index += 1
+            result.append(count)
+        return result
+
+    def _index(self, value):
+        """Get bucket index for value."""
+        if value < 1:
+            return 0
+        value = min(value, self.max_value)
+        mantissa, exponent = math.frexp(value)
+        sub_bucket = int((mantissa - 0.5) * 2 * self.sub_buckets)
+        return (exponent - 1) * self.sub_buckets + sub_bucket
+
+    def _upper_bound(self, index):
+        """Get exclusive upper bound of bucket at index."""
+        exponent, sub_bucket = divmod(index, self.sub_buckets)
+        return (2 ** exponent) * (1 + float(sub_bucket + 1) / self.sub_buckets)
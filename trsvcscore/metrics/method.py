@@ -0,0 +1,129 @@
+import threading
+
+from trsvcscore.metrics.histogram import Histogram
+
+class MethodMetric(object):
+    """Service method metric.
+
+    Records the number of calls, errors, and a latency
+    histogram, in microseconds, for a single method.
+    """
+
+    def __init__(self, name):
+        """MethodMetric constructor.
+
+        Args:
+            name: method name
+        """
+        self.name = name
+        self.errors = 0
+        self.latency = Histogram()
+        self.lock = threading.Lock()
+
+    @property
+    def requests(self):
+        """Number of calls recorded."""
+        return self.latency.count
+
+    def record(self, seconds, error=False):
+        """Record method call.
+
+        Args:
+            seconds: call latency in seconds
+            error: True if the call raised an exception
+        """
+        self.latency.record(seconds * 1000000)
+        if error:
+            with self.lock:
+                self.errors += 1
+
+    def reset(self):
+        """Clear recorded calls."""
+        with self.lock:
+            self.errors = 0
+        self.latency.reset()
+
+
+class MethodMetrics(object):
+    """Per-method service metrics.
+
+    Maintains a MethodMetric for each service method, and reports
+    them as counters, named method_<name>_<metric>, and as a
+    human readable summary. Memory is fixed per method, and
+    recording a call only takes a short lock, so metrics may
+    be left enabled in production.
+
+    Example usage:
+        metrics = MethodMetrics()
+        metric = metrics.get_metric("getVersion")
+        metric.record(0.0012)
+        metrics.counters()
+    """
+
+    #Latency percentiles to report
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self):
+        """MethodMetrics constructor."""
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get_metric(self, name):
+        """Get method metric, creating it if needed.
+
+        Args:
+            name: method name
+        Returns:
+            MethodMetric object
+        """
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(name, MethodMetric(name))
+        return metric
+
+    def reset(self):
+        """Clear recorded calls for all methods."""
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def counters(self):
+        """Get method counters.
+
+        Only methods which have been called are included.
+        Latencies are reported in microseconds.
+
+        Returns:
+            dict of counter name to value.
+        """
+        result = {}
+        for name, metric in self.metrics.items():
+            if not metric.requests:
+                continue
+            prefix = "method_%s" % name
+            result["%s_requests" % prefix] = metric.requests
+            result["%s_errors" % prefix] = metric.errors
+            for percentile, value in metric.latency.percentiles(self.PERCENTILES).items():
+                result["%s_latency_p%d_us" % (prefix, percentile)] = int(value)
+            result["%s_latency_max_us" % prefix] = int(metric.latency.max)
+        return result
+
+    def summary(self):
+        """Get human readable summary of method metrics.
+
+        Returns:
+            string with one line per method which has been called.
+        """
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            if not metric.requests:
+                continue
+            percentiles = metric.latency.percentiles(self.PERCENTILES)
+            lines.append("%s: requests=%d errors=%d %s max=%dus" % (
+                name,
+                metric.requests,
+                metric.errors,
+                " ".join(["p%d=%dus" % (p, percentiles[p]) for p in self.PERCENTILES]),
+                metric.latency.max))
+        return "\n".join(lines)
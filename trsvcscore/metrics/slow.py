@@ -0,0 +1,91 @@
+import collections
+import datetime
+import threading
+
+class SlowRequestLog(object):
+    """Ring buffer of slow service requests.
+
+    Records requests whose duration meets the threshold, along with
+    their arguments, retaining only the most recent size requests,
+    so memory is bounded. Argument representations are truncated
+    to max_arguments_length characters.
+
+    Example usage:
+        log = SlowRequestLog(threshold=1.0, size=100)
+        log.record(timing)
+        log.summary()
+    """
+
+    def __init__(self, threshold=1.0, size=100, max_arguments_length=256):
+        """SlowRequestLog constructor.
+
+        Args:
+            threshold: minimum request duration in seconds
+                to be considered slow.
+            size: maximum number of requests to retain
+            max_arguments_length: maximum length of recorded
+                argument representations.
+        """
+        self.threshold = threshold
+        self.max_arguments_length = max_arguments_length
+        self.entries = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, timing, args=None):
+        """Record request if it is slow.
+
+        Args:
+            timing: finished RequestTiming object
+            args: optional service method arguments,
+                excluding the request context.
+        Returns:
+            True if the request was recorded, False otherwise.
+        """
+        if self.threshold is None or timing.duration < self.threshold:
+            return False
+
+        arguments = ", ".join([repr(arg) for arg in args or []])
+        if len(arguments) > self.max_arguments_length:
+            arguments = arguments[:self.max_arguments_length] + "..."
+
+        with self.lock:
+            self.entries.append((timing, arguments))
+        return True
+
+    def requests(self):
+        """Get recorded requests.
+
+        Returns:
+            list of (RequestTiming, arguments) tuples,
+            most recent first.
+        """
+        with self.lock:
+            entries = list(self.entries)
+        entries.reverse()
+        return entries
+
+    def clear(self):
+        """Discard recorded requests."""
+        with self.lock:
+            self.entries.clear()
+
+    def summary(self):
+        """Get human readable summary of recorded requests.
+
+        Returns:
+            string with one line per request, most recent first.
+        """
+        lines = []
+        for timing, arguments in self.requests():
+            context = timing.request_context
+            times = " ".join(["%s=%dms" % (category, seconds * 1000)
+                for category, seconds in sorted(timing.times.items())])
+            lines.append("%s %s(%s) userId=%s sessionId=%s duration=%dms %s" % (
+                datetime.datetime.utcfromtimestamp(timing.start).isoformat(),
+                timing.method,
+                arguments,
+                getattr(context, "userId", None),
+                getattr(context, "sessionId", None),
+                timing.duration * 1000,
+                times))
+        return "\n".join([line.rstrip() for line in lines])
@@ -0,0 +1,120 @@
+import time
+from contextlib import contextmanager
+
+#Requests are tracked per greenlet if greenlet is installed,
+#which also distinguishes threads, since each thread has
+#its own main greenlet, and per thread otherwise.
+try:
+    from greenlet import getcurrent as _current
+except ImportError:
+    from thread import get_ident as _current
+
+#Current RequestTiming by greenlet or thread
+_requests = {}
+
+class RequestTiming(object):
+    """Service request timing.
+
+    Tracks the duration of a service request, and the time spent
+    within it in categories of work, i.e. database queries ("db")
+    and downstream service calls ("proxy"). If the request is
+    traced, span is its server Span.
+    """
+
+    def __init__(self, method, request_context=None):
+        """RequestTiming constructor.
+
+        Args:
+            method: service method name
+            request_context: optional RequestContext object
+        """
+        self.method = method
+        self.request_context = request_context
+        self.start = time.time()
+        self.end = None
+        self.times = {}
+        self.span = None
+        self.previous = None
+
+    @property
+    def duration(self):
+        """Request duration in seconds, so far if not finished."""
+        return (self.end or time.time()) - self.start
+
+    def add(self, category, seconds):
+        """Add time spent in category.
+
+        Args:
+            category: category name, i.e. "db"
+            seconds: time spent
+        """
+        self.times[category] = self.times.get(category, 0) + seconds
+
+
+def begin_request(method, request_context=None):
+    """Begin timing request in the current thread or greenlet.
+
+    Args:
+        method: service method name
+        request_context: optional RequestContext object
+    Returns:
+        RequestTiming object, which must be passed to end_request().
+    """
+    key = _current()
+    timing = RequestTiming(method, request_context)
+    timing.previous = _requests.get(key)
+    _requests[key] = timing
+    return timing
+
+def end_request(timing):
+    """End timing request.
+
+    Restores the request which was current when timing began,
+    if any, so nested requests are supported.
+
+    Args:
+        timing: RequestTiming object returned by begin_request()
+    """
+    timing.end = time.time()
+    key = _current()
+    if timing.previous is not None:
+        _requests[key] = timing.previous
+    else:
+        _requests.pop(key, None)
+    timing.previous = None
+
+def current_request():
+    """Get request timing for the current thread or greenlet.
+
+    Returns:
+        RequestTiming object, or None if not within a request.
+    """
+    return _requests.get(_current())
+
+def add_time(category, seconds):
+    """Add time spent in category to the current request, if any.
+
+    Args:
+        category: category name, i.e. "db"
+        seconds: time spent
+    """
+    timing = _requests.get(_current())
+    if timing is not None:
+        timing.add(category, seconds)
+
+@contextmanager
+def timed(category):
+    """Context manager adding time spent to the current request.
+
+    Example usage:
+        with timed("proxy"):
+            proxy.getVersion(context)
+
+    Args:
+        category: category name, i.e. "proxy"
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_time(category, time.time() - start)
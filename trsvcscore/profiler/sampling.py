@@ -0,0 +1,257 @@
+import logging
+import os
+import sys
+import thread
+import threading
+import time
+
+#The sampler must run in a native thread, even if gevent has
+#monkey patched the thread and time modules, so that it can
+#sample greenlets which do not yield. Versions of gevent prior
+#to 1.0 do not provide the original functions, so the profiler
+#must be imported before monkey patching to sample natively.
+try:
+    from gevent import monkey
+    _start_new_thread = monkey.get_original("thread", "start_new_thread")
+    _allocate_lock = monkey.get_original("thread", "allocate_lock")
+    _get_ident = monkey.get_original("thread", "get_ident")
+    _sleep = monkey.get_original("time", "sleep")
+except (ImportError, AttributeError):
+    _start_new_thread = thread.start_new_thread
+    _allocate_lock = thread.allocate_lock
+    _get_ident = thread.get_ident
+    _sleep = time.sleep
+
+#Native thread id of the main thread, assuming this module
+#is imported in the main thread, which gevent does not
+#report in threading.enumerate() once monkey patched.
+_main_ident = _get_ident()
+
+#Innermost frames, as (file name, function name), of threads
+#or greenlets which are waiting rather than running. Stacks
+#ending in these frames are excluded unless idle is True.
+IDLE_FRAMES = set([
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("Queue.py", "get"),
+    ("socket.py", "accept"),
+    ("hub.py", "run"),
+    ("hub.py", "switch"),
+    ("hub.py", "wait")
+])
+
+#Service options, and their defaults, which control the
+#handler's profiler through the setOption() admin method.
+#Setting profile.enable to true discards previous results and
+#starts sampling. Results are available through getOption()
+#as profile.collapsed, and in profile.output if provided.
+PROFILE_OPTIONS = {
+    "profile.enable": "false",
+    "profile.duration": "60",
+    "profile.rate": "100",
+    "profile.idle": "false",
+    "profile.output": ""
+}
+
+def parse_bool(value):
+    """Parse boolean option value.
+
+    Args:
+        value: option string, i.e. "true" or "1"
+    Returns:
+        True if the value is true, False otherwise.
+    """
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def parse_rate(value):
+    """Parse profile.rate option value.
+
+    Args:
+        value: option string, i.e. "100"
+    Returns:
+        samples per second as a float.
+    Raises:
+        ValueError if the value is not a positive number.
+    """
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        rate = 0
+    if not rate > 0:
+        raise ValueError("invalid profile.rate (%s)" % value)
+    return rate
+
+
+class SamplingProfiler(object):
+    """Statistical profiler.
+
+    Samples the stacks of all threads, or of the running greenlet
+    if gevent is used, at a fixed rate from a native background
+    thread, and counts identical stacks. Since profiled code is
+    never instrumented, overhead is limited to the sampling itself,
+    so the profiler may be enabled in production.
+
+    Results are provided in collapsed stack format, one stack per
+    line, with frames separated by semicolons and followed by the
+    number of samples, which is suitable for flame graph tools.
+
+    Example usage:
+        profiler = SamplingProfiler(rate=100)
+        profiler.start(duration=30)
+        ...
+        profiler.stop()
+        profiler.collapsed()
+    """
+
+    def __init__(self, rate=100, idle=False, max_depth=64):
+        """SamplingProfiler constructor.
+
+        Args:
+            rate: samples per second
+            idle: if True, include stacks of threads which are
+                waiting, i.e. idle workers, in the results.
+            max_depth: maximum number of frames per stack
+        """
+        self.rate = rate
+        self.idle = idle
+        self.max_depth = max_depth
+        self.output = None
+        self.deadline = None
+        self.running = False
+        self.generation = 0
+        self.sampler_idents = set()
+        self.sample_count = 0
+        self.stacks = {}
+        self.lock = _allocate_lock()
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def start(self, duration=None, output=None):
+        """Start sampling.
+
+        Previous results are retained until reset() is called.
+
+        Args:
+            duration: optional number of seconds after which
+                sampling will stop automatically.
+            output: optional file path to which collapsed
+                stacks will be written when sampling stops.
+        """
+        if self.running:
+            return
+        self.running = True
+        self.generation += 1
+        self.output = output
+        self.deadline = time.time() + duration if duration else None
+        _start_new_thread(self._run, (self.generation,))
+
+    def stop(self):
+        """Stop sampling.
+
+        The sampler thread will exit within one sample interval.
+        """
+        self.running = False
+
+    def is_running(self):
+        """Check if the profiler is sampling.
+
+        Returns:
+            True if sampling, False otherwise.
+        """
+        return self.running
+
+    def reset(self):
+        """Discard results."""
+        with self.lock:
+            self.stacks = {}
+            self.sample_count = 0
+
+    def collapsed(self):
+        """Get results in collapsed stack format.
+
+        Returns:
+            string containing one line per distinct stack,
+            with the most frequently sampled stacks first.
+        """
+        with self.lock:
+            stacks = self.stacks.items()
+        stacks.sort(key=lambda item: item[1], reverse=True)
+        return "\n".join(["%s %d" % (";".join(stack), count) for stack, count in stacks])
+
+    def write(self, path):
+        """Write results in collapsed stack format to file.
+
+        Args:
+            path: file path
+        """
+        with open(path, "w") as output:
+            output.write(self.collapsed())
+            output.write("\n")
+
+    def _run(self, generation):
+        """Sampler thread method.
+
+        Args:
+            generation: start() generation. The thread exits if the
+                profiler is stopped, or stopped and restarted.
+        """
+        ident = _get_ident()
+        self.sampler_idents.add(ident)
+        interval = 1.0 / self.rate
+        output = self.output
+        try:
+            while self.running and generation == self.generation:
+                if self.deadline is not None and time.time() >= self.deadline:
+                    break
+                self._sample()
+                _sleep(interval)
+        except Exception as error:
+            self.log.exception(error)
+        finally:
+            self.sampler_idents.discard(ident)
+            if generation == self.generation:
+                self.running = False
+            if output:
+                try:
+                    self.write(output)
+                except Exception as error:
+                    self.log.exception(error)
+
+    def _sample(self):
+        """Sample the stacks of all threads."""
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        names.setdefault(_main_ident, "MainThread")
+        frames = sys._current_frames()
+
+        stacks = []
+        for ident, frame in frames.items():
+            if ident in self.sampler_idents:
+                continue
+            code = frame.f_code
+            if not self.idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            stacks.append(self._stack(names.get(ident, str(ident)), frame))
+
+        with self.lock:
+            self.sample_count += 1
+            for stack in stacks:
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def _stack(self, name, frame):
+        """Get stack for frame.
+
+        Args:
+            name: thread name
+            frame: innermost frame
+        Returns:
+            tuple of frame descriptions, outermost first,
+            beginning with the thread name.
+        """
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append("%s (%s:%d)" % (code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.append(name)
+        stack.reverse()
+        return tuple(stack)
@@ -1,8 +1,7 @@
 import abc
 
-from thrift.protocol import TBinaryProtocol
-
 from tridlcore.gen import TRService
+from trsvcscore.thrift import negotiation
 
 class ServiceProxyException(Exception):
     """General service proxy exception class."""
@@ -28,7 +27,7 @@ class ServiceProxy(object):
 
     def __init__(self, service_name, service_class=None,
             transport_class=None, protocol_class=None,
-            keepalive=False, is_gevent=False):
+            keepalive=False, is_gevent=False, accelerated=True):
         """ServiceProxy constructor.
 
         Args:
@@ -42,7 +41,9 @@ class ServiceProxy(object):
                 appropriately patched for gevent comptability
                 if is_gevent is set to True.
             protocol_class: Option Thrift protocol class. If not
-                provided this will default to TBinaryProtocol.
+                provided the protocol will be negotiated with
+                the service endpoint, defaulting to TBinaryProtocol
+                for endpoints which do not advertise their protocols.
             keepalive: Optional boolean indicating if transport should
                 be kept open between requests. If false, transport
                 will be opened and closed for each service request.
@@ -50,12 +51,16 @@ class ServiceProxy(object):
                 gevent based service. If so, the default TSocket
                 transport_class will be patched for gevent 
                 compatability.
+            accelerated: Optional boolean indicating if the
+                C-accelerated binary protocol should be used,
+                if installed, when the protocol is negotiated.
         """
         self.service_name = service_name
         self.keepalive = keepalive
         self.is_gevent = is_gevent
+        self.accelerated = accelerated
         self.service_class = service_class or TRService
-        self.protocol_class = protocol_class or TBinaryProtocol.TBinaryProtocol
+        self.protocol_class = protocol_class
 
         #If in a gevent app and adjust the transport accordingly
         if self.is_gevent:
@@ -76,3 +81,37 @@ class ServiceProxy(object):
     @abc.abstractmethod
     def close_transport(self):
         return
+
+    def create_service_client(self, address, port, endpoint=None):
+        """Create a service client object.
+
+        The most preferred Thrift protocol and transport supported
+        by the endpoint are selected automatically. The transport
+        created with transport_class is wrapped in a buffered or
+        framed transport accordingly, so each request is written
+        to the network in a single write.
+
+        Args:
+            address: service address
+            port: service port
+            endpoint: optional ServerEndpoint object advertising the
+                Thrift protocols and transports supported by the
+                service.
+        Returns:
+            (Service, Transport) tuple
+        """
+        transport_name = negotiation.select_transport(endpoint)
+        transport = negotiation.transport_class(transport_name)(
+                self.transport_class(address, port))
+
+        if self.protocol_class is not None:
+            protocol = self.protocol_class(transport)
+        else:
+            protocol_name = negotiation.select_protocol(endpoint,
+                    negotiation.protocol_preference(self.accelerated))
+            protocol = negotiation.protocol_class(
+                    protocol_name, self.accelerated)(transport)
+
+        service = self.service_class.Client(protocol)
+        return service, transport
+
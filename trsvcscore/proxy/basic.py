@@ -2,7 +2,9 @@ import thrift
 from thrift.transport.TTransport import TTransportException
 
 from trpycore.pool.queue import QueuePool
+from trsvcscore.metrics.timing import timed
 from trsvcscore.proxy.base import ServiceProxyException, ServiceProxy
+from trsvcscore.tracing.tracer import traced_call
 
 class BasicServiceProxy(ServiceProxy):
     """Basic service proxy.
@@ -23,7 +25,8 @@ class BasicServiceProxy(ServiceProxy):
 
     def __init__(self, service_name, service_hostname, service_port,
             service_class=None, transport_class=None,
-            protocol_class=None, keepalive=False, is_gevent=False):
+            protocol_class=None, keepalive=False, is_gevent=False,
+            accelerated=True):
         """BasicServiceProxy constructor.
 
         Args:
@@ -39,7 +42,8 @@ class BasicServiceProxy(ServiceProxy):
                 appropriately patched for gevent comptability
                 if is_gevent is set to True.
             protocol_class: Option Thrift protocol class. If not
-                provided this will default to TBinaryProtocol.
+                provided this will default to TBinaryProtocol, or
+                TBinaryProtocolAccelerated if accelerated.
             keepalive: Optional boolean indicating if transport should
                 be kept open between requests. If false, transport
                 will be opened and closed for each service request.
@@ -47,6 +51,9 @@ class BasicServiceProxy(ServiceProxy):
                 gevent based service. If so, the default TSocket
                 transport_class will be patched for gevent 
                 compatability.
+            accelerated: Optional boolean indicating if the
+                C-accelerated binary protocol should be used
+                if installed.
         """
         super(BasicServiceProxy, self).__init__(
                 service_name,
@@ -54,15 +61,15 @@ class BasicServiceProxy(ServiceProxy):
                 transport_class,
                 protocol_class,
                 keepalive,
-                is_gevent)
+                is_gevent,
+                accelerated)
 
         self.service_hostname = service_hostname
         self.service_port = service_port
         self.is_gevent = is_gevent
 
-        self.service_transport = self.transport_class(self.service_hostname, self.service_port)
-        self.service_protocol = self.protocol_class(self.service_transport)
-        self.service = self.service_class.Client(self.service_protocol)
+        self.service, self.service_transport = self.create_service_client(
+                self.service_hostname, self.service_port)
 
         self.service_method_wrappers  ={}
 
@@ -102,20 +109,24 @@ class BasicServiceProxy(ServiceProxy):
         Users will receive a wrapper version of service methods
         which ensures that the transport is opened for each
         request and is properly governed by keepalive setting.
+        Time spent is added to the current service request's
+        timing in the "proxy" category, and calls are traced
+        if a default tracer is set.
         """
 
         if method not in self.service_method_wrappers:
             def wrapper(*args, **kwargs):
-                try:
-                    if not self.service_transport.isOpen():
-                        self.service_transport.open()
-                    return method(*args, **kwargs)
-                except TTransportException as error:
-                    self.service_transport.close()
-                    raise ServiceProxyException("service unavailable: %s" % str(error))
-                finally:
-                    if not self.keepalive and self.service_transport.isOpen():
+                with timed("proxy"):
+                    try:
+                        if not self.service_transport.isOpen():
+                            self.service_transport.open()
+                        return traced_call(method.__name__, method, args, kwargs)
+                    except TTransportException as error:
                         self.service_transport.close()
+                        raise ServiceProxyException("service unavailable: %s" % str(error))
+                    finally:
+                        if not self.keepalive and self.service_transport.isOpen():
+                            self.service_transport.close()
             self.service_method_wrappers[method] = wrapper
         return self.service_method_wrappers[method]
 
@@ -161,7 +172,7 @@ class BasicServiceProxyPool(QueuePool):
     def __init__(self, service_name, service_hostname, service_port, size,
             service_class=None, queue_class=None,
             transport_class=None, protocol_class=None,
-            keepalive=False, is_gevent=False):
+            keepalive=False, is_gevent=False, accelerated=True):
         """BasicServiceProxyPool constructor.
 
         Args:
@@ -193,6 +204,9 @@ class BasicServiceProxyPool(QueuePool):
                 transport_class will be patched for gevent 
                 compatability, and an appropriate queue class will
                 be used.
+            accelerated: Optional boolean indicating if the
+                C-accelerated binary protocol should be used
+                if installed.
         """
         self.service_name = service_name
         self.service_hostname = service_hostname
@@ -204,6 +218,7 @@ class BasicServiceProxyPool(QueuePool):
         self.protocol_class = protocol_class
         self.keepalive = keepalive
         self.is_gevent = is_gevent
+        self.accelerated = accelerated
 
         if self.queue_class is None:
             if self.is_gevent:
@@ -227,4 +242,5 @@ class BasicServiceProxyPool(QueuePool):
                 transport_class=self.transport_class,
                 protocol_class=self.protocol_class,
                 keepalive=self.keepalive,
-                is_gevent=self.is_gevent)
+                is_gevent=self.is_gevent,
+                accelerated=self.accelerated)
@@ -1,15 +1,46 @@
 import logging
 import os
-import threading
 
 from thrift import Thrift
 from thrift.transport.TTransport import TTransportException
 
 from trpycore.pool.queue import QueuePool
 from trpycore.zookeeper.client import ZookeeperClient
-from trpycore.zookeeper.watch import ChildrenWatch
+from trsvcscore.registrar.base import ServiceRegistryEvent
 from trsvcscore.registrar.zoo import ZookeeperServiceRegistrar
+from trsvcscore.metrics.timing import timed
 from trsvcscore.proxy.base import ServiceProxyException, ServiceProxy
+from trsvcscore.tracing.tracer import traced_call
+
+class ZookeeperServiceSnapshot(object):
+    """Immutable snapshot of a proxied service instance.
+
+    Snapshots are never modified once created. When the proxied
+    service instance becomes unavailable, a new snapshot is created
+    and swapped in with a single reference assignment, so readers
+    never need to acquire a lock. Service calls in progress
+    continue to use the snapshot they started with.
+    """
+    __slots__ = ["node", "service", "transport", "method_wrappers"]
+
+    def __init__(self, node=None, service=None, transport=None):
+        """ZookeeperServiceSnapshot constructor.
+
+        Args:
+            node: Service zookeeper node, i.e. chatsvc_00000001
+            service: Service client object
+            transport: Service client transport
+        """
+        self.node = node
+        self.service = service
+        self.transport = transport
+
+        #Cache of service method name to transport managing wrapper.
+        #This is the only mutable state, and is populated lazily.
+        #Concurrent population is benign since wrappers for the
+        #same method are equivalent.
+        self.method_wrappers = {}
+
 
 class ZookeeperServiceProxy(ServiceProxy):
     """Zookeeper based service proxy.
@@ -31,23 +62,9 @@ class ZookeeperServiceProxy(ServiceProxy):
         proxy.getVersion(RequestContext())
     """
 
-    class NoOpLock(object):
-        """Lock context manager which does nothing, no-op.
-
-        This is a standin for a lock context manager, when
-        locking is not really needed.
-        """
-        def __enter__(self):
-            return
-
-        def __exit__(self, exception_type, exception_value, exception_traceback):
-            """Exit context manager without supressing exceptions."""
-            return False
-
-
     def __init__(self, zookeeper_client, service_name,
             service_class=None, transport_class=None, protocol_class=None,
-            keepalive=False):
+            keepalive=False, accelerated=True):
         """ZookeeperServiceProxy constructor.
 
         Args:
@@ -64,10 +81,14 @@ class ZookeeperServiceProxy(ServiceProxy):
                 appropriately patched for gevent comptability
                 if is_gevent is set to True.
             protocol_class: Option Thrift protocol class. If not
-                provided this will default to TBinaryProtocol.
+                provided the protocol will be negotiated with
+                the service endpoint.
             keepalive: Optional boolean indicating if transport should
                 be kept open between requests. If false, transport
                 will be opened and closed for each service request.
+            accelerated: Optional boolean indicating if the
+                C-accelerated binary protocol should be used,
+                if installed, when the protocol is negotiated.
         """
         if isinstance(zookeeper_client, ZookeeperClient):
             is_gevent = False
@@ -80,55 +101,56 @@ class ZookeeperServiceProxy(ServiceProxy):
                 transport_class,
                 protocol_class,
                 keepalive,
-                is_gevent)
+                is_gevent,
+                accelerated)
 
         self.zookeeper_client = zookeeper_client
-        self.registrar = ZookeeperServiceRegistrar(self.zookeeper_client)
+        self.registrar = ZookeeperServiceRegistrar.shared(self.zookeeper_client)
         self.registry_path = os.path.join("/services", self.service_name, "registry")
+        self.registry_watch = None
         self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
 
-        self.service = None               #Service client object
-        self.service_transport = None     #Service client transport
-        self.service_node = None          #Service zookeeper node, i.e. chatsvc_00000001
-        self.service_method_wrappers = {} #Service method wrappers
-        
-        #Staged service client object, node, and transport.
-        #If the the current self.service become unavailable
-        #the _watcher() callback will be invoked asynchronously
-        #by the zookeeper client. At this point, we'll create
-        #a new service client object and stage it for update
-        #on the next user invocation.
-        self.staged_service = None
-        self.staged_service_node = None
-        self.staged_service_transport = None
+        #Current service snapshot. If the the current service
+        #becomes unavailable the _registry_observer() callback
+        #will be invoked asynchronously. At this point, we'll
+        #create a new snapshot and swap it in atomically.
+        self.snapshot = ZookeeperServiceSnapshot()
         
-        #If we're in a gevent app adjust the lock, and watch accordingly.
-        if self.is_gevent:
-            from trpycore.zookeeper_gevent.watch import GChildrenWatch
-            self.watch = GChildrenWatch(self.zookeeper_client, self.registry_path, self._watch)
-            self.lock = self.NoOpLock()
-        else:
-            self.watch = ChildrenWatch(self.zookeeper_client, self.registry_path, self._watch)
-            self.lock = threading.Lock()
-        
-        #Acquire the lock, and create the service client.
-        with self.lock:
-            self.service_node, self.service, self.service_transport = self._create_service()
-
         #Start watching zookeeper /services/<service_name>/registry for
         #addition and removal of service instances, so we can
-        #update our proxy if our instance goes down.
-        self.watch.start()
+        #update our proxy if our instance goes down. Note that
+        #the registry watch is shared by all proxies for this
+        #service which use the same zookeeper client.
+        self.registry_watch = self.registrar.add_registry_observer(
+                self.service_name, self._registry_observer)
+        
+        self.snapshot = self._create_snapshot()
+
+    @property
+    def service(self):
+        """Current service client object or None."""
+        return self.snapshot.service
+
+    @property
+    def service_node(self):
+        """Current service zookeeper node or None."""
+        return self.snapshot.node
+
+    @property
+    def service_transport(self):
+        """Current service client transport or None."""
+        return self.snapshot.transport
 
     def open_transport(self):
         """Open service transport.
         Raises:
             ServiceProxyException if service is not available.
         """
+        transport = self.snapshot.transport
         try:
-            if self.service_transport:
-                if not self.service_transpot.isOpen():
-                    self.service_transport.open()
+            if transport:
+                if not transport.isOpen():
+                    transport.open()
             else:
                 raise ServiceProxyException("service unavailable")
         except Exception:
@@ -139,89 +161,104 @@ class ZookeeperServiceProxy(ServiceProxy):
         Raises:
             ServiceProxyException if service is not available.
         """
+        transport = self.snapshot.transport
         try:
-            if self.service_transport:
-                if self.service_transpot.isOpen():
-                    self.service_transport.close()
+            if transport:
+                if transport.isOpen():
+                    transport.close()
             else:
                 raise ServiceProxyException("service unavailable")
         except Exception:
             raise ServiceProxyException("service unavailable")
 
-    def _watch(self, watcher):
-        """Zookeper watcher callback.
+    def release(self):
+        """Release the proxy's reference to the shared registry watch.
+        
+        The shared registry watch for the service will be stopped,
+        and the shared registrar dropped, once all proxies using
+        them have been released. Following
+        release, the proxy will no longer adjust for service
+        unavailability.
+        """
+        if self.registry_watch is not None:
+            self.registrar.remove_registry_observer(
+                    self.service_name, self._registry_observer)
+            self.registry_watch = None
+            ZookeeperServiceRegistrar.release_shared(self.zookeeper_client)
+
+    def _registry_observer(self, watch, event):
+        """Zookeeper registry observer callback.
 
         This method will be invoked asynchronously if instances
         of this service are added or removed. If our instance
-        is no longer available, create a new, staged, service
-        object while will be swapped in on the next user
-        invocation.
+        is no longer available, create a new service snapshot
+        and swap it in.
+
+        Args:
+            watch: ZookeeperServiceRegistryWatch object
+            event: ServiceRegistryEvent object
         """
-        services = watcher.get_children()
+        if event.event_type != ServiceRegistryEvent.CHANGED_EVENT:
+            return
+
+        services = [os.path.basename(path) for path, service_info in watch.zookeeper_services()]
 
         #If our service is no longer available, create a new one.
-        if self.service_node not in services and \
-            self.staged_service_node not in services:
-            
-            node, service, transport = self._create_service()
-            
-            #Update staged service and node.
-            with self.lock:
-                self.staged_service_node = node
-                self.staged_service = service
-                self.staged_service_transport = transport
+        if self.snapshot.node not in services:
+            self.snapshot = self._create_snapshot()
         
-    def _create_service(self):
-        """Create a new service client object.
+    def _create_snapshot(self):
+        """Create a new service snapshot.
 
         Returns:
-            (Zookeeper node, Service, Transport) tuple if service is available,
-            otherwise (None, None, None).
+            ZookeeperServiceSnapshot object. If no service is
+            available, the snapshot's node, service, and transport
+            will be None.
         """
-        result = (None, None, None)
-        
         #Locate an available service instance in the registrar
         path, service_info = self.registrar.locate_zookeeper_service(self.service_name)
 
-        #If a service instance is available, create the object and stage
-        #it to be swapped in on the next user invocation.
+        #If a service instance is available, create the client object.
         if path and service_info:
             #Get the TCP/THRIFT server endpoint
             endpoint = service_info.default_endpoint()
             node = os.path.basename(path)
-            transport = self.transport_class(endpoint.address, endpoint.port)
-            protocol = self.protocol_class(transport)
-            service = self.service_class.Client(protocol)
-
-            result = (node, service, transport)
-
-        return result
+            service, transport = self.create_service_client(
+                    endpoint.address, endpoint.port, endpoint)
+            return ZookeeperServiceSnapshot(node, service, transport)
+        else:
+            return ZookeeperServiceSnapshot()
 
-    def _get_service_method_wrapper(self, method):
+    def _get_service_method_wrapper(self, snapshot, name, method):
         """Create a service method wrapper to manage transport.
 
         Users will receive a wrapper version of service methods
         which ensures that the transport is opened for each
         request and is properly governed by keepalive setting.
+        Time spent is added to the current service request's
+        timing in the "proxy" category, and calls are traced
+        if a default tracer is set.
+        Wrappers are bound to the snapshot's transport, so
+        a snapshot swap during a request will not affect it.
         """
-
-        if method not in self.service_method_wrappers:
+        wrapper = snapshot.method_wrappers.get(name)
+        if wrapper is None:
+            transport = snapshot.transport
+            keepalive = self.keepalive
             def wrapper(*args, **kwargs):
-                if self.service_transport is None:
-                    raise ServiceProxyException("service unavailable")
-
-                try:
-                    if not self.service_transport.isOpen():
-                        self.service_transport.open()
-                    return method(*args, **kwargs)
-                except TTransportException as error:
-                    self.service_transport.close()
-                    raise ServiceProxyException("service unavailable: %s" % str(error))
-                finally:
-                    if not self.keepalive and self.service_transport.isOpen():
-                        self.service_transport.close()
-            self.service_method_wrappers[method] = wrapper
-        return self.service_method_wrappers[method]
+                with timed("proxy"):
+                    try:
+                        if not transport.isOpen():
+                            transport.open()
+                        return traced_call(name, method, args, kwargs)
+                    except TTransportException as error:
+                        transport.close()
+                        raise ServiceProxyException("service unavailable: %s" % str(error))
+                    finally:
+                        if not keepalive and transport.isOpen():
+                            transport.close()
+            snapshot.method_wrappers[name] = wrapper
+        return wrapper
 
 
     def __getattr__(self, attr):
@@ -239,28 +276,18 @@ class ZookeeperServiceProxy(ServiceProxy):
         Raises:
             ServiceProxyException if service is not available.
         """
+        #Single reference read of the current snapshot. The
+        #snapshot is immutable so no locking is required.
+        snapshot = self.snapshot
 
-        #If a new service object is stage, acquire the
-        #lock and swap it in.
-        if self.staged_service:
-            with self.lock:
-                self.service = self.staged_service
-                self.staged_service = None
-
-                self.service_node = self.staged_service_node
-                self.staged_service_node = None
-
-                self.service_transport = self.staged_service_transport
-                self.staged_service_transport = None
-        
         #If the service is unavailable raise ServiceProxyException.
-        if self.service is None:
+        if snapshot.service is None:
             raise ServiceProxyException("service unavailable")
         
         #Return service object attribute.
-        attribute = getattr(self.service, attr)
+        attribute = getattr(snapshot.service, attr)
         if hasattr(attribute, "__call__"):
-            attribute = self._get_service_method_wrapper(attribute)
+            attribute = self._get_service_method_wrapper(snapshot, attr, attribute)
         return attribute
 
 
@@ -277,7 +304,7 @@ class ZookeeperServiceProxyPool(QueuePool):
     def __init__(self, zookeeper_client, service_name, size,
             service_class=None, queue_class=None,
             transport_class=None, protocol_class=None,
-            keepalive=False, is_gevent=False):
+            keepalive=False, is_gevent=False, accelerated=True):
         """ZookeeperServiceProxyPool constructor.
 
         Args:
@@ -299,7 +326,8 @@ class ZookeeperServiceProxyPool(QueuePool):
                 if is_gevent is set to True.
                 appropriately patched for gevent comptability.
             protocol_class: Option Thrift protocol class. If not
-                provided this will default to TBinaryProtocol.
+                provided the protocol will be negotiated with
+                the service endpoint.
             keepalive: Optional boolean indicating if transport should
                 be kept open between requests. If false, transport
                 will be opened and closed for each service request.
@@ -308,6 +336,9 @@ class ZookeeperServiceProxyPool(QueuePool):
                 transport_class will be patched for gevent 
                 compatability, and an appropriate queue class will
                 be used.
+            accelerated: Optional boolean indicating if the
+                C-accelerated binary protocol should be used,
+                if installed, when the protocol is negotiated.
         """
         self.zookeeper_client = zookeeper_client
         self.service_name = service_name
@@ -318,6 +349,8 @@ class ZookeeperServiceProxyPool(QueuePool):
         self.protocol_class = protocol_class
         self.keepalive = keepalive
         self.is_gevent = is_gevent
+        self.accelerated = accelerated
+        self.proxies = []
 
         if self.queue_class is None:
             if self.is_gevent:
@@ -333,12 +366,26 @@ class ZookeeperServiceProxyPool(QueuePool):
                 queue_class=self.queue_class)
     
     def create(self):
-        """ZookeeperServiceProxy factory method."""
-        return ZookeeperServiceProxy(
+        """ZookeeperServiceProxy factory method.
+
+        Note that all proxies in the pool share a single
+        registry watch for the service.
+        """
+        proxy = ZookeeperServiceProxy(
                 self.zookeeper_client,
                 self.service_name,
                 service_class=self.service_class,
                 transport_class=self.transport_class,
                 protocol_class=self.protocol_class,
                 keepalive=self.keepalive,
-                is_gevent=self.is_gevent)
+                accelerated=self.accelerated)
+        self.proxies.append(proxy)
+        return proxy
+
+    def release(self):
+        """Release all proxies created by the pool.
+
+        See ZookeeperServiceProxy.release().
+        """
+        for proxy in self.proxies:
+            proxy.release()
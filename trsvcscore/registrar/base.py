@@ -61,3 +61,40 @@ class ServiceRegistrar(object):
             list of ServiceInfo objects for found services.
         """
         return
+
+
+class ServiceRegistryEvent(object):
+    """Service registry event."""
+
+    CONNECTED_EVENT = "CONNECTED_EVENT"
+    CHANGED_EVENT = "CHANGED_EVENT"
+    DISCONNECTED_EVENT = "DISCONNECTED_EVENT"
+
+    def __init__(self, event_type, service_name, previous_services=None,
+            current_services=None, added_services=None, removed_services=None):
+        """ServiceRegistryEvent constructor.
+
+        Args:
+            event_type: event type (ALL EVENTS)
+            service_name: service name, i.e. chatsvc (ALL EVENTS)
+            previous_services: list of ServiceInfo's before change (CHANGED_EVENT)
+            current_services: list of ServiceInfo's after change (CHANGED_EVENT)
+            added_services: list of added ServiceInfo's (CHANGED_EVENT)
+            removed_services: list of removed ServiceInfo's (CHANGED_EVENT)
+        """
+        self.event_type = event_type
+        self.service_name = service_name
+        self.previous_services = previous_services
+        self.current_services = current_services
+        self.added_services = added_services
+        self.removed_services = removed_services
+
+    def __repr__(self):
+        return "%s(%s, %s, %r, %r, %r, %r)" % (
+                self.__class__.__name__,
+                self.event_type,
+                self.service_name,
+                self.previous_services,
+                self.current_services,
+                self.added_services,
+                self.removed_services)
@@ -3,30 +3,382 @@ import json
 import os
 import random
 import socket
+import threading
+import weakref
 
 import zookeeper
 
 from trpycore.zookeeper.client import ZookeeperClient
-from trsvcscore.registrar.base import ServiceRegistrar
+from trpycore.zookeeper.watch import ChildrenWatch
+from trsvcscore.registrar.base import ServiceRegistrar, ServiceRegistryEvent
 from trsvcscore.service.base import ServiceInfo
 
+class ZookeeperServiceRegistryWatch(object):
+    """Zookeeper service registry watch.
+
+    Watches /services/<service>/registry for the addition and removal
+    of service instances, and notifies observers with a
+    ServiceRegistryEvent describing the change.
+
+    Bursts of registry changes, i.e. during a rolling deploy,
+    are coalesced. Following a change, the watch waits
+    coalesce_seconds before reading the registry, so that
+    all changes within the window result in a single
+    CHANGED_EVENT. Only the data of newly added service
+    nodes is read from zookeeper; the decoded ServiceInfo
+    objects for existing nodes are reused.
+
+    This class is not typically instantiated directly, instead
+    it should be obtained through
+    ZookeeperServiceRegistrar.add_registry_observer().
+    """
+    def __init__(self, zookeeper_client, service_name, coalesce_seconds=0.5):
+        """ZookeeperServiceRegistryWatch constructor.
+
+        Args:
+            zookeeper_client: zookeeper client instance.
+            service_name: service name, i.e. chatsvc
+            coalesce_seconds: time in seconds to wait following
+                a registry change before reading the registry.
+                Changes within this window will be coalesced
+                into a single CHANGED_EVENT. If 0, each change
+                will be processed immediately.
+        """
+        self.zookeeper_client = zookeeper_client
+        self.service_name = service_name
+        self.coalesce_seconds = coalesce_seconds
+        self.path = os.path.join("/services", service_name, "registry")
+        self.observers = []
+        self.running = False
+        self.update_pending = False
+        self.updating = False
+        self.update_again = False
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        #Map of service node name, i.e. chatsvc_<key>, to ServiceInfo.
+        #Note that this dict is never modified in place, it's replaced
+        #on each change, so it's safe for readers to use without a lock.
+        self.nodes = {}
+        
+        #Adjust watch, lock, and timer for thread/greenlets accordingly.
+        if isinstance(self.zookeeper_client, ZookeeperClient):
+            self.watch = ChildrenWatch(self.zookeeper_client, self.path, self._watch)
+            self.lock = threading.Lock()
+        else:
+            import gevent.coros
+            from trpycore.zookeeper_gevent.watch import GChildrenWatch
+            self.watch = GChildrenWatch(self.zookeeper_client, self.path, self._watch)
+            self.lock = gevent.coros.Semaphore()
+    
+    def _spawn_later(self, seconds, method):
+        """Invoke method asynchronously after seconds."""
+        if isinstance(self.zookeeper_client, ZookeeperClient):
+            timer = threading.Timer(seconds, method)
+            timer.daemon = True
+            timer.start()
+        else:
+            import gevent
+            gevent.spawn_later(seconds, method)
+
+    def _watch(self, watcher):
+        """Zookeeper watcher callback.
+
+        This method will be invoked asynchronously if instances
+        of this service are added or removed.
+        """
+        self._schedule_update()
+
+    def _schedule_update(self):
+        """Schedule a coalesced registry update.
+
+        If an update is in progress, a new update is scheduled
+        once it completes, rather than running concurrently.
+        """
+        with self.lock:
+            if not self.running:
+                return
+            if self.updating:
+                self.update_again = True
+                return
+            if self.update_pending:
+                return
+            self.update_pending = True
+
+        if self.coalesce_seconds:
+            self._spawn_later(self.coalesce_seconds, self._update)
+        else:
+            self._update()
+
+    def _read_children(self):
+        """Read registry children from zookeeper.
+
+        Returns:
+            list of registry child node names.
+        """
+        try:
+            return self.zookeeper_client.get_children(self.path)
+        except zookeeper.NoNodeException:
+            return []
+
+    def _update(self, notify=True):
+        """Read the registry and notify observers of changes.
+
+        Updates are serialized. Changes which occur during an
+        update schedule a new update once it completes.
+
+        Args:
+            notify: optional flag indicating if observers should
+                be notified of changes.
+        """
+        with self.lock:
+            if self.updating:
+                self.update_pending = False
+                self.update_again = True
+                return
+            self.update_pending = False
+            self.update_again = False
+            self.updating = True
+
+        try:
+            self._read_registry(notify)
+        finally:
+            with self.lock:
+                self.updating = False
+                update_again = self.update_again
+                self.update_again = False
+            if update_again:
+                self._schedule_update()
+
+    def _read_registry(self, notify):
+        """Read the registry and notify observers of changes.
+
+        This method should only be invoked through _update().
+
+        Args:
+            notify: flag indicating if observers should
+                be notified of changes.
+        """
+        try:
+            children = self._read_children()
+        except Exception as error:
+            self.log.exception(error)
+            return
+
+        previous_nodes = self.nodes
+        current_nodes = {}
+        added_services = []
+        for child in children:
+            if child in previous_nodes:
+                current_nodes[child] = previous_nodes[child]
+            else:
+                try:
+                    service_node = os.path.join(self.path, child)
+                    data, stat = self.zookeeper_client.get_data(service_node)
+                    current_nodes[child] = ServiceInfo.from_json(data)
+                    added_services.append(current_nodes[child])
+                except zookeeper.NoNodeException:
+                    #Node was removed before we were able to read it.
+                    pass
+                except Exception as error:
+                    self.log.exception(error)
+
+        removed_services = [s for n, s in previous_nodes.items() if n not in current_nodes]
+        self.nodes = current_nodes
+
+        if notify and (added_services or removed_services):
+            event = ServiceRegistryEvent(
+                    ServiceRegistryEvent.CHANGED_EVENT,
+                    self.service_name,
+                    previous_services=previous_nodes.values(),
+                    current_services=current_nodes.values(),
+                    added_services=added_services,
+                    removed_services=removed_services)
+            self._notify(event)
+
+    def _notify(self, event):
+        """Notify observers of registry event."""
+        for observer in list(self.observers):
+            try:
+                observer(self, event)
+            except Exception as error:
+                self.log.exception(error)
+
+    def session_observer(self, event):
+        """Zookeeper session observer.
+
+        Args:
+            event: ZookeeperClient.Event
+        """
+        if not self.running:
+            return
+
+        if event.state == zookeeper.CONNECTED_STATE:
+            self._notify(ServiceRegistryEvent(
+                ServiceRegistryEvent.CONNECTED_EVENT, self.service_name))
+            #Registry may have changed while disconnected.
+            self._schedule_update()
+        elif event.state in [zookeeper.CONNECTING_STATE, zookeeper.EXPIRED_SESSION_STATE]:
+            self._notify(ServiceRegistryEvent(
+                ServiceRegistryEvent.DISCONNECTED_EVENT, self.service_name))
+
+    def start(self):
+        """Start watching the registry.
+        
+        The registry is read synchronously upon start so that
+        services() reflects the current registry immediately.
+        """
+        if not self.running:
+            self.running = True
+            self.watch.start()
+            self._update(notify=False)
+
+    def stop(self):
+        """Stop watching the registry."""
+        if self.running:
+            self.running = False
+            self.watch.stop()
+
+    def add_observer(self, method):
+        """Add a registry observer method.
+
+        The given method will be invoked with following arguments:
+            watch: ZookeeperServiceRegistryWatch object
+            event: ServiceRegistryEvent object
+        """
+        self.observers.append(method)
+
+    def remove_observer(self, method):
+        """Remove a registry observer method."""
+        self.observers.remove(method)
+    
+    def services(self):
+        """Return currently registered service instances.
+
+        Returns:
+            list of ServiceInfo objects.
+        """
+        return self.nodes.values()
+
+    def zookeeper_services(self):
+        """Return currently registered service instances.
+
+        Equivalent to services() except the result is a list of tuples
+        including the zookeeper service node path.
+
+        Returns:
+            list of (Zookeeper node path, ServiceInfo) tuples.
+        """
+        return [(os.path.join(self.path, n), s) for n, s in self.nodes.items()]
+
+    def locate_zookeeper_service(self, host_affinity=True):
+        """Locate a random service instance.
+
+        Equivalent to ZookeeperServiceRegistrar.locate_zookeeper_service,
+        except the service instance is selected from the watched
+        registry without reading from zookeeper.
+
+        Args:
+            host_affinity: if True preference will be given to services
+                located on the same physical host. Otherwise a service
+                instance will be selected randomly.
+        
+        Returns:
+            (Zookeeper service node path, ServiceInfo) tuple if service is located,
+            (None, None) otherwise.
+        """
+        result = (None, None)
+        services = self.zookeeper_services()
+
+        if services:
+            #If host affinity is set try to find a service on this host
+            if host_affinity:
+                hostname = socket.gethostname()
+                host_services = [(p, s) for p, s in services if s.hostname == hostname]
+                if host_services:
+                    result = random.choice(host_services)
+
+            #If still no result, pick one at random
+            if result[0] is None:
+                result = random.choice(services)
+
+        return result
+
+
 class ZookeeperServiceRegistrar(ServiceRegistrar):
     """Zookeeper service registrar."""
-    def __init__(self, zookeeper_client):
+
+    #Map of zookeeper client to [shared ZookeeperServiceRegistrar,
+    #reference count]. The registrar references its client, so
+    #entries are kept until released through release_shared().
+    _shared_registrars = weakref.WeakKeyDictionary()
+    _shared_registrars_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, zookeeper_client):
+        """Get the shared registrar for the given zookeeper client.
+
+        Users of the same zookeeper client within a process, i.e.
+        service proxies, should use the shared registrar so that
+        a single registry watch, and decoded list of service
+        instances, is maintained per service.
+
+        Each call must be paired with a call to release_shared().
+
+        Args:
+            zookeeper_client: zookeeper client instance.
+        Returns:
+            ZookeeperServiceRegistrar object.
+        """
+        with cls._shared_registrars_lock:
+            if zookeeper_client not in cls._shared_registrars:
+                cls._shared_registrars[zookeeper_client] = [cls(zookeeper_client), 0]
+            entry = cls._shared_registrars[zookeeper_client]
+            entry[1] += 1
+            return entry[0]
+
+    @classmethod
+    def release_shared(cls, zookeeper_client):
+        """Release a reference to the shared registrar.
+
+        Once all references obtained through shared() have been
+        released, the shared registrar is closed and dropped.
+
+        Args:
+            zookeeper_client: zookeeper client instance.
+        """
+        with cls._shared_registrars_lock:
+            entry = cls._shared_registrars.get(zookeeper_client)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del cls._shared_registrars[zookeeper_client]
+                    entry[0]._close()
+
+    def __init__(self, zookeeper_client, registry_coalesce_seconds=0.5):
         """ZookeeperServiceRegistrar constructor.
 
         Args:
             zookeeper_client: zookeeper client instance.
+            registry_coalesce_seconds: optional time in seconds over
+                which registry changes will be coalesced into a single
+                event for registry observers.
         """
         self.zookeeper_client = zookeeper_client
+        self.registry_coalesce_seconds = registry_coalesce_seconds
+
+        #Map of service name to ZookeeperServiceRegistryWatch
+        self.registry_watches = {}
         
-        #Adjust queue for thread/greenlets accordingly.
+        #Adjust queue and lock for thread/greenlets accordingly.
         if isinstance(self.zookeeper_client, ZookeeperClient):
             import Queue
             self.registration_queue = Queue.Queue()
+            self.registry_lock = threading.Lock()
         else:
+            import gevent.coros
             import gevent.queue
             self.registration_queue = gevent.queue.Queue()
+            self.registry_lock = gevent.coros.Semaphore()
 
         #store map of registered service so we can
         #re-register them upon session expiration.
@@ -60,6 +412,21 @@ class ZookeeperServiceRegistrar(ServiceRegistrar):
             #so that services are re-registered when we re-connect.
             for service_node, service in self.registered_services.iteritems():
                 self.registration_queue.put(service)
+        
+        for watch in self.registry_watches.values():
+            watch.session_observer(event)
+
+    def _close(self):
+        """Stop registry watches and remove the session observer.
+
+        Invoked by release_shared() once the shared registrar
+        is no longer referenced.
+        """
+        self.zookeeper_client.remove_session_observer(self._session_observer)
+        with self.registry_lock:
+            for watch in self.registry_watches.values():
+                watch.stop()
+            self.registry_watches = {}
 
     
     def _service_node_path(self, service):
@@ -207,6 +574,12 @@ class ZookeeperServiceRegistrar(ServiceRegistrar):
             (None, None) otherwise.
         """
         result = (None, None)
+
+        #If the registry is already being watched, avoid reading
+        #the registry from zookeeper.
+        watch = self.registry_watches.get(name)
+        if watch is not None:
+            return watch.locate_zookeeper_service(host_affinity)
         
         try:
             services = {}
@@ -283,3 +656,52 @@ class ZookeeperServiceRegistrar(ServiceRegistrar):
             self.log.exception(error)
 
         return result
+
+    def add_registry_observer(self, name, method):
+        """Add a registry observer for the given service.
+
+        The given method will be invoked with the following arguments
+        when instances of the service are added or removed:
+            watch: ZookeeperServiceRegistryWatch object
+            event: ServiceRegistryEvent object
+
+        A single registry watch is shared by all observers of
+        a service. The watch is started when the first observer
+        is added, and stopped when the last observer is removed.
+
+        Args:
+            name: service name
+            method: observer method
+        Returns:
+            ZookeeperServiceRegistryWatch object which may be used
+            to access the current service instances.
+        """
+        with self.registry_lock:
+            if name not in self.registry_watches:
+                watch = ZookeeperServiceRegistryWatch(
+                        self.zookeeper_client,
+                        name,
+                        self.registry_coalesce_seconds)
+                self.registry_watches[name] = watch
+                watch.start()
+
+            watch = self.registry_watches[name]
+            watch.add_observer(method)
+            return watch
+
+    def remove_registry_observer(self, name, method):
+        """Remove a registry observer for the given service.
+
+        Args:
+            name: service name
+            method: observer method previously added with
+                add_registry_observer().
+        """
+        with self.registry_lock:
+            if name in self.registry_watches:
+                watch = self.registry_watches[name]
+                if method in watch.observers:
+                    watch.remove_observer(method)
+                if not watch.observers:
+                    watch.stop()
+                    del self.registry_watches[name]
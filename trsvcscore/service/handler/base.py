@@ -40,3 +40,13 @@ class Handler(object):
         Returns Status enum.
         """
         return
+
+    def after_fork(self):
+        """Reinitialize handler in a forked worker process.
+
+        Invoked by pre-fork servers in each worker process
+        following fork. Handlers should reinitialize any state
+        which does not survive fork, i.e. threads and inherited
+        network connections.
+        """
+        return
@@ -1,10 +1,18 @@
 import logging
+import time
 
 from tridlcore.gen import TRService
 from tridlcore.gen.ttypes import Status
 
-from trpycore.counter.atomic import AtomicCounters
 from trpycore.zookeeper.client import ZookeeperClient
+from trsvcscore.counter.sharded import ShardedCounters
+from trsvcscore.db.replica import Balancing
+from trsvcscore.db.statements import begin_statements, end_statements
+from trsvcscore.metrics.method import MethodMetrics
+from trsvcscore.metrics.slow import SlowRequestLog
+from trsvcscore.metrics.timing import begin_request, end_request
+from trsvcscore.profiler.sampling import PROFILE_OPTIONS, SamplingProfiler, parse_bool, parse_rate
+from trsvcscore.tracing.tracer import extract, parse_sample_rate, set_tracer
 from trsvcscore.registrar.zoo import ZookeeperServiceRegistrar
 from trsvcscore.service.handler.base import Handler
 
@@ -17,7 +25,13 @@ class ServiceHandler(TRService.Iface, Handler):
     """
 
     def __init__(self, service, zookeeper_hosts,
-            database_connection=None, database_connection_pool_size=5):
+            database_connection=None, database_connection_pool_size=5,
+            database_pool_timeout=30, database_pool_recycle=None,
+            database_pool_pre_ping=False, database_replicas=None,
+            database_replica_balancing=Balancing.ROUND_ROBIN,
+            database_repeated_statement_threshold=None,
+            slow_request_threshold=1.0, slow_request_log_size=100,
+            tracer=None):
         """ServiceHandler constructor.
 
         Args:
@@ -26,11 +40,46 @@ class ServiceHandler(TRService.Iface, Handler):
                 instantiation until then.
             zookeeper_hosts: list of zookeeper hosts, i.e. ["localhost:2181", "localdev:2181"]
             database_connection: optional database connection string
+            database_connection_pool_size: database connection pool size
+            database_pool_timeout: seconds to wait for a pooled database
+                connection before raising an exception.
+            database_pool_recycle: optional number of seconds after
+                which database connections are replaced, so that
+                connections are not closed by the database server,
+                or firewalls, while pooled.
+            database_pool_pre_ping: if True, pooled database connections
+                are tested when checked out and replaced if stale, at
+                the cost of a round trip per checkout.
+            database_replicas: optional list of read replica database
+                connection strings. Sessions returned by
+                get_database_session(readonly=True) are routed
+                to healthy replicas, or to the primary database
+                connection if no replica is healthy.
+            database_replica_balancing: Balancing enum value
+                determining how replicas are selected.
+            database_repeated_statement_threshold: optional number of
+                executions of a single statement shape, within a service
+                request, above which a possible N+1 query warning is
+                logged. If None, statements are not tracked.
+            slow_request_threshold: optional duration in seconds at
+                which service requests are recorded in the slow
+                request log. If None, no requests are recorded.
+            slow_request_log_size: maximum number of slow requests
+                to retain.
+            tracer: optional Tracer object. If provided, service
+                requests are traced, and it's set as the default
+                tracer so that service proxy calls are traced.
+                The sample rate may be changed through the
+                trace.sample_rate option.
         """
         self.service = service
-        self.options = {}
-        self.counters = AtomicCounters()
+        self.options = dict(PROFILE_OPTIONS)
+        self.counter_providers = []
+        #Sharded by thread, so worker threads do not contend
+        #on counter locks for each service method call.
+        self.counters = ShardedCounters()
         self.running = False
+        self.zookeeper_hosts = zookeeper_hosts
 
         #Zookeeper client
         self.zookeeper_client = ZookeeperClient(zookeeper_hosts)
@@ -39,27 +88,112 @@ class ServiceHandler(TRService.Iface, Handler):
         if database_connection:
             from sqlalchemy import create_engine
             from sqlalchemy.orm import sessionmaker
-            engine = create_engine(
-                    database_connection,
-                    pool_size=database_connection_pool_size)
-            self.DatabaseSession = sessionmaker(bind=engine)
+            from sqlalchemy.pool import QueuePool
+            from trsvcscore.db.instrument import instrument_engine
+            from trsvcscore.db.pool import PoolMetrics, instrument_pool, instrumented_pool_class
+            from trsvcscore.db.replica import ReplicaRouter
+            from trsvcscore.db.statements import instrument_statements
+
+            def create_database_engine(connection, metrics):
+                engine = create_engine(
+                        connection,
+                        poolclass=instrumented_pool_class(QueuePool, metrics),
+                        pool_size=database_connection_pool_size,
+                        pool_timeout=database_pool_timeout,
+                        pool_recycle=database_pool_recycle or -1)
+                instrument_engine(engine)
+                instrument_pool(engine, metrics, pre_ping=database_pool_pre_ping)
+                if database_repeated_statement_threshold is not None:
+                    instrument_statements(engine)
+                return engine
+
+            self.database_pool_metrics = PoolMetrics()
+            self.database_engine = create_database_engine(
+                    database_connection, self.database_pool_metrics)
+            self.DatabaseSession = sessionmaker(bind=self.database_engine)
+
+            #Read replica engines, each with its own pool
+            self.database_replica_router = ReplicaRouter(
+                    primary=self.database_engine,
+                    replicas=[create_database_engine(replica, PoolMetrics())
+                        for replica in database_replicas or []],
+                    balancing=database_replica_balancing)
         else:
+            self.database_engine = None
+            self.database_pool_metrics = None
+            self.database_replica_router = None
             self.DatabaseSession = None
 
         #Registrar
         self.registrar = ZookeeperServiceRegistrar(self.zookeeper_client)
         
-        #Add counter decorator to track service method calls
+        #Sampling profiler, controlled through profile.* options
+        self.profiler = SamplingProfiler()
+
+        #Recent slow requests with db and proxy time breakdown
+        self.slow_requests = SlowRequestLog(
+                threshold=slow_request_threshold,
+                size=slow_request_log_size)
+
+        #Distributed request tracing
+        self.tracer = tracer
+        if self.tracer is not None:
+            set_tracer(self.tracer)
+            self.options["trace.sample_rate"] = str(self.tracer.sample_rate)
+
+        #Statement counts per request, to detect N+1 queries
+        self.database_repeated_statement_threshold = database_repeated_statement_threshold
+
+        #Per-method call counts, errors, and latency histograms.
+        #Note that these are per process in pre-fork mode.
+        self.method_metrics = MethodMetrics()
+        self.add_counter_provider(self.method_metrics.counters)
+
+        #Database connection pool checkouts, waits, and occupancy
+        if self.database_pool_metrics is not None:
+            self.add_counter_provider(self.database_pool_metrics.counters)
+        if self.database_replica_router is not None and \
+                self.database_replica_router.replicas:
+            self.add_counter_provider(self.database_replica_router.counters)
+
+        #Add counter decorator to track service method calls.
+        #Counters are looked up for each call since servers may
+        #replace them, i.e. with SharedCounters in pre-fork mode.
         def counter_decorator(func):
-            requests_counter = self.counters.get_counter("requests")
-            open_requests_counter = self.counters.get_counter("open_requests")
+            metric = self.method_metrics.get_metric(func.__name__)
             def wrapper(*args, **kwargs):
+                counters = self.counters
+                open_requests_counter = counters.get_counter("open_requests")
+                start = time.time()
+                error = True
+                request_context = parent = None
+                if args:
+                    #Remove trace header added by the calling proxy
+                    request_context, parent = extract(args[0])
+                    args = (request_context,) + args[1:]
+                timing = begin_request(func.__name__, request_context)
+                statements = None
+                if self.database_repeated_statement_threshold is not None:
+                    statements = begin_statements(func.__name__,
+                            self.database_repeated_statement_threshold)
+                if self.tracer is not None:
+                    timing.span = self.tracer.start_span(func.__name__, "server", parent)
                 try:
-                    requests_counter.increment()
+                    counters.get_counter("requests").increment()
                     open_requests_counter.increment()
-                    return func(*args, **kwargs)
+                    result = func(*args, **kwargs)
+                    error = False
+                    return result
                 finally:
                     open_requests_counter.decrement()
+                    metric.record(time.time() - start, error)
+                    end_request(timing)
+                    if statements is not None:
+                        end_statements(statements)
+                        statements.log_repeated()
+                    if timing.span is not None:
+                        timing.span.finish(error)
+                    self.slow_requests.record(timing, args[1:])
             return wrapper
         self._decorate_service_methods(counter_decorator)
 
@@ -97,6 +231,8 @@ class ServiceHandler(TRService.Iface, Handler):
             self.running = True
             self.zookeeper_client.start()
             self.registrar.register_service(self.service)
+            if self.tracer is not None:
+                self.tracer.start()
     
     def join(self, timeout):
         """Join service handler.
@@ -117,6 +253,8 @@ class ServiceHandler(TRService.Iface, Handler):
             self.running = False
             self.registrar.unregister_service(self.service)
             self.zookeeper_client.stop()
+            if self.tracer is not None:
+                self.tracer.stop()
 
     def status(self):
         """Get the handler status.
@@ -128,15 +266,78 @@ class ServiceHandler(TRService.Iface, Handler):
         else:
             return Status.STOPPED
 
-    def get_database_session(self, **kwargs):
+    def after_fork(self):
+        """Reinitialize handler in a forked worker process.
+
+        The zookeeper client's threads do not survive fork, so
+        a new zookeeper client is created for the worker. Note
+        that the service remains registered by the parent process.
+        The worker is given its own database connection pool, so
+        connections are never shared with the parent, and its
+        own tracer span exporter thread.
+        """
+        #Workers may be forked before the handler is started
+        self.running = True
+        self.zookeeper_client = ZookeeperClient(self.zookeeper_hosts)
+        self.registrar = ZookeeperServiceRegistrar(self.zookeeper_client)
+        self.zookeeper_client.start()
+
+        if self.database_engine is not None:
+            #Retain a reference to the inherited pool rather than
+            #closing it, since closing inherited connections would
+            #terminate the parent's database sessions.
+            self.inherited_database_pool = self.database_engine.pool
+            self.database_engine.pool = self.database_engine.pool.recreate()
+
+            self.inherited_database_replica_pools = []
+            for replica in self.database_replica_router.replicas:
+                self.inherited_database_replica_pools.append(replica.pool)
+                replica.pool = replica.pool.recreate()
+
+        if self.tracer is not None:
+            self.tracer.after_fork()
+
+    def add_counter_provider(self, provider):
+        """Add counter provider.
+
+        Counter providers supply counters which are computed
+        on demand, i.e. gauges such as the size of a worker pool,
+        and are included in getCounter() and getCounters().
+
+        Args:
+            provider: method taking no arguments and returning
+                a dict of counter name to value.
+        """
+        self.counter_providers.append(provider)
+
+    def remove_counter_provider(self, provider):
+        """Remove counter provider.
+
+        Args:
+            provider: counter provider previously added
+                with add_counter_provider().
+        """
+        if provider in self.counter_providers:
+            self.counter_providers.remove(provider)
+
+    def get_database_session(self, readonly=False, **kwargs):
         """Return new database SQLAlchemy database session.
 
+        Args:
+            readonly: if True, the session is bound to a healthy
+                read replica, if any. Since replicas may lag the
+                primary, read-only sessions should not be used
+                to read data which was just written, or to lock
+                rows, i.e. when claiming jobs.
+            kwargs: additional SQLAlchemy Session arguments
         Returns:
             new SQLAlchemy session
         Raises:
             RuntimeError: If database_connection not provided to handler.
         """
         if self.DatabaseSession:
+            if readonly and "bind" not in kwargs:
+                kwargs["bind"] = self.database_replica_router.engine()
             return self.DatabaseSession(**kwargs)
         else:
             raise RuntimeError("database_connection not provided")
@@ -192,12 +393,23 @@ class ServiceHandler(TRService.Iface, Handler):
             requestContext: RequestContext object containing user information.
         
         Returns:
-            String description of the current Status enum.
+            String description of the current Status enum,
+            followed by a summary of service method metrics,
+            and of recent slow requests.
         """
         if self.running:
-            return "Alive and well"
+            details = "Alive and well"
         else:
-            return "Dead"
+            details = "Dead"
+
+        summary = self.method_metrics.summary()
+        if summary:
+            details = "%s\n%s" % (details, summary)
+
+        slow_requests = self.slow_requests.summary()
+        if slow_requests:
+            details = "%s\nSlow requests:\n%s" % (details, slow_requests)
+        return details
 
     def getCounter(self, requestContext, key):
         """Get service counter.
@@ -211,8 +423,11 @@ class ServiceHandler(TRService.Iface, Handler):
         """
         if key in self.counters:
             return self.counters[key]
-        else:
-            return -1
+        for provider in self.counter_providers:
+            counters = provider()
+            if key in counters:
+                return counters[key]
+        return -1
 
     def getCounters(self, requestContext):
         """Get service counters.
@@ -223,7 +438,10 @@ class ServiceHandler(TRService.Iface, Handler):
         Returns:
             Dict of service specific counters.
         """
-        return self.counters.as_dict()
+        result = self.counters.as_dict()
+        for provider in self.counter_providers:
+            result.update(provider())
+        return result
 
     def getOption(self, requestContext, key):
         """Get service option.
@@ -235,8 +453,12 @@ class ServiceHandler(TRService.Iface, Handler):
         Returns:
             String value for the option.
         """
-        if key in self.options:
-            return self.options[key]
+        if key == "profile.collapsed":
+            return self.profiler.collapsed()
+
+        options = self.getOptions(requestContext)
+        if key in options:
+            return options[key]
         else:
             return "invalid option"
 
@@ -249,7 +471,11 @@ class ServiceHandler(TRService.Iface, Handler):
         Returns:
             Dict of service specific options  key / values.
         """
-        return self.options
+        #profile.enable reflects the profiler, which
+        #may have stopped once profile.duration elapsed.
+        options = dict(self.options)
+        options["profile.enable"] = str(self.profiler.is_running()).lower()
+        return options
 
     def setOption(self, requestContext, key, value):
         """Set service options.
@@ -258,8 +484,33 @@ class ServiceHandler(TRService.Iface, Handler):
             requestContext: RequestContext object containing user information.
             key: Option name (string)
             value: Option value
+        Raises:
+            ValueError if profile.rate is not a positive number,
+                or trace.sample_rate is not a number between 0 and 1.
         """
+        if key == "profile.rate":
+            parse_rate(value)
+        elif key == "trace.sample_rate":
+            sample_rate = parse_sample_rate(value)
+
         self.options[key] = value
+        if key == "profile.enable":
+            self._update_profiler()
+        elif key == "trace.sample_rate" and self.tracer is not None:
+            self.tracer.sample_rate = sample_rate
+
+    def _update_profiler(self):
+        """Start or stop the profiler per the profile.* options."""
+        if parse_bool(self.options["profile.enable"]):
+            self.profiler.stop()
+            self.profiler.reset()
+            self.profiler.rate = parse_rate(self.options["profile.rate"])
+            self.profiler.idle = parse_bool(self.options["profile.idle"])
+            self.profiler.start(
+                    duration=float(self.options["profile.duration"] or 0),
+                    output=self.options["profile.output"] or None)
+        else:
+            self.profiler.stop()
 
     def shutdown(self, requestContext):
         """Shutdown service.
@@ -4,12 +4,38 @@ import json
 class ServerProtocol(object):
     """Server protocol enum."""
     THRIFT = "thrift"
+    HTTP = "http"
 
 class ServerTransport(object):
     """Server transport enum."""
     TCP = "tcp"
     ZMQ = "zmq"
 
+class ThriftProtocol(object):
+    """Thrift protocol enum.
+    
+    Note that the accelerated binary protocol is wire
+    compatible with the binary protocol, so it is
+    not enumerated separately.
+    """
+    BINARY = "binary"
+    COMPACT = "compact"
+
+class ThriftTransport(object):
+    """Thrift transport enum."""
+    BUFFERED = "buffered"
+    FRAMED = "framed"
+
+class Backpressure(object):
+    """Server backpressure strategy enum.
+
+    BLOCK stops receiving requests until capacity is available.
+    REJECT receives requests and rejects those exceeding capacity
+    immediately, i.e. with a 503 response.
+    """
+    BLOCK = "block"
+    REJECT = "reject"
+
 class ServerEndpoint(object):
     """Server endpoint.
 
@@ -17,7 +43,8 @@ class ServerEndpoint(object):
     Each endpoint contains all the details necessary for a client
     to connect to it.
     """
-    def __init__(self, address, port, protocol, transport):
+    def __init__(self, address, port, protocol, transport,
+            thrift_protocols=None, thrift_transports=None):
         """ServerEndpoint constructor.
 
         Args:
@@ -26,11 +53,21 @@ class ServerEndpoint(object):
             port: Server port (int)
             protocol: ServerProtocol enum
             transport: ServerTransport enum
+            thrift_protocols: optional list of ThriftProtocol enums
+                supported by the endpoint, in order of server
+                preference. If None, clients should assume only
+                ThriftProtocol.BINARY is supported.
+            thrift_transports: optional list of ThriftTransport enums
+                supported by the endpoint, in order of server
+                preference. If None, clients should assume only
+                ThriftTransport.BUFFERED is supported.
         """
         self.address = address
         self.port = port
         self.protocol = protocol
         self.transport = transport
+        self.thrift_protocols = thrift_protocols
+        self.thrift_transports = thrift_transports
 
     @staticmethod
     def from_json(data):
@@ -51,15 +88,19 @@ class ServerEndpoint(object):
                 json_dict["address"],
                 json_dict["port"],
                 json_dict["protocol"],
-                json_dict["transport"])
+                json_dict["transport"],
+                json_dict.get("thrift_protocols"),
+                json_dict.get("thrift_transports"))
     
     def __repr__(self):
-        return "%s(%s, %s, %s, %s" % (
+        return "%s(%s, %s, %s, %s, %r, %r)" % (
                 self.__class__.__name__,
                 self.address,
                 self.port,
                 self.protocol,
-                self.transport)
+                self.transport,
+                self.thrift_protocols,
+                self.thrift_transports)
 
     def to_json(self):
         """Convert ServerEndpoint object to json representation.
@@ -67,12 +108,20 @@ class ServerEndpoint(object):
         Returns:
             Python dict json representation. 
         """
-        return {
+        result = {
             "address": self.address,
             "port": self.port,
             "protocol": self.protocol,
             "transport": self.transport
         }
+        
+        #Only include thrift protocols and transports if advertised,
+        #so registry data is unchanged for servers not advertising them.
+        if self.thrift_protocols is not None:
+            result["thrift_protocols"] = self.thrift_protocols
+        if self.thrift_transports is not None:
+            result["thrift_transports"] = self.thrift_transports
+        return result
 
 class ServerInfo(object):
     """Server information.
@@ -3,19 +3,29 @@ import socket
 import threading
 
 from thrift.transport import TTransport
-from thrift.protocol import TBinaryProtocol
 
 from tridlcore.gen.ttypes import Status
 from trpycore.thrift.server import TThreadPoolServer
 from trpycore.thrift.transport import TNonBlockingServerSocket
 from trpycore.thread.util import join
-from trsvcscore.service.server.base import Server, ServerInfo, ServerEndpoint, ServerProtocol, ServerTransport
+from trsvcscore.service.server.base import Server, ServerInfo, ServerEndpoint, ServerProtocol, ServerTransport, \
+        ThriftProtocol, ThriftTransport
+from trsvcscore.thrift.admission import TAdmissionProcessor
+from trsvcscore.thrift.negotiation import TNegotiatingProcessor, factory_protocols, factory_transports, \
+        protocol_factory as thrift_protocol_factory
+from trsvcscore.counter.shared import SharedCounters
+from trsvcscore.thrift.prefork import TPreforkServer
+from trsvcscore.thrift.server import TMultiplexingServer, TPooledServer
+from trsvcscore.thrift.worker import WorkerPool
 
 class ThriftServer(Server):
     """Thrift based server."""
     def __init__(self, name, interface, port, handler, processor,
             threads=5, address=None, transport=None,
-            transport_factory=None, protocol_factory=None):
+            transport_factory=None, protocol_factory=None,
+            accelerated=True, multiplex=False, processes=1,
+            max_threads=None, idle_timeout=60,
+            max_in_flight=None, max_queue_wait=None, exempt_methods=None):
         """ThriftServer constructor.
 
         Args:
@@ -25,10 +35,9 @@ class ThriftServer(Server):
             handler: ServiceHandler handler instance
             processor: Thrift service processor
             threads: Number of worker threads to allocate.
-                Each thread will handle one and only one client connection
-                at a time, so set this accordingly. In the future this
-                should be enhanced to use a transport which  multiplex connections,
-                and dispatches requests (not connections) to workers.
+                Unless multiplex is True, each thread will handle one
+                and only one client connection at a time, so set this
+                accordingly.
             address: optional address to advertise in ServerInfo.
                 This may be a hostname, fqdn, or ip address. If no
                 address is provided, socket.gethostname() will
@@ -36,6 +45,48 @@ class ThriftServer(Server):
             transport: optional Thrift server transport object
             transport_factory: optional Thrift transport factory
             protocol_factory: optional Thrift protocol factory
+
+            If neither transport_factory nor protocol_factory are
+            provided, the server will negotiate the protocol
+            (binary or compact) and transport (buffered or framed)
+            with each client, and advertise them in ServerInfo.
+
+            accelerated: optional flag indicating that the C-accelerated
+                binary protocol should be used, if installed, for
+                negotiated connections and the default protocol factory.
+            multiplex: optional flag indicating that client connections
+                should be multiplexed by a single event loop which
+                dispatches individual requests (not connections) to
+                the worker threads. This requires clients to use
+                the framed transport, so transport_factory is ignored.
+                If protocol_factory is not provided, the protocol
+                will be detected for each request.
+            processes: optional number of worker processes. If greater
+                than 1, the listening socket will be bound once and
+                shared by forked worker processes, each with the
+                given number of threads. The handler's counters
+                will be replaced with SharedCounters, so that
+                counters are aggregated across workers, and
+                handler.after_fork() will be invoked in each worker.
+            max_threads: optional maximum number of worker threads.
+                If greater than threads, the worker pool will grow
+                from threads up to max_threads when requests wait
+                for a worker, or the handler's open_requests counter
+                reaches the pool size. The pool's size and queue depth
+                are reported in the handler's counters.
+            idle_timeout: optional seconds after which unneeded
+                worker threads beyond threads will exit.
+            max_in_flight: optional maximum number of requests to
+                process concurrently. Additional requests will be
+                rejected with a TApplicationException of type
+                admission.OVERLOADED.
+            max_queue_wait: optional maximum number of seconds requests
+                may wait for a worker thread before requests are
+                rejected. Only applies if multiplex is True, or
+                max_threads is provided.
+            exempt_methods: optional list of method names exempt from
+                max_in_flight and max_queue_wait. Defaults to the
+                service administration methods, i.e. getStatus.
         """
         super(ThriftServer, self).__init__()
         
@@ -45,12 +96,43 @@ class ThriftServer(Server):
         self.handler = handler
         self.processor = processor
         self.threads = threads
+        self.max_threads = max_threads
+        self.idle_timeout = idle_timeout
+        self.processes = processes
         self.address = address or socket.gethostname()
         self.transport = transport or TNonBlockingServerSocket(self.interface, self.port)
+        self.multiplex = multiplex
+        self.negotiate = protocol_factory is None and \
+                (transport_factory is None or self.multiplex)
         self.transport_factory = transport_factory or TTransport.TBufferedTransportFactory()
-        self.protocol_factory = protocol_factory or TBinaryProtocol.TBinaryProtocolFactory()
+        self.accelerated = accelerated
+        self.protocol_factory = protocol_factory or \
+                thrift_protocol_factory(ThriftProtocol.BINARY, self.accelerated)
+        
+        #In pre-fork mode, counters are kept in shared memory with
+        #a row for the parent process (index 0) and each worker.
+        if self.processes > 1:
+            self.handler.counters = SharedCounters(self.processes + 1)
+
+        #Processor to be used by the thrift server, which sheds load
+        #if admission control is enabled. The multiplexing server
+        #detects the protocol of each request itself.
+        self.server_processor = self.processor
+        if max_in_flight is not None or max_queue_wait is not None:
+            self.server_processor = TAdmissionProcessor(
+                    self.server_processor,
+                    max_in_flight=max_in_flight,
+                    max_queue_wait=max_queue_wait,
+                    queue_wait=self._queue_wait,
+                    exempt_methods=exempt_methods,
+                    counters=self.handler.counters)
+        if self.negotiate and not self.multiplex:
+            self.server_processor = TNegotiatingProcessor(
+                    self.server_processor, accelerated=self.accelerated)
+
         self.running = False
         self.server = None
+        self.worker_pool = None
         self._status = Status.STOPPED
 
         self.thread = threading.Thread(target=self.run)
@@ -67,20 +149,17 @@ class ThriftServer(Server):
         errors = 0
         while self.running:
             try:
-                #TODO replace TThreadPoolServer with a transport which
-                #multiplexes connections and dispatches requests
-                #(not connections) to workers.
-                self.server = TThreadPoolServer(
-                        self.processor,
-                        self.transport,
-                        self.transport_factory,
-                        self.protocol_factory,
-                        daemon=True)
-                self.server.setNumThreads(self.threads)
+                if self.processes > 1:
+                    #Workers are forked by start() unless restarting
+                    if self.server is None:
+                        self.server = self._create_prefork_server()
+                else:
+                    self.server = self._create_server(self.transport)
                 self.server.serve()
 
             except Exception as error:
                 logging.exception(error)
+                self.server = None
 
                 errors += 1
                 if errors >= 10:
@@ -88,11 +167,121 @@ class ThriftServer(Server):
                     logging.error("Halting server (errors >=  %s)" % error)
                     break
 
+    def _create_prefork_server(self):
+        """Create pre-fork thrift server.
+
+        Returns:
+            TPreforkServer object.
+        """
+        return TPreforkServer(
+                self.processes,
+                self.transport,
+                self._create_server,
+                after_fork=self._after_fork)
+
+    def _create_server(self, transport):
+        """Create thrift server.
+
+        Args:
+            transport: Thrift server transport
+        Returns:
+            TMultiplexingServer if multiplex is True, TPooledServer
+            if max_threads is greater than threads, TThreadPoolServer
+            otherwise.
+        """
+        if self.multiplex:
+            server = TMultiplexingServer(
+                    self.server_processor,
+                    transport,
+                    protocol_factory=None if self.negotiate else self.protocol_factory,
+                    accelerated=self.accelerated,
+                    worker_pool=self._create_worker_pool())
+        elif self.max_threads is not None and self.max_threads > self.threads:
+            server = TPooledServer(
+                    self.server_processor,
+                    transport,
+                    self.transport_factory,
+                    self.protocol_factory,
+                    self._create_worker_pool())
+        else:
+            server = TThreadPoolServer(
+                    self.server_processor,
+                    transport,
+                    self.transport_factory,
+                    self.protocol_factory,
+                    daemon=True)
+            server.setNumThreads(self.threads)
+        return server
+
+    def _create_worker_pool(self):
+        """Create worker pool and report its counters.
+
+        Returns:
+            WorkerPool object.
+        """
+        #open_requests is aggregated across processes in pre-fork
+        #mode, so it's only a measure of this pool's load otherwise.
+        load = None
+        if self.processes <= 1:
+            load = self._open_requests
+
+        if self.worker_pool is not None:
+            self.handler.remove_counter_provider(self.worker_pool.counters)
+
+        self.worker_pool = WorkerPool(
+                min_threads=self.threads,
+                max_threads=self.max_threads,
+                name="thrift_worker",
+                idle_timeout=self.idle_timeout,
+                load=load)
+        self.handler.add_counter_provider(self.worker_pool.counters)
+        return self.worker_pool
+
+    def _queue_wait(self):
+        """Get the time the oldest queued request has waited.
+
+        Returns:
+            seconds the oldest request has waited for a worker,
+            or 0 if the server does not use a WorkerPool.
+        """
+        if self.worker_pool is not None:
+            return self.worker_pool.queue_wait()
+        return 0
+
+    def _open_requests(self):
+        """Get the handler's open_requests counter.
+
+        Returns:
+            number of requests in progress.
+        """
+        if "open_requests" in self.handler.counters:
+            return self.handler.counters["open_requests"]
+        return 0
+
+    def _after_fork(self, index):
+        """Pre-fork worker process initialization.
+
+        Args:
+            index: worker index
+        """
+        self.handler.counters.set_process_index(index + 1)
+        self.handler.after_fork()
+
     def start(self):
         """Start server."""
         if not self.running:
             self._status = Status.STARTING
             self.running = True
+
+            #Fork workers before the handler starts the zookeeper
+            #client's threads, since a worker forked while another
+            #thread holds a lock would deadlock on it. Note that
+            #servers started prior to this one may have started
+            #threads, so pre-fork servers should be started first.
+            if self.processes > 1:
+                self.server = self._create_prefork_server()
+                self.server.start()
+
             self.handler.start()
             self.thread.start()
     
@@ -159,10 +348,25 @@ class ThriftServer(Server):
         Returns:
             ServerInfo object.
         """
+        if self.multiplex:
+            thrift_transports = [ThriftTransport.FRAMED]
+            if self.negotiate:
+                thrift_protocols = [ThriftProtocol.BINARY, ThriftProtocol.COMPACT]
+            else:
+                thrift_protocols = factory_protocols(self.protocol_factory)
+        elif self.negotiate:
+            thrift_protocols = self.server_processor.protocols
+            thrift_transports = self.server_processor.transports
+        else:
+            thrift_protocols = factory_protocols(self.protocol_factory)
+            thrift_transports = factory_transports(self.transport_factory)
+
         endpoint = ServerEndpoint(
                 address=self.address,
                 port=self.port,
                 protocol=ServerProtocol.THRIFT,
-                transport=ServerTransport.TCP)
+                transport=ServerTransport.TCP,
+                thrift_protocols=thrift_protocols,
+                thrift_transports=thrift_transports)
         
         return ServerInfo(self.name, [endpoint])
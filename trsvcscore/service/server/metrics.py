@@ -0,0 +1,157 @@
+import BaseHTTPServer
+import logging
+import socket
+import SocketServer
+import threading
+
+from tridlcore.gen.ttypes import Status
+from trpycore.thread.util import join
+from trsvcscore.metrics.exposition import CONTENT_TYPE, render
+from trsvcscore.service.server.base import Server, ServerInfo, ServerEndpoint, ServerProtocol, ServerTransport
+
+class MetricsHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded HTTP server for metrics requests."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """HTTP request handler which renders handler metrics.
+
+    The service handler is provided through the server's
+    service_handler attribute.
+    """
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404, "not found")
+            return
+
+        #Metrics are written as they are rendered, without
+        #a content-length, so the connection is closed.
+        self.close_connection = 1
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.end_headers()
+        for chunk in render(self.server.service_handler):
+            self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+
+class MetricsServer(Server):
+    """Metrics HTTP server.
+
+    Exposes service handler counters, method latency histograms,
+    pool occupancy, and database connection pool stats at
+    /metrics in the Prometheus text exposition format. Requests
+    are served in their own threads, so scrapes never occupy
+    service worker threads.
+
+    The server is intended to be included in a service's
+    servers alongside its ThriftServer, which is responsible
+    for starting and stopping the handler.
+
+    Note that with a pre-fork ThriftServer, handler counters are
+    aggregated across worker processes, but method latency
+    histograms are not. Since the metrics server runs in the
+    parent process, which serves no requests, method histograms
+    are only those of the parent process.
+
+    Example usage:
+        servers = [
+            ThriftServer(...),
+            MetricsServer("chatsvc-metrics", "0.0.0.0", 9090, handler)
+        ]
+    """
+
+    def __init__(self, name, interface, port, handler, address=None):
+        """MetricsServer constructor.
+
+        Args:
+            name: server name, i.e. chatsvc-metrics
+            interface: interface for server to listen on, 0.0.0.0 for all.
+            port: server port
+            handler: ServiceHandler handler instance
+            address: optional address to advertise in ServerInfo.
+                This may be a hostname, fqdn, or ip address. If no
+                address is provided, socket.gethostname() will
+                be used.
+        """
+        self.name = name
+        self.interface = interface
+        self.port = port
+        self.handler = handler
+        self.address = address or socket.gethostname()
+        self.server = None
+        self.thread = None
+        self.running = False
+        self._status = Status.STOPPED
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def start(self):
+        """Start server."""
+        if not self.running:
+            self._status = Status.STARTING
+            self.running = True
+            self.server = MetricsHTTPServer(
+                    (self.interface, self.port),
+                    MetricsRequestHandler)
+            self.server.service_handler = self.handler
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        """Run server."""
+        self._status = Status.ALIVE
+        try:
+            self.server.serve_forever()
+        except Exception as error:
+            self.log.exception(error)
+            self._status = Status.DEAD
+        finally:
+            self.server.server_close()
+
+        if self._status != Status.DEAD:
+            self._status = Status.STOPPED
+
+    def stop(self):
+        """Stop server."""
+        if self.running:
+            self._status = Status.STOPPING
+            self.running = False
+            self.server.shutdown()
+
+    def join(self, timeout=None):
+        """Join the server.
+
+        Args:
+            timeout: Optional timeout in seconds to observe before returning.
+                If timeout is specified, the status() method must be called
+                to determine if the server is still running.
+        """
+        if self.thread is not None:
+            join([self.thread], timeout)
+
+    def status(self):
+        """Get server status.
+
+        Returns:
+            Status enum.
+        """
+        return self._status
+
+    def info(self):
+        """Get server info.
+
+        Returns:
+            ServerInfo object.
+        """
+        endpoint = ServerEndpoint(
+                address=self.address,
+                port=self.port,
+                protocol=ServerProtocol.HTTP,
+                transport=ServerTransport.TCP)
+        return ServerInfo(self.name, [endpoint])
@@ -2,21 +2,28 @@ import logging
 import socket
 
 import gevent
+import gevent.pool
 
 from thrift import Thrift
 from thrift.transport import TTransport
-from thrift.protocol import TBinaryProtocol
 
 from tridlcore.gen.ttypes import Status
 from trpycore.greenlet.util import join
 from trpycore.thrift_gevent.server import TGeventServer
 from trpycore.thrift_gevent.transport import TNonBlockingServerSocket
-from trsvcscore.service.server.base import Server, ServerInfo, ServerEndpoint, ServerProtocol, ServerTransport
+from trsvcscore.service.server.base import Backpressure, Server, ServerInfo, ServerEndpoint, ServerProtocol, ServerTransport, \
+        ThriftProtocol
+from trsvcscore.thrift.admission import TAdmissionProcessor
+from trsvcscore.thrift.negotiation import TNegotiatingProcessor, factory_protocols, factory_transports, \
+        protocol_factory as thrift_protocol_factory
+from trsvcscore.thrift_gevent.server import TGeventPoolServer, pool_counters
 
 class GThriftServer(Server):
     """Gevent Thrift Server."""
     def __init__(self, name, interface, port, handler, processor, address=None,
-            transport=None, transport_factory=None, protocol_factory=None):
+            transport=None, transport_factory=None, protocol_factory=None,
+            accelerated=True, max_in_flight=None, exempt_methods=None,
+            pool_size=None, backpressure=Backpressure.BLOCK):
         """GThriftServer constructor.
 
         Args:
@@ -32,6 +39,32 @@ class GThriftServer(Server):
             transport: optional Thrift server transport object
             transport_factory: optional Thrift transport factory
             protocol_factory: optional Thrift protocol factory
+
+            If neither transport_factory nor protocol_factory are
+            provided, the server will negotiate the protocol
+            (binary or compact) and transport (buffered or framed)
+            with each client, and advertise them in ServerInfo.
+
+            accelerated: optional flag indicating that the C-accelerated
+                binary protocol should be used, if installed, for
+                negotiated connections and the default protocol factory.
+            max_in_flight: optional maximum number of requests to
+                process concurrently. Additional requests will be
+                rejected with a TApplicationException of type
+                admission.OVERLOADED.
+            exempt_methods: optional list of method names exempt from
+                max_in_flight. Defaults to the service administration
+                methods, i.e. getStatus.
+            pool_size: optional maximum number of client connections
+                to serve concurrently. If provided, connection
+                greenlets are spawned in a bounded gevent Pool, and
+                its occupancy is reported in the thrift_pool_size,
+                thrift_pool_occupancy, and thrift_pool_free counters.
+            backpressure: Backpressure enum specifying how connections
+                are handled when the pool is full. BLOCK leaves them
+                in the listen backlog until a greenlet is available,
+                and REJECT closes them immediately, counting them in
+                the thrift_pool_rejected counter.
         """
         
         self.name = name
@@ -41,8 +74,32 @@ class GThriftServer(Server):
         self.processor = processor
         self.address = address or socket.gethostname()
         self.transport = transport or TNonBlockingServerSocket(self.interface, self.port)
+        self.negotiate = transport_factory is None and protocol_factory is None
         self.transport_factory = transport_factory or TTransport.TBufferedTransportFactory()
-        self.protocol_factory = protocol_factory or TBinaryProtocol.TBinaryProtocolFactory()
+        self.accelerated = accelerated
+        self.protocol_factory = protocol_factory or \
+                thrift_protocol_factory(ThriftProtocol.BINARY, self.accelerated)
+        
+        #Processor to be used by the thrift server, which sheds
+        #load if admission control is enabled.
+        self.server_processor = self.processor
+        if max_in_flight is not None:
+            self.server_processor = TAdmissionProcessor(
+                    self.server_processor,
+                    max_in_flight=max_in_flight,
+                    exempt_methods=exempt_methods,
+                    counters=self.handler.counters)
+        if self.negotiate:
+            self.server_processor = TNegotiatingProcessor(
+                    self.server_processor, accelerated=self.accelerated)
+
+        #Bounded connection greenlet pool
+        self.pool = None
+        self.backpressure = backpressure
+        if pool_size is not None:
+            self.pool = gevent.pool.Pool(pool_size)
+            self.handler.add_counter_provider(self._pool_counters)
+
         self.greenlet = None
         self.server = None
         self.running = False
@@ -64,7 +121,7 @@ class GThriftServer(Server):
         
         while self.running:
             try:
-                self.server = TGeventServer(self.processor, self.transport, self.transport_factory, self.protocol_factory)
+                self.server = self._create_server()
                 self.server.serve()
 
             except Exception as error:
@@ -83,6 +140,38 @@ class GThriftServer(Server):
         if self._status != Status.DEAD:
             self._status = Status.STOPPED
     
+    def _create_server(self):
+        """Create thrift server.
+
+        Returns:
+            TGeventPoolServer if pool_size was provided,
+            TGeventServer otherwise.
+        """
+        if self.pool is not None:
+            server = TGeventPoolServer(
+                    self.server_processor,
+                    self.transport,
+                    self.transport_factory,
+                    self.protocol_factory,
+                    self.pool,
+                    backpressure=self.backpressure,
+                    counters=self.handler.counters)
+        else:
+            server = TGeventServer(
+                    self.server_processor,
+                    self.transport,
+                    self.transport_factory,
+                    self.protocol_factory)
+        return server
+
+    def _pool_counters(self):
+        """Get connection pool occupancy counters.
+
+        Returns:
+            dict of counter name to value.
+        """
+        return pool_counters(self.pool, "thrift_pool")
+
     def stop(self):
         """Stop server."""
         if self.running:
@@ -119,10 +208,19 @@ class GThriftServer(Server):
         Returns:
             ServerInfo object.
         """
+        if self.negotiate:
+            thrift_protocols = self.server_processor.protocols
+            thrift_transports = self.server_processor.transports
+        else:
+            thrift_protocols = factory_protocols(self.protocol_factory)
+            thrift_transports = factory_transports(self.transport_factory)
+
         endpoint = ServerEndpoint(
                 address=self.address,
                 port=self.port,
                 protocol=ServerProtocol.THRIFT,
-                transport=ServerTransport.TCP)
+                transport=ServerTransport.TCP,
+                thrift_protocols=thrift_protocols,
+                thrift_transports=thrift_transports)
         
         return ServerInfo(self.name, [endpoint])
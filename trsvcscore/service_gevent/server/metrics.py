@@ -0,0 +1,143 @@
+import logging
+import socket
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from tridlcore.gen.ttypes import Status
+from trsvcscore.metrics.exposition import CONTENT_TYPE, render
+from trsvcscore.service.server.base import Server, ServerInfo, ServerEndpoint, ServerProtocol, ServerTransport
+
+class GMetricsServer(Server):
+    """Gevent metrics HTTP server.
+
+    Exposes service handler counters, method latency histograms,
+    pool occupancy, and database connection pool stats at
+    /metrics in the Prometheus text exposition format.
+
+    Metrics are streamed as they are rendered, and the rendering
+    greenlet yields between chunks, so scraping a service with
+    many series does not stall request greenlets.
+
+    The server is intended to be included in a service's
+    servers alongside its GThriftServer, which is responsible
+    for starting and stopping the handler.
+    """
+
+    #Number of rendered chunks between yields to other greenlets
+    CHUNKS_PER_YIELD = 10
+
+    def __init__(self, name, interface, port, handler, address=None):
+        """GMetricsServer constructor.
+
+        Args:
+            name: server name, i.e. chatsvc-metrics
+            interface: interface for server to listen on, 0.0.0.0 for all.
+            port: server port
+            handler: GServiceHandler handler instance
+            address: optional address to advertise in ServerInfo.
+                This may be a hostname, fqdn, or ip address. If no
+                address is provided, socket.gethostname() will
+                be used.
+        """
+        self.name = name
+        self.interface = interface
+        self.port = port
+        self.handler = handler
+        self.address = address or socket.gethostname()
+        self.server = None
+        self.greenlet = None
+        self.running = False
+        self._status = Status.STOPPED
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def start(self):
+        """Start server."""
+        if not self.running:
+            self._status = Status.STARTING
+            self.running = True
+            self.server = WSGIServer(
+                    (self.interface, self.port),
+                    self.application,
+                    log=None)
+            self.greenlet = gevent.spawn(self.run)
+
+    def run(self):
+        """Run server."""
+        self._status = Status.ALIVE
+        try:
+            self.server.serve_forever()
+        except gevent.GreenletExit:
+            pass
+        except Exception as error:
+            self.log.exception(error)
+            self._status = Status.DEAD
+
+        if self._status != Status.DEAD:
+            self._status = Status.STOPPED
+
+    def stop(self):
+        """Stop server."""
+        if self.running:
+            self._status = Status.STOPPING
+            self.running = False
+            self.server.stop()
+
+    def join(self, timeout=None):
+        """Join the server.
+
+        Args:
+            timeout: Optional timeout in seconds to observe before returning.
+                If timeout is specified, the status() method must be called
+                to determine if the server is still running.
+        """
+        if self.greenlet is not None:
+            self.greenlet.join(timeout)
+
+    def status(self):
+        """Get server status.
+
+        Returns:
+            Status enum.
+        """
+        return self._status
+
+    def info(self):
+        """Get server info.
+
+        Returns:
+            ServerInfo object.
+        """
+        endpoint = ServerEndpoint(
+                address=self.address,
+                port=self.port,
+                protocol=ServerProtocol.HTTP,
+                transport=ServerTransport.TCP)
+        return ServerInfo(self.name, [endpoint])
+
+    def application(self, environ, start_response):
+        """WSGI application rendering metrics.
+
+        Args:
+            environ: WSGI environment
+            start_response: WSGI start_response method
+        Returns:
+            iterable of response chunks.
+        """
+        if environ.get("PATH_INFO") != "/metrics":
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return ["not found"]
+
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE)])
+        return self._render()
+
+    def _render(self):
+        """Render metrics, yielding to other greenlets periodically.
+
+        Returns:
+            generator yielding response chunks.
+        """
+        for index, chunk in enumerate(render(self.handler)):
+            yield chunk
+            if index % self.CHUNKS_PER_YIELD == self.CHUNKS_PER_YIELD - 1:
+                gevent.sleep(0)
@@ -1,16 +1,19 @@
 import logging
 
 import gevent
+import gevent.pool
 
 from tridlcore.gen.ttypes import Status
 from trpycore.mongrel2_gevent.handler import GConnection
-from trsvcscore.service.server.base import Server, ServerInfo
+from trsvcscore.service.server.base import Backpressure, Server, ServerInfo
+from trsvcscore.thrift_gevent.server import pool_counters
 
 class GMongrel2Server(Server):
     """Greenlet Mongrel2 server."""
 
     def __init__(self, name, mongrel2_sender_id,
-            mongrel2_pull_addr, mongrel2_pub_addr, handler):
+            mongrel2_pull_addr, mongrel2_pub_addr, handler,
+            pool_size=None, backpressure=Backpressure.BLOCK):
         """GMongrel2Service constructor.
         Args:
             name: server name, i.e. chatsvc-mongrel
@@ -18,7 +21,19 @@ class GMongrel2Server(Server):
             mongrel2_pull_addr: zeromq style pull address
             mongrel2_pub_addr: zeromq style pub address
             handler: GServiceHandler handler instance
+            pool_size: optional maximum number of requests to handle
+                concurrently. If provided, request greenlets are
+                spawned in a bounded gevent Pool, whose occupancy
+                is reported by counters().
+            backpressure: Backpressure enum specifying how requests
+                are handled when the pool is full. BLOCK stops
+                receiving requests until a greenlet is available,
+                and REJECT replies 503 immediately. Disconnect
+                notifications are never rejected.
         """
+        if backpressure not in (Backpressure.BLOCK, Backpressure.REJECT):
+            raise ValueError("invalid backpressure (%s)" % backpressure)
+
         self.name = name
         self.mongrel2_sender_id = mongrel2_sender_id
         self.mongrel2_pull_addr = mongrel2_pull_addr
@@ -27,6 +42,15 @@ class GMongrel2Server(Server):
         self.running = False
         self._status = Status.STOPPED
         self.greenlet = None
+        self.backpressure = backpressure
+        self.rejected = 0
+
+        #Unbounded pool if pool_size is not provided
+        self.pool = gevent.pool.Pool(pool_size)
+
+        #Report pool counters through handlers which support it
+        if hasattr(self.handler, "add_counter_provider"):
+            self.handler.add_counter_provider(self.counters)
 
     def start(self):
         """Start server."""
@@ -67,7 +91,13 @@ class GMongrel2Server(Server):
         while self.running:
             try:
                 request = connection.recv()
-                gevent.spawn(self.handler.handle, connection, request)
+                if self.backpressure == Backpressure.REJECT \
+                        and self.pool.full() \
+                        and not request.is_disconnect():
+                    self._reject(connection, request)
+                else:
+                    #Blocks until a greenlet is available
+                    self.pool.spawn(self.handler.handle, connection, request)
             
             except Exception as error:
                 logging.exception(error)
@@ -78,6 +108,35 @@ class GMongrel2Server(Server):
 
         self._status = Status.STOPPED
 
+    def counters(self):
+        """Get request pool counters.
+
+        Counters are included in service counters if the
+        handler supports add_counter_provider().
+
+        Returns:
+            dict of counter name to value.
+        """
+        result = {"mongrel2_pool_rejected": self.rejected}
+        if self.pool.size is not None:
+            result.update(pool_counters(self.pool, "mongrel2_pool"))
+        else:
+            result["mongrel2_pool_occupancy"] = len(self.pool)
+        return result
+
+    def _reject(self, connection, request):
+        """Reject request with 503 response.
+
+        Args:
+            connection: GConnection object
+            request: Mongrel2 request
+        """
+        self.rejected += 1
+        try:
+            connection.reply_http(request, "service unavailable", code=503)
+        except Exception as error:
+            logging.exception(error)
+
     def status(self):
         """Get server status.
 
@@ -0,0 +1,177 @@
+import logging
+import threading
+
+from thrift.Thrift import TApplicationException, TMessageType, TType
+
+#TApplicationException type for requests rejected due to overload.
+#Clients should treat these as retryable, preferably against
+#another service instance.
+OVERLOADED = 503
+
+#Service administration methods, defined in TRService, which
+#are exempt from admission control by default, so services
+#can be monitored and managed while overloaded.
+ADMIN_METHODS = [
+    "getName",
+    "getVersion",
+    "getBuildNumber",
+    "getStatus",
+    "getStatusDetails",
+    "getCounter",
+    "getCounters",
+    "getOption",
+    "getOptions",
+    "setOption",
+    "shutdown",
+    "reinitialize"
+]
+
+def is_overloaded(error):
+    """Check if an exception indicates an overloaded service.
+
+    Args:
+        error: exception raised by a service client
+    Returns:
+        True if the request was rejected by admission control.
+    """
+    return isinstance(error, TApplicationException) and error.type == OVERLOADED
+
+
+class TAdmissionProcessor(object):
+    """Thrift processor which sheds load when overloaded.
+
+    Wraps a generated Thrift service processor, rejecting requests
+    early, before they're read or handled, if the number of requests
+    in flight reaches max_in_flight, or if requests have been waiting
+    for a worker longer than max_queue_wait. Rejected requests receive
+    a TApplicationException of type OVERLOADED.
+
+    Methods in exempt_methods, i.e. service administration methods,
+    are always admitted, and do not count towards max_in_flight.
+
+    Shed requests are counted in the shed_requests counter, and
+    by reason in the shed_requests_in_flight and
+    shed_requests_queue_wait counters.
+
+    Note that the wrapped processor's protocols are used as is,
+    so the C-accelerated binary protocol is preserved.
+    """
+
+    def __init__(self, processor, max_in_flight=None, max_queue_wait=None,
+            queue_wait=None, exempt_methods=None, counters=None):
+        """TAdmissionProcessor constructor.
+
+        Args:
+            processor: generated Thrift service processor
+            max_in_flight: optional maximum number of non-exempt
+                requests processed concurrently.
+            max_queue_wait: optional maximum number of seconds
+                requests may wait for a worker.
+            queue_wait: optional method taking no arguments and
+                returning the number of seconds the oldest queued
+                request has been waiting. Required for max_queue_wait.
+            exempt_methods: optional list of method names which
+                are always admitted. Defaults to ADMIN_METHODS.
+            counters: optional counters object, i.e. handler counters,
+                in which to count shed requests.
+        """
+        self.processor = processor
+        self.max_in_flight = max_in_flight
+        self.max_queue_wait = max_queue_wait
+        self.queue_wait = queue_wait
+        self.exempt_methods = set(exempt_methods if exempt_methods is not None else ADMIN_METHODS)
+        self.counters = counters
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def _admit(self):
+        """Admit a non-exempt request.
+
+        Returns:
+            None if the request is admitted, in which case
+            _release() must be called once it's processed.
+            Otherwise, the reason the request is rejected.
+        """
+        if self.max_queue_wait is not None and self.queue_wait is not None:
+            if self.queue_wait() > self.max_queue_wait:
+                return "queue_wait"
+
+        with self.lock:
+            if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+                return "in_flight"
+            self.in_flight += 1
+        return None
+
+    def _release(self):
+        """Release an admitted request."""
+        with self.lock:
+            self.in_flight -= 1
+
+    def _reject(self, name, type, seqid, iprot, oprot, error_type, message):
+        """Reject request with TApplicationException.
+
+        Args:
+            name: method name
+            type: message type
+            seqid: message sequence id
+            iprot: input protocol
+            oprot: output protocol
+            error_type: TApplicationException type
+            message: exception message
+        """
+        iprot.skip(TType.STRUCT)
+        iprot.readMessageEnd()
+
+        #Oneway requests do not expect a response
+        if type == TMessageType.ONEWAY:
+            return
+
+        error = TApplicationException(error_type, message)
+        oprot.writeMessageBegin(name, TMessageType.EXCEPTION, seqid)
+        error.write(oprot)
+        oprot.writeMessageEnd()
+        oprot.trans.flush()
+
+    def _count_shed(self, reason):
+        """Count shed request.
+
+        Args:
+            reason: reason request was shed
+        """
+        if self.counters is not None:
+            self.counters.get_counter("shed_requests").increment()
+            self.counters.get_counter("shed_requests_%s" % reason).increment()
+
+    def process(self, iprot, oprot):
+        """Process a single request.
+
+        Args:
+            iprot: input protocol
+            oprot: output protocol
+        """
+        name, type, seqid = iprot.readMessageBegin()
+
+        method = self.processor._processMap.get(name)
+        if method is None:
+            self._reject(name, type, seqid, iprot, oprot,
+                    TApplicationException.UNKNOWN_METHOD,
+                    "Unknown function %s" % name)
+            return
+
+        if name in self.exempt_methods:
+            method(self.processor, seqid, iprot, oprot)
+            return True
+
+        reason = self._admit()
+        if reason is not None:
+            self._count_shed(reason)
+            self._reject(name, type, seqid, iprot, oprot,
+                    OVERLOADED, "service overloaded (%s)" % reason)
+            return
+
+        try:
+            method(self.processor, seqid, iprot, oprot)
+        finally:
+            self._release()
+        return True
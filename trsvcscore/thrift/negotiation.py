@@ -0,0 +1,298 @@
+import weakref
+
+from thrift.protocol import TBinaryProtocol, TCompactProtocol
+from thrift.transport import TTransport
+
+from trsvcscore.service.server.base import ThriftProtocol, ThriftTransport
+
+#C-accelerated binary protocol codec, if installed.
+try:
+    from thrift.protocol import fastbinary
+except ImportError:
+    fastbinary = None
+
+#Client protocol preference, most preferred first.
+#The pure python compact protocol is preferred over the pure python
+#binary protocol since it's smaller on the wire with comparable cost.
+#If the C-accelerated binary codec is available, it is considerably
+#faster than either, so it's preferred.
+PROTOCOL_PREFERENCE = [ThriftProtocol.COMPACT, ThriftProtocol.BINARY]
+ACCELERATED_PROTOCOL_PREFERENCE = [ThriftProtocol.BINARY, ThriftProtocol.COMPACT]
+
+#Client transport preference, most preferred first.
+TRANSPORT_PREFERENCE = [ThriftTransport.FRAMED, ThriftTransport.BUFFERED]
+
+#Protocols and transports assumed for endpoints which do not advertise them.
+DEFAULT_PROTOCOLS = [ThriftProtocol.BINARY]
+DEFAULT_TRANSPORTS = [ThriftTransport.BUFFERED]
+
+#First byte of a strict binary / compact protocol message
+BINARY_PROTOCOL_ID = 0x80
+COMPACT_PROTOCOL_ID = TCompactProtocol.TCompactProtocol.PROTOCOL_ID
+
+
+def is_accelerated(accelerated=True):
+    """Determine if the C-accelerated binary codec should be used.
+
+    Args:
+        accelerated: flag indicating if the accelerated codec
+            is desired.
+    Returns:
+        True if accelerated is True and the codec is installed.
+    """
+    return accelerated and fastbinary is not None
+
+def protocol_class(protocol, accelerated=True):
+    """Get the Thrift protocol class for a ThriftProtocol enum.
+
+    Note that the generated Thrift code will only use the C-accelerated
+    codec for TBinaryProtocolAccelerated (not subclasses) over a
+    CReadableTransport, i.e. TBufferedTransport or TFramedTransport.
+
+    Args:
+        protocol: ThriftProtocol enum
+        accelerated: optional flag indicating that the
+            C-accelerated binary protocol should be used
+            if it's installed.
+    Returns:
+        Thrift protocol class.
+    """
+    if protocol == ThriftProtocol.COMPACT:
+        return TCompactProtocol.TCompactProtocol
+    elif is_accelerated(accelerated):
+        return TBinaryProtocol.TBinaryProtocolAccelerated
+    else:
+        return TBinaryProtocol.TBinaryProtocol
+
+def protocol_factory(protocol, accelerated=True):
+    """Get a Thrift protocol factory for a ThriftProtocol enum.
+
+    Args:
+        protocol: ThriftProtocol enum
+        accelerated: optional flag indicating that the
+            C-accelerated binary protocol should be used
+            if it's installed.
+    Returns:
+        Thrift protocol factory.
+    """
+    if protocol == ThriftProtocol.COMPACT:
+        return TCompactProtocol.TCompactProtocolFactory()
+    elif is_accelerated(accelerated):
+        return TBinaryProtocol.TBinaryProtocolAcceleratedFactory()
+    else:
+        return TBinaryProtocol.TBinaryProtocolFactory()
+
+def protocol_preference(accelerated=True):
+    """Get the client protocol preference.
+
+    Args:
+        accelerated: optional flag indicating that the
+            C-accelerated binary protocol should be used
+            if it's installed.
+    Returns:
+        list of ThriftProtocol enums, most preferred first.
+    """
+    if is_accelerated(accelerated):
+        return ACCELERATED_PROTOCOL_PREFERENCE
+    else:
+        return PROTOCOL_PREFERENCE
+
+def transport_class(transport):
+    """Get the Thrift transport class for a ThriftTransport enum.
+
+    Args:
+        transport: ThriftTransport enum
+    Returns:
+        Thrift transport class which wraps another transport.
+    """
+    if transport == ThriftTransport.FRAMED:
+        return TTransport.TFramedTransport
+    else:
+        return TTransport.TBufferedTransport
+
+def select_protocol(endpoint, preference=None):
+    """Select the most preferred protocol supported by endpoint.
+
+    Args:
+        endpoint: ServerEndpoint object or None.
+        preference: optional list of ThriftProtocol enums, most
+            preferred first. Defaults to protocol_preference().
+    Returns:
+        ThriftProtocol enum.
+    """
+    preference = preference or protocol_preference()
+    supported = DEFAULT_PROTOCOLS
+    if endpoint is not None and endpoint.thrift_protocols:
+        supported = endpoint.thrift_protocols
+    for protocol in preference:
+        if protocol in supported:
+            return protocol
+    return ThriftProtocol.BINARY
+
+def select_transport(endpoint, preference=None):
+    """Select the most preferred transport supported by endpoint.
+
+    Args:
+        endpoint: ServerEndpoint object or None.
+        preference: optional list of ThriftTransport enums, most
+            preferred first. Defaults to TRANSPORT_PREFERENCE.
+    Returns:
+        ThriftTransport enum.
+    """
+    preference = preference or TRANSPORT_PREFERENCE
+    supported = DEFAULT_TRANSPORTS
+    if endpoint is not None and endpoint.thrift_transports:
+        supported = endpoint.thrift_transports
+    for transport in preference:
+        if transport in supported:
+            return transport
+    return ThriftTransport.BUFFERED
+
+def factory_protocols(protocol_factory):
+    """Get the protocols supported by a Thrift protocol factory.
+
+    Args:
+        protocol_factory: Thrift protocol factory
+    Returns:
+        list of ThriftProtocol enums, or None if unknown.
+    """
+    if isinstance(protocol_factory, TCompactProtocol.TCompactProtocolFactory):
+        return [ThriftProtocol.COMPACT]
+    elif isinstance(protocol_factory, (
+            TBinaryProtocol.TBinaryProtocolFactory,
+            TBinaryProtocol.TBinaryProtocolAcceleratedFactory)):
+        return [ThriftProtocol.BINARY]
+    return None
+
+def factory_transports(transport_factory):
+    """Get the transports supported by a Thrift transport factory.
+
+    Args:
+        transport_factory: Thrift transport factory
+    Returns:
+        list of ThriftTransport enums, or None if unknown.
+    """
+    if isinstance(transport_factory, TTransport.TFramedTransportFactory):
+        return [ThriftTransport.FRAMED]
+    elif isinstance(transport_factory, TTransport.TBufferedTransportFactory):
+        return [ThriftTransport.BUFFERED]
+    return None
+
+def peek(trans, sz):
+    """Peek at the next sz bytes of a CReadableTransport.
+
+    Args:
+        trans: Thrift CReadableTransport, i.e. TBufferedTransport
+    Returns:
+        string of sz bytes which will be returned by the next
+        read from the transport.
+    Raises:
+        TTransportException if the transport is closed.
+    """
+    buf = trans.cstringio_buf
+    data = buf.read(sz)
+    if len(data) < sz:
+        buf = trans.cstringio_refill(data, sz)
+        data = buf.read(sz)
+    buf.seek(buf.tell() - len(data))
+
+    if len(data) < sz:
+        raise TTransport.TTransportException(
+                TTransport.TTransportException.END_OF_FILE,
+                "transport closed")
+    return data
+
+
+class TNegotiatingProcessor(object):
+    """Thrift processor which negotiates protocol and transport.
+
+    Wraps a Thrift processor, detecting the protocol and transport
+    used by each client connection from the first bytes it sends,
+    so a single server can accept binary and compact protocols,
+    over both buffered and framed transports. Responses are written
+    using the protocol and transport of the request.
+
+    Detection relies on strict protocol messages, which begin
+    with a protocol id byte (0x80 for binary, 0x82 for compact).
+    Framed messages begin with a 4-byte frame length instead.
+    Note that the Thrift binary protocol writes strict messages
+    by default.
+
+    The server's transport factory must produce CReadableTransport's
+    (i.e. TBufferedTransportFactory), and the server's protocol
+    factory is only used to provide access to these transports.
+    """
+
+    def __init__(self, processor, protocols=None, transports=None, accelerated=True):
+        """TNegotiatingProcessor constructor.
+
+        Args:
+            processor: Thrift service processor
+            protocols: optional list of ThriftProtocol enums to accept.
+                Defaults to all protocols.
+            transports: optional list of ThriftTransport enums to accept.
+                Defaults to all transports.
+            accelerated: optional flag indicating that the
+                C-accelerated binary protocol should be used
+                if it's installed.
+        """
+        self.processor = processor
+        self.accelerated = accelerated
+        self.protocols = protocols or [ThriftProtocol.BINARY, ThriftProtocol.COMPACT]
+        self.transports = transports or [ThriftTransport.BUFFERED, ThriftTransport.FRAMED]
+
+        #Map of server input protocol to negotiated (iprot, oprot).
+        #Servers reuse protocol objects for the life of a connection.
+        self.connections = weakref.WeakKeyDictionary()
+
+    def _negotiate(self, iprot, oprot):
+        """Negotiate protocol and transport for a connection.
+
+        Args:
+            iprot: server input protocol
+            oprot: server output protocol
+        Returns:
+            (iprot, oprot) tuple of negotiated protocols.
+        Raises:
+            TTransportException if the protocol or transport
+            is not supported.
+        """
+        itrans = iprot.trans
+        otrans = oprot.trans
+
+        #Unframed messages begin with a protocol id, otherwise the
+        #first bytes are the frame length.
+        protocol_id = ord(peek(itrans, 1))
+        if protocol_id in (BINARY_PROTOCOL_ID, COMPACT_PROTOCOL_ID):
+            transport = ThriftTransport.BUFFERED
+        else:
+            transport = ThriftTransport.FRAMED
+            itrans = TTransport.TFramedTransport(itrans)
+            otrans = TTransport.TFramedTransport(otrans)
+            protocol_id = ord(peek(itrans, 1))
+
+        if protocol_id == COMPACT_PROTOCOL_ID:
+            protocol = ThriftProtocol.COMPACT
+        else:
+            protocol = ThriftProtocol.BINARY
+
+        if transport not in self.transports or protocol not in self.protocols:
+            raise TTransport.TTransportException(
+                    TTransport.TTransportException.UNKNOWN,
+                    "unsupported protocol (%s) or transport (%s)" % (protocol, transport))
+
+        cls = protocol_class(protocol, self.accelerated)
+        return cls(itrans), cls(otrans)
+
+    def process(self, iprot, oprot):
+        """Process a single request.
+
+        Args:
+            iprot: server input protocol
+            oprot: server output protocol
+        """
+        protocols = self.connections.get(iprot)
+        if protocols is None:
+            protocols = self._negotiate(iprot, oprot)
+            self.connections[iprot] = protocols
+        return self.processor.process(*protocols)
@@ -0,0 +1,255 @@
+import errno
+import logging
+import os
+import signal
+import threading
+import time
+
+from thrift.transport import TTransport
+
+class TPreboundServerTransport(TTransport.TServerTransportBase):
+    """Server transport wrapper for an already listening transport.
+
+    Allows servers in forked worker processes to accept connections
+    on the listening socket inherited from the parent process.
+    listen() is a no-op, since the socket is already bound.
+    """
+
+    def __init__(self, transport):
+        """TPreboundServerTransport constructor.
+
+        Args:
+            transport: listening Thrift server socket transport
+        """
+        self.transport = transport
+
+    @property
+    def handle(self):
+        """Listening socket."""
+        return self.transport.handle
+
+    def listen(self):
+        pass
+
+    def accept(self):
+        return self.transport.accept()
+
+    def close(self):
+        self.transport.close()
+
+
+class TPreforkServer(object):
+    """Pre-fork multi-process Thrift server.
+
+    Binds the listening socket once, and forks worker processes
+    which share it, each running its own Thrift server. This allows
+    CPU bound services to use more than one core, which is not
+    possible with threads due to the GIL.
+
+    The parent process supervises the workers, restarting them
+    if they exit. Workers are terminated when the server is stopped.
+
+    Note that worker processes do not inherit the parent's threads,
+    so any state which depends on threads, i.e. zookeeper clients,
+    or on inherited connections, i.e. database connection pools,
+    must be reinitialized in the after_fork callback.
+
+    A lock held by another thread at the time of fork remains held
+    in the worker, which would deadlock on it. start() should be
+    called to fork the initial workers before other threads are
+    started. Workers restarted by serve() are necessarily forked
+    from a multi-threaded parent, so logging locks, which any
+    thread may hold, are reinitialized in each worker, and
+    after_fork must not use other inherited locks.
+    """
+
+    #Supervisor poll interval in seconds
+    POLL_INTERVAL = 0.5
+
+    #Workers which exit within this many seconds of starting
+    #will not be restarted until this many seconds have passed.
+    MIN_WORKER_LIFETIME = 1.0
+
+    #Seconds to wait for workers to exit following SIGTERM
+    #before sending SIGKILL.
+    TERMINATE_TIMEOUT = 5.0
+
+    def __init__(self, processes, transport, server_factory, after_fork=None):
+        """TPreforkServer constructor.
+
+        Args:
+            processes: number of worker processes
+            transport: Thrift server socket transport, i.e. TServerSocket
+            server_factory: method taking a server transport and returning
+                the Thrift server to run in each worker process, i.e.
+                TThreadPoolServer or TMultiplexingServer.
+            after_fork: optional method taking the worker index which
+                will be invoked in each worker process after fork.
+        """
+        self.processes = processes
+        self.transport = transport
+        self.server_factory = server_factory
+        self.after_fork = after_fork
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.parent_pid = os.getpid()
+        self.listening = False
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        #Worker pid and start time by worker index
+        self.workers = [None] * self.processes
+        self.started = [0] * self.processes
+
+    def worker_pids(self):
+        """Get worker process ids.
+
+        Returns:
+            list of pids of running workers.
+        """
+        return [pid for pid in self.workers if pid is not None]
+
+    def start(self):
+        """Bind the listening socket and fork the initial workers.
+
+        This method should be called before other threads are
+        started. If not, it's called by serve().
+        """
+        if not self.listening:
+            self.parent_pid = os.getpid()
+            self.transport.listen()
+            self.listening = True
+            with self.lock:
+                self._spawn()
+
+    def serve(self):
+        """Start workers and supervise them until stop() is called."""
+        self.start()
+        try:
+            while not self.stop_event.is_set():
+                with self.lock:
+                    if not self.stop_event.is_set():
+                        self._reap()
+                        self._spawn()
+                self.stop_event.wait(self.POLL_INTERVAL)
+        finally:
+            with self.lock:
+                self._terminate()
+            self.transport.close()
+
+    def stop(self):
+        """Stop the server.
+
+        Worker processes are terminated before returning, so
+        they will not outlive the parent if it exits immediately.
+        """
+        self.stop_event.set()
+        with self.lock:
+            self._terminate()
+
+    def _spawn(self):
+        """Start workers which are not running."""
+        now = time.time()
+        for index, pid in enumerate(self.workers):
+            if pid is None and now - self.started[index] >= self.MIN_WORKER_LIFETIME:
+                self.started[index] = now
+                pid = os.fork()
+                if pid == 0:
+                    self._run_worker(index)
+                self.workers[index] = pid
+                self.log.info("started worker %d (pid=%d)" % (index, pid))
+
+    def _reap(self):
+        """Reap exited workers."""
+        for index, pid in enumerate(self.workers):
+            if pid is None:
+                continue
+            try:
+                result, status = os.waitpid(pid, os.WNOHANG)
+            except OSError as error:
+                if error.errno != errno.ECHILD:
+                    raise
+                result, status = pid, 0
+            if result == pid:
+                self.workers[index] = None
+                if not self.stop_event.is_set():
+                    self.log.warning("worker %d (pid=%d) exited (status=%d)" % (index, pid, status))
+
+    def _terminate(self):
+        """Terminate all workers."""
+        for pid in self.worker_pids():
+            self._kill(pid, signal.SIGTERM)
+
+        deadline = time.time() + self.TERMINATE_TIMEOUT
+        while self.worker_pids() and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+
+        for pid in self.worker_pids():
+            self.log.warning("killing worker (pid=%d)" % pid)
+            self._kill(pid, signal.SIGKILL)
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.workers = [None] * self.processes
+
+    def _kill(self, pid, sig):
+        """Send signal to worker, ignoring exited workers."""
+        try:
+            os.kill(pid, sig)
+        except OSError as error:
+            if error.errno != errno.ESRCH:
+                raise
+
+    def _run_worker(self, index):
+        """Run worker process.
+
+        This method is invoked in the forked worker
+        process and never returns.
+
+        Args:
+            index: worker index
+        """
+        status = 1
+        try:
+            #The parent is responsible for shutdown
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            self._reinit_logging_locks()
+
+            #Exit if the parent exits without terminating us
+            thread = threading.Thread(target=self._watch_parent)
+            thread.daemon = True
+            thread.start()
+
+            if self.after_fork is not None:
+                self.after_fork(index)
+
+            server = self.server_factory(TPreboundServerTransport(self.transport))
+            server.serve()
+            status = 0
+        except Exception as error:
+            self.log.exception(error)
+        finally:
+            os._exit(status)
+
+    def _reinit_logging_locks(self):
+        """Replace logging locks inherited from the parent.
+
+        This method is invoked in the forked worker process,
+        where locks held by parent threads at the time of
+        fork would never be released.
+        """
+        logging._lock = threading.RLock()
+        for handler in logging._handlers.values():
+            handler.createLock()
+
+    def _watch_parent(self):
+        """Exit the worker process if the parent process exits.
+
+        This method is invoked in a worker process thread.
+        """
+        while os.getppid() == self.parent_pid:
+            time.sleep(self.POLL_INTERVAL)
+        os._exit(1)
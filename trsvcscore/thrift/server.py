@@ -0,0 +1,620 @@
+import collections
+import errno
+import fcntl
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+
+from thrift.transport import TTransport
+
+from trsvcscore.service.server.base import ThriftProtocol
+from trsvcscore.thrift.negotiation import COMPACT_PROTOCOL_ID, protocol_class
+from trsvcscore.thrift.worker import WorkerPool
+
+#Maximum accepted request frame size in bytes.
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+#Socket errors indicating that a non-blocking operation would block.
+WOULD_BLOCK_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+def set_nonblocking(fd):
+    """Put a file descriptor in non-blocking mode.
+
+    Args:
+        fd: file descriptor
+    """
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class Poller(object):
+    """File descriptor readiness poller.
+
+    Uses epoll if available, otherwise poll, both of which
+    scale to far more file descriptors than select.
+    """
+
+    READ = select.POLLIN
+    WRITE = select.POLLOUT
+    ERROR = select.POLLERR | select.POLLHUP
+
+    def __init__(self):
+        """Poller constructor."""
+        if hasattr(select, "epoll"):
+            self.impl = select.epoll()
+            self.timeout_scale = 1
+        else:
+            self.impl = select.poll()
+            self.timeout_scale = 1000
+
+    def register(self, fd, events):
+        """Register file descriptor for events.
+
+        Args:
+            fd: file descriptor
+            events: mask of Poller.READ / Poller.WRITE events
+        """
+        self.impl.register(fd, events)
+
+    def modify(self, fd, events):
+        """Modify the events registered for file descriptor.
+
+        Args:
+            fd: file descriptor
+            events: mask of Poller.READ / Poller.WRITE events
+        """
+        self.impl.modify(fd, events)
+
+    def unregister(self, fd):
+        """Unregister file descriptor.
+
+        Args:
+            fd: file descriptor
+        """
+        self.impl.unregister(fd)
+
+    def poll(self, timeout):
+        """Poll for events.
+
+        Args:
+            timeout: timeout in seconds
+        Returns:
+            list of (fd, events) tuples.
+        """
+        try:
+            return self.impl.poll(timeout * self.timeout_scale)
+        except (select.error, IOError) as error:
+            if error.args[0] == errno.EINTR:
+                return []
+            raise
+
+    def close(self):
+        """Close poller."""
+        if hasattr(self.impl, "close"):
+            self.impl.close()
+
+
+class TConnection(object):
+    """Multiplexed client connection.
+
+    Reads framed requests from a non-blocking client socket
+    and buffers framed responses for writing. Connections
+    are only accessed from the server's event loop thread.
+    """
+
+    READ_SIZE = 65536
+
+    def __init__(self, sock, address):
+        """TConnection constructor.
+
+        Args:
+            sock: non-blocking client socket
+            address: client address
+        """
+        self.socket = sock
+        self.address = address
+        self.fileno = sock.fileno()
+        self.events = Poller.READ
+        self.closed = False
+
+        #Read buffer chunks and total length
+        self.read_chunks = []
+        self.read_length = 0
+
+        #Size of the frame being read, or None if reading the header
+        self.frame_size = None
+
+        #Complete request frames waiting to be processed.
+        #Requests are processed one at a time, in order,
+        #so that responses are written in request order.
+        self.frames = collections.deque()
+        self.processing = False
+
+        #Pending response data
+        self.write_buffer = ""
+
+    def _consume(self, size):
+        """Consume size bytes from the read buffer.
+
+        Args:
+            size: number of bytes, no more than read_length.
+        Returns:
+            string of size bytes.
+        """
+        data = "".join(self.read_chunks)
+        self.read_chunks = [data[size:]] if len(data) > size else []
+        self.read_length -= size
+        return data[:size]
+
+    def read(self, max_frame_size=MAX_FRAME_SIZE):
+        """Read available data, queueing complete request frames.
+
+        Args:
+            max_frame_size: maximum accepted frame size in bytes.
+        Returns:
+            False if the client closed the connection, True otherwise.
+        Raises:
+            socket.error on read error.
+            TTransportException if the frame size is invalid.
+        """
+        data = self.socket.recv(self.READ_SIZE)
+        if not data:
+            return False
+
+        self.read_chunks.append(data)
+        self.read_length += len(data)
+
+        while True:
+            if self.frame_size is None:
+                if self.read_length < 4:
+                    break
+                self.frame_size = struct.unpack("!i", self._consume(4))[0]
+                if self.frame_size <= 0 or self.frame_size > max_frame_size:
+                    raise TTransport.TTransportException(
+                            TTransport.TTransportException.UNKNOWN,
+                            "invalid frame size (%d)" % self.frame_size)
+            if self.read_length < self.frame_size:
+                break
+            self.frames.append(self._consume(self.frame_size))
+            self.frame_size = None
+        return True
+
+    def write(self):
+        """Write as much pending response data as possible.
+
+        Raises:
+            socket.error on write error.
+        """
+        try:
+            sent = self.socket.send(self.write_buffer)
+            self.write_buffer = self.write_buffer[sent:]
+        except socket.error as error:
+            if error.args[0] not in WOULD_BLOCK_ERRORS:
+                raise
+
+    def add_response(self, response):
+        """Add response to the pending response data.
+
+        Args:
+            response: serialized response, which will be framed.
+        """
+        self.write_buffer += struct.pack("!i", len(response)) + response
+
+    def close(self):
+        """Close connection."""
+        if not self.closed:
+            self.closed = True
+            self.frames.clear()
+            self.write_buffer = ""
+            try:
+                self.socket.close()
+            except Exception:
+                pass
+
+
+class TMultiplexingServer(object):
+    """Thrift server which multiplexes client connections.
+
+    A single event loop thread accepts connections and reads
+    framed requests from all of them using epoll (or poll).
+    Individual requests, rather than connections, are dispatched
+    to a pool of worker threads. The number of connected clients
+    is therefore independent of the number of worker threads,
+    and idle keepalive clients do not tie up workers.
+
+    Requests must use TFramedTransport. If no protocol factory
+    is provided, the protocol (binary or compact) is detected
+    from each request.
+
+    Requests on a single connection are processed in order, one
+    at a time, so responses are always written in request order.
+    """
+
+    #Event loop poll timeout in seconds
+    POLL_TIMEOUT = 1.0
+
+    def __init__(self, processor, transport, protocol_factory=None,
+            threads=5, protocols=None, accelerated=True,
+            max_frame_size=MAX_FRAME_SIZE, worker_pool=None):
+        """TMultiplexingServer constructor.
+
+        Args:
+            processor: Thrift service processor
+            transport: Thrift server socket transport, i.e. TServerSocket.
+                The server uses the listening socket directly.
+            protocol_factory: optional Thrift protocol factory. If not
+                provided, the protocol is detected for each request.
+            threads: number of worker threads
+            protocols: optional list of ThriftProtocol enums to accept
+                if protocol_factory is not provided. Defaults to all
+                protocols.
+            accelerated: optional flag indicating that the C-accelerated
+                binary protocol should be used if installed.
+            max_frame_size: maximum accepted request frame size in bytes.
+                Connections sending larger frames will be closed.
+            worker_pool: optional WorkerPool object. If not provided
+                a WorkerPool with the given number of threads
+                will be used.
+        """
+        self.processor = processor
+        self.transport = transport
+        self.protocol_factory = protocol_factory
+        self.protocols = protocols or [ThriftProtocol.BINARY, ThriftProtocol.COMPACT]
+        self.accelerated = accelerated
+        self.max_frame_size = max_frame_size
+        self.worker_pool = worker_pool or WorkerPool(threads, name="thrift_worker")
+        self.stopped = False
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+        #Map of file descriptor to TConnection object
+        self.connections = {}
+
+        #(connection, response) tuples for processed requests
+        #which have not yet been handed back to the event loop.
+        self.completed = collections.deque()
+
+        self.poller = None
+        self.listen_socket = None
+        self.wakeup_read = None
+        self.wakeup_write = None
+        self.wakeup_lock = threading.Lock()
+
+    def connection_count(self):
+        """Get the number of connected clients.
+
+        Returns:
+            number of connected clients.
+        """
+        return len(self.connections)
+
+    def serve(self):
+        """Run the event loop until stop() is called."""
+        self.transport.listen()
+        self.listen_socket = self.transport.handle
+        self.listen_socket.setblocking(0)
+
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        set_nonblocking(self.wakeup_read)
+        set_nonblocking(self.wakeup_write)
+
+        self.poller = Poller()
+        self.poller.register(self.listen_socket.fileno(), Poller.READ)
+        self.poller.register(self.wakeup_read, Poller.READ)
+
+        self.worker_pool.start()
+
+        try:
+            while not self.stopped:
+                self._poll()
+        finally:
+            self._cleanup()
+
+    def stop(self):
+        """Stop the server.
+
+        serve() will return once the event loop exits. Requests
+        being processed by workers will be completed, but their
+        responses will be discarded.
+        """
+        self.stopped = True
+        self._wakeup()
+
+    def _poll(self):
+        """Run a single iteration of the event loop."""
+        listen_fd = self.listen_socket.fileno()
+
+        for fd, events in self.poller.poll(self.POLL_TIMEOUT):
+            if fd == listen_fd:
+                self._accept()
+            elif fd == self.wakeup_read:
+                self._drain_wakeup()
+            else:
+                connection = self.connections.get(fd)
+                if connection is None:
+                    continue
+                if events & Poller.READ:
+                    self._read(connection)
+                elif events & Poller.ERROR:
+                    self._close(connection)
+                if events & Poller.WRITE and not connection.closed:
+                    self._write(connection)
+
+        self._process_completed()
+
+    def _accept(self):
+        """Accept pending client connections."""
+        while True:
+            try:
+                sock, address = self.listen_socket.accept()
+            except socket.error as error:
+                if error.args[0] in WOULD_BLOCK_ERRORS:
+                    break
+                elif error.args[0] in (errno.EMFILE, errno.ENFILE, errno.ECONNABORTED):
+                    self.log.error("accept error: %s" % str(error))
+                    break
+                raise
+
+            sock.setblocking(0)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = TConnection(sock, address)
+            self.connections[connection.fileno] = connection
+            self.poller.register(connection.fileno, connection.events)
+
+    def _read(self, connection):
+        """Read from connection and dispatch complete requests.
+
+        Args:
+            connection: TConnection object
+        """
+        try:
+            if not connection.read(self.max_frame_size):
+                self._close(connection)
+                return
+        except socket.error as error:
+            if error.args[0] not in WOULD_BLOCK_ERRORS:
+                self._close(connection)
+                return
+        except TTransport.TTransportException as error:
+            self.log.warning("closing connection from %s: %s" % (
+                connection.address, str(error)))
+            self._close(connection)
+            return
+
+        self._dispatch(connection)
+
+    def _write(self, connection):
+        """Write pending responses to connection.
+
+        Args:
+            connection: TConnection object
+        """
+        try:
+            connection.write()
+        except socket.error:
+            self._close(connection)
+            return
+
+        if connection.write_buffer:
+            events = Poller.READ | Poller.WRITE
+        else:
+            events = Poller.READ
+
+        if events != connection.events:
+            connection.events = events
+            self.poller.modify(connection.fileno, events)
+
+    def _close(self, connection):
+        """Close connection.
+
+        Args:
+            connection: TConnection object
+        """
+        if not connection.closed:
+            self.connections.pop(connection.fileno, None)
+            try:
+                self.poller.unregister(connection.fileno)
+            except Exception:
+                pass
+            connection.close()
+
+    def _dispatch(self, connection):
+        """Dispatch the connection's next request to a worker.
+
+        Args:
+            connection: TConnection object
+        """
+        if connection.frames and not connection.processing and not connection.closed:
+            connection.processing = True
+            self.worker_pool.submit(self._process, connection, connection.frames.popleft())
+
+    def _process_completed(self):
+        """Queue responses for processed requests."""
+        while self.completed:
+            connection, response = self.completed.popleft()
+            connection.processing = False
+            if connection.closed:
+                continue
+            elif response is None:
+                self._close(connection)
+                continue
+
+            #Oneway requests have empty responses
+            if response:
+                connection.add_response(response)
+                self._write(connection)
+
+            self._dispatch(connection)
+
+    def _get_protocols(self, frame, itrans, otrans):
+        """Get input and output protocols for request.
+
+        Args:
+            frame: request frame
+            itrans: input transport
+            otrans: output transport
+        Returns:
+            (iprot, oprot) tuple.
+        Raises:
+            TTransportException if the protocol is not supported.
+        """
+        if self.protocol_factory is not None:
+            return (self.protocol_factory.getProtocol(itrans),
+                    self.protocol_factory.getProtocol(otrans))
+
+        if ord(frame[0]) == COMPACT_PROTOCOL_ID:
+            protocol = ThriftProtocol.COMPACT
+        else:
+            protocol = ThriftProtocol.BINARY
+
+        if protocol not in self.protocols:
+            raise TTransport.TTransportException(
+                    TTransport.TTransportException.UNKNOWN,
+                    "unsupported protocol (%s)" % protocol)
+
+        cls = protocol_class(protocol, self.accelerated)
+        return cls(itrans), cls(otrans)
+
+    def _process(self, connection, frame):
+        """Process a single request.
+
+        This method is invoked in a worker thread.
+
+        Args:
+            connection: TConnection object
+            frame: request frame
+        """
+        #TMemoryBuffer is a CReadableTransport which is
+        #required by the accelerated binary protocol.
+        itrans = TTransport.TMemoryBuffer(frame)
+        otrans = TTransport.TMemoryBuffer()
+        try:
+            iprot, oprot = self._get_protocols(frame, itrans, otrans)
+            self.processor.process(iprot, oprot)
+            response = otrans.getvalue()
+        except Exception as error:
+            self.log.exception(error)
+            response = None
+
+        self.completed.append((connection, response))
+        self._wakeup()
+
+    def _wakeup(self):
+        """Wake up the event loop."""
+        with self.wakeup_lock:
+            if self.wakeup_write is not None:
+                try:
+                    os.write(self.wakeup_write, "x")
+                except OSError as error:
+                    if error.errno not in WOULD_BLOCK_ERRORS:
+                        raise
+
+    def _drain_wakeup(self):
+        """Drain event loop wakeup pipe."""
+        try:
+            while os.read(self.wakeup_read, 4096):
+                pass
+        except OSError as error:
+            if error.errno not in WOULD_BLOCK_ERRORS:
+                raise
+
+    def _cleanup(self):
+        """Release event loop resources."""
+        self.worker_pool.stop()
+
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
+        self.completed.clear()
+
+        self.poller.close()
+
+        #Workers may still be processing requests, so the
+        #wakeup pipe must be closed under the wakeup lock.
+        with self.wakeup_lock:
+            os.close(self.wakeup_read)
+            os.close(self.wakeup_write)
+            self.wakeup_read = self.wakeup_write = None
+
+        self.transport.close()
+
+
+class TPooledServer(object):
+    """Thrift server which dispatches connections to a WorkerPool.
+
+    Like TThreadPoolServer, each worker handles one client connection
+    at a time, for the life of the connection. Unlike TThreadPoolServer,
+    the WorkerPool may grow and shrink with demand.
+    """
+
+    #Seconds to wait for a connection before checking for stop
+    ACCEPT_TIMEOUT = 1.0
+
+    def __init__(self, processor, transport, transport_factory,
+            protocol_factory, worker_pool):
+        """TPooledServer constructor.
+
+        Args:
+            processor: Thrift service processor
+            transport: Thrift server socket transport, i.e. TServerSocket
+            transport_factory: Thrift transport factory
+            protocol_factory: Thrift protocol factory
+            worker_pool: WorkerPool object
+        """
+        self.processor = processor
+        self.transport = transport
+        self.transport_factory = transport_factory
+        self.protocol_factory = protocol_factory
+        self.worker_pool = worker_pool
+        self.stopped = False
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def serve(self):
+        """Accept connections until stop() is called."""
+        self.transport.listen()
+        self.worker_pool.start()
+        try:
+            while not self.stopped:
+                readable, writable, errors = select.select(
+                        [self.transport.handle], [], [], self.ACCEPT_TIMEOUT)
+                if readable and not self.stopped:
+                    client = self.transport.accept()
+                    if client is not None:
+                        self.worker_pool.submit(self._serve_client, client)
+        finally:
+            self.worker_pool.stop()
+            self.transport.close()
+
+    def stop(self):
+        """Stop the server.
+
+        serve() will return within ACCEPT_TIMEOUT seconds. Connected
+        clients will be disconnected following their current request.
+        """
+        self.stopped = True
+
+    def _serve_client(self, client):
+        """Process requests for client until it disconnects.
+
+        This method is invoked in a worker thread.
+
+        Args:
+            client: Thrift client transport
+        """
+        itrans = self.transport_factory.getTransport(client)
+        otrans = self.transport_factory.getTransport(client)
+        iprot = self.protocol_factory.getProtocol(itrans)
+        oprot = self.protocol_factory.getProtocol(otrans)
+        try:
+            while not self.stopped:
+                self.processor.process(iprot, oprot)
+        except TTransport.TTransportException:
+            pass
+        except Exception as error:
+            self.log.exception(error)
+
+        itrans.close()
+        otrans.close()
@@ -0,0 +1,256 @@
+import logging
+import Queue
+import threading
+import time
+
+class WorkerPool(object):
+    """Elastic thread worker pool.
+
+    Executes submitted work items in daemon worker threads. The
+    pool starts with min_threads workers, and grows, up to
+    max_threads, when work items wait in the queue longer than
+    grow_wait seconds, or when the optional load callback reaches
+    the number of workers. Workers beyond min_threads exit once
+    they have not been needed for idle_timeout seconds.
+
+    If max_threads is not greater than min_threads, the pool
+    size is fixed.
+
+    Example usage:
+        pool = WorkerPool(min_threads=5, max_threads=20)
+        pool.start()
+        pool.submit(method, arg1, arg2)
+        pool.stop()
+    """
+
+    #Work item instructing a worker to exit.
+    STOP = object()
+
+    #Seconds between checks for overload
+    MONITOR_INTERVAL = 0.05
+
+    def __init__(self, min_threads=5, max_threads=None, name="worker",
+            grow_wait=0.05, idle_timeout=60, load=None):
+        """WorkerPool constructor.
+
+        Args:
+            min_threads: minimum number of worker threads
+            max_threads: optional maximum number of worker threads.
+                Defaults to min_threads.
+            name: worker thread name prefix
+            grow_wait: seconds a work item may wait in the queue
+                before an additional worker is started.
+            idle_timeout: seconds after which unneeded workers beyond
+                min_threads will exit.
+            load: optional method taking no arguments and returning
+                the number of requests in progress, i.e. the
+                open_requests counter. An additional worker is
+                started if it reaches the number of workers.
+        """
+        self.min_threads = min_threads
+        self.max_threads = max(max_threads or min_threads, min_threads)
+        self.name = name
+        self.grow_wait = grow_wait
+        self.idle_timeout = idle_timeout
+        self.load = load
+        self.queue = Queue.Queue()
+        self.threads = []
+        self.idle = 0
+        self.running = False
+        self.lock = threading.Lock()
+        self.monitor_thread = None
+        self.worker_index = 0
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def is_elastic(self):
+        """Check if the pool size may change.
+
+        Returns:
+            True if max_threads is greater than min_threads.
+        """
+        return self.max_threads > self.min_threads
+
+    def start(self):
+        """Start worker threads."""
+        if not self.running:
+            self.running = True
+            self.queue = Queue.Queue()
+            self.threads = []
+            self.idle = 0
+            with self.lock:
+                for i in range(self.min_threads):
+                    self._start_worker()
+
+            if self.is_elastic():
+                self.monitor_thread = threading.Thread(
+                        target=self._monitor,
+                        name="%s-monitor" % self.name)
+                self.monitor_thread.daemon = True
+                self.monitor_thread.start()
+
+    def stop(self):
+        """Stop worker threads.
+
+        Workers will exit once work items already submitted
+        have been processed.
+        """
+        if self.running:
+            self.running = False
+            with self.lock:
+                for thread in self.threads:
+                    self.queue.put(self.STOP)
+
+    def join(self, timeout=None):
+        """Join worker threads.
+
+        Args:
+            timeout: optional timeout in seconds for each thread.
+        """
+        for thread in list(self.threads):
+            thread.join(timeout)
+
+    def submit(self, method, *args, **kwargs):
+        """Submit a work item.
+
+        Args:
+            method: method to invoke in a worker thread
+            args: method positional arguments
+            kwargs: method keyword arguments
+        """
+        self.queue.put((time.time(), method, args, kwargs))
+
+    def size(self):
+        """Get the number of worker threads.
+
+        Returns:
+            number of worker threads.
+        """
+        return len(self.threads)
+
+    def idle_size(self):
+        """Get the number of idle worker threads.
+
+        Returns:
+            number of worker threads waiting for work.
+        """
+        return self.idle
+
+    def queue_depth(self):
+        """Get the number of work items waiting for a worker.
+
+        Returns:
+            approximate number of queued work items.
+        """
+        return self.queue.qsize()
+
+    def queue_wait(self):
+        """Get the time the oldest queued work item has waited.
+
+        Returns:
+            seconds the oldest work item has been queued,
+            or 0 if the queue is empty.
+        """
+        try:
+            return time.time() - self.queue.queue[0][0]
+        except (IndexError, TypeError):
+            return 0
+
+    def counters(self):
+        """Get pool counters.
+
+        Returns:
+            dict of counter name to value.
+        """
+        return {
+            "%s_threads" % self.name: self.size(),
+            "%s_idle_threads" % self.name: self.idle_size(),
+            "%s_queue_depth" % self.name: self.queue_depth()
+        }
+
+    def _overloaded(self):
+        """Check if an additional worker is needed.
+
+        Returns:
+            True if queued work has waited longer than grow_wait,
+            or if load has reached the number of workers.
+        """
+        if self.queue_wait() >= self.grow_wait:
+            return True
+        elif self.load is not None and self.idle == 0:
+            return self.load() >= len(self.threads)
+        return False
+
+    def _start_worker(self):
+        """Start a worker thread.
+
+        This method must be invoked with the lock held.
+        """
+        thread = threading.Thread(
+                target=self._run,
+                args=(self.queue,),
+                name="%s-%d" % (self.name, self.worker_index))
+        thread.daemon = True
+        self.worker_index += 1
+        self.threads.append(thread)
+        thread.start()
+
+    def _monitor(self):
+        """Monitor thread method.
+
+        Grows the pool when overloaded. Shrinks the pool by the
+        minimum number of idle workers observed over each
+        idle_timeout period, so workers beyond min_threads
+        which have not been needed will exit.
+        """
+        window_start = time.time()
+        min_idle = self.idle
+
+        while self.running:
+            try:
+                if len(self.threads) < self.max_threads and self._overloaded():
+                    with self.lock:
+                        if self.running and len(self.threads) < self.max_threads:
+                            self._start_worker()
+
+                min_idle = min(min_idle, self.idle)
+                if time.time() - window_start >= self.idle_timeout:
+                    with self.lock:
+                        surplus = min(min_idle, len(self.threads) - self.min_threads)
+                        if self.running:
+                            for i in range(surplus):
+                                self.queue.put(self.STOP)
+                    window_start = time.time()
+                    min_idle = self.idle
+            except Exception as error:
+                self.log.exception(error)
+            time.sleep(self.MONITOR_INTERVAL)
+
+    def _run(self, queue):
+        """Worker thread method.
+
+        Args:
+            queue: work item queue
+        """
+        thread = threading.current_thread()
+
+        while True:
+            with self.lock:
+                self.idle += 1
+            try:
+                item = queue.get()
+            finally:
+                with self.lock:
+                    self.idle -= 1
+
+            if item is self.STOP:
+                break
+
+            enqueue_time, method, args, kwargs = item
+            try:
+                method(*args, **kwargs)
+            except Exception as error:
+                self.log.exception(error)
+
+        with self.lock:
+            if thread in self.threads:
+                self.threads.remove(thread)
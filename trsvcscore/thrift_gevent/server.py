@@ -0,0 +1,137 @@
+import logging
+
+import gevent
+import gevent.pool
+
+from thrift.transport import TTransport
+
+from trsvcscore.service.server.base import Backpressure
+
+class TGeventPoolServer(object):
+    """Gevent Thrift server with a bounded greenlet pool.
+
+    Like TGeventServer, each client connection is served by its own
+    greenlet. Unlike TGeventServer, connection greenlets are spawned
+    in a gevent Pool of limited size, so that a burst of connections
+    cannot create an unbounded number of greenlets.
+
+    When the pool is full, the backpressure strategy determines
+    how new connections are handled:
+        Backpressure.BLOCK: connections are not accepted until
+            a greenlet is available, and wait in the listen backlog.
+        Backpressure.REJECT: connections are accepted and closed
+            immediately. Since no request has been read at this
+            point, clients will receive a TTransportException.
+    """
+
+    def __init__(self, processor, transport, transport_factory,
+            protocol_factory, pool, backpressure=Backpressure.BLOCK,
+            name="thrift_pool", counters=None):
+        """TGeventPoolServer constructor.
+
+        Args:
+            processor: Thrift service processor
+            transport: Thrift non-blocking server socket transport
+            transport_factory: Thrift transport factory
+            protocol_factory: Thrift protocol factory
+            pool: gevent.pool.Pool object with a size
+            backpressure: Backpressure enum
+            name: counter name prefix
+            counters: optional counters object, i.e. handler counters,
+                in which to count rejected connections.
+        """
+        if pool.size is None:
+            raise ValueError("pool size required")
+        if backpressure not in (Backpressure.BLOCK, Backpressure.REJECT):
+            raise ValueError("invalid backpressure (%s)" % backpressure)
+
+        self.processor = processor
+        self.transport = transport
+        self.transport_factory = transport_factory
+        self.protocol_factory = protocol_factory
+        self.pool = pool
+        self.backpressure = backpressure
+        self.name = name
+        self.counters = counters
+        self.greenlet = None
+        self.stopped = False
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def serve(self):
+        """Accept connections until stop() is called."""
+        self.greenlet = gevent.getcurrent()
+        self.transport.listen()
+        try:
+            while not self.stopped:
+                if self.backpressure == Backpressure.BLOCK:
+                    self.pool.wait_available()
+
+                client = self.transport.accept()
+                if client is None:
+                    continue
+
+                if self.pool.full():
+                    self._reject(client)
+                else:
+                    self.pool.spawn(self._serve_client, client)
+        finally:
+            self.transport.close()
+
+    def stop(self):
+        """Stop the server.
+
+        Connected clients will be disconnected following
+        their current request.
+        """
+        self.stopped = True
+        if self.greenlet is not None and self.greenlet is not gevent.getcurrent():
+            self.greenlet.kill(block=False)
+
+    def _reject(self, client):
+        """Reject client connection.
+
+        Args:
+            client: Thrift client transport
+        """
+        if self.counters is not None:
+            self.counters.get_counter("%s_rejected" % self.name).increment()
+        client.close()
+
+    def _serve_client(self, client):
+        """Process requests for client until it disconnects.
+
+        This method is invoked in a pool greenlet.
+
+        Args:
+            client: Thrift client transport
+        """
+        itrans = self.transport_factory.getTransport(client)
+        otrans = self.transport_factory.getTransport(client)
+        iprot = self.protocol_factory.getProtocol(itrans)
+        oprot = self.protocol_factory.getProtocol(otrans)
+        try:
+            while not self.stopped:
+                self.processor.process(iprot, oprot)
+        except TTransport.TTransportException:
+            pass
+        except Exception as error:
+            self.log.exception(error)
+
+        itrans.close()
+        otrans.close()
+
+
+def pool_counters(pool, name):
+    """Get greenlet pool occupancy counters.
+
+    Args:
+        pool: gevent.pool.Pool object with a size
+        name: counter name prefix
+    Returns:
+        dict of counter name to value.
+    """
+    return {
+        "%s_size" % name: pool.size,
+        "%s_occupancy" % name: len(pool),
+        "%s_free" % name: pool.free_count()
+    }
@@ -0,0 +1,166 @@
+import collections
+import json
+import logging
+import socket
+import threading
+
+class FileSpanSink(object):
+    """Span sink which appends spans to a file as JSON lines."""
+
+    def __init__(self, path):
+        """FileSpanSink constructor.
+
+        Args:
+            path: file path
+        """
+        self.path = path
+
+    def send(self, spans):
+        """Send batch of spans.
+
+        Args:
+            spans: list of span dicts
+        """
+        with open(self.path, "a") as output:
+            for span in spans:
+                output.write(json.dumps(span))
+                output.write("\n")
+
+
+class UdpSpanSink(object):
+    """Span sink which sends spans to a UDP collector.
+
+    Spans are sent as JSON lines, packed into as few datagrams
+    as possible without exceeding max_datagram_size.
+    """
+
+    def __init__(self, host="localhost", port=9411, max_datagram_size=8192):
+        """UdpSpanSink constructor.
+
+        Args:
+            host: collector host
+            port: collector port
+            max_datagram_size: maximum datagram size in bytes.
+                Larger spans are sent in their own datagram.
+        """
+        self.address = (host, port)
+        self.max_datagram_size = max_datagram_size
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, spans):
+        """Send batch of spans.
+
+        Args:
+            spans: list of span dicts
+        """
+        datagram = []
+        size = 0
+        for span in spans:
+            line = json.dumps(span) + "\n"
+            if datagram and size + len(line) > self.max_datagram_size:
+                self.socket.sendto("".join(datagram), self.address)
+                datagram = []
+                size = 0
+            datagram.append(line)
+            size += len(line)
+        if datagram:
+            self.socket.sendto("".join(datagram), self.address)
+
+
+class SpanExporter(object):
+    """Batching span exporter.
+
+    Finished spans are queued and sent to the sink in batches from
+    a background thread, so that requests never wait on the sink.
+    If the sink falls behind, the oldest queued spans are dropped
+    once max_queue_size is reached, and counted in dropped.
+    """
+
+    def __init__(self, sink, batch_size=100, flush_interval=1.0, max_queue_size=10000):
+        """SpanExporter constructor.
+
+        Args:
+            sink: span sink object with a send(spans) method,
+                i.e. FileSpanSink or UdpSpanSink.
+            batch_size: maximum number of spans per batch.
+                Reaching this number triggers a flush.
+            flush_interval: maximum seconds between flushes
+            max_queue_size: maximum number of queued spans
+        """
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = collections.deque(maxlen=max_queue_size)
+        self.dropped = 0
+        self.exported = 0
+        self.running = False
+        self.thread = None
+        self.flush_event = threading.Event()
+        self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+
+    def start(self):
+        """Start exporter thread."""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="span-exporter")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """Stop exporter thread, flushing queued spans."""
+        if self.running:
+            self.running = False
+            self.flush_event.set()
+
+    def join(self, timeout=None):
+        """Join exporter thread.
+
+        Args:
+            timeout: optional timeout in seconds
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def after_fork(self):
+        """Restart exporter thread in a forked process.
+
+        Threads do not survive fork, and spans queued by the
+        parent are discarded, since the parent will export them.
+        """
+        self.queue.clear()
+        self.running = False
+        self.flush_event = threading.Event()
+        self.start()
+
+    def export(self, span):
+        """Queue span for export.
+
+        Args:
+            span: span dict
+        """
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(span)
+        if len(self.queue) >= self.batch_size:
+            self.flush_event.set()
+
+    def flush(self):
+        """Send all queued spans to the sink."""
+        while self.queue:
+            batch = []
+            while self.queue and len(batch) < self.batch_size:
+                batch.append(self.queue.popleft())
+            try:
+                self.sink.send(batch)
+                self.exported += len(batch)
+            except Exception as error:
+                self.dropped += len(batch)
+                self.log.exception(error)
+
+    def _run(self):
+        """Exporter thread method."""
+        while self.running:
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            self.flush()
+        self.flush()
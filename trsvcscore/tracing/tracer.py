@@ -0,0 +1,327 @@
+import copy
+import os
+import random
+import time
+
+from trsvcscore.metrics.timing import current_request
+
+#Separator between a RequestContext's application context
+#and the trace header appended to it by service proxies.
+TRACE_SEPARATOR = "\x1etrace:"
+
+#Process default tracer used by service proxies
+_tracer = None
+
+def set_tracer(tracer):
+    """Set the default tracer used by service proxies.
+
+    Args:
+        tracer: Tracer object, or None to disable tracing.
+    """
+    global _tracer
+    _tracer = tracer
+
+def get_tracer():
+    """Get the default tracer used by service proxies.
+
+    Returns:
+        Tracer object, or None if tracing is disabled.
+    """
+    return _tracer
+
+def new_id():
+    """Generate a random 64-bit trace or span id.
+
+    Ids are read from os.urandom(), rather than the random module,
+    whose state is copied into forked processes, so that ids are
+    unique across pre-forked service processes.
+
+    Returns:
+        id as a 16 character hex string.
+    """
+    return os.urandom(8).encode("hex")
+
+
+def parse_sample_rate(value):
+    """Parse trace.sample_rate option value.
+
+    Args:
+        value: option string, i.e. "0.01"
+    Returns:
+        sample rate as a float.
+    Raises:
+        ValueError if the value is not a number between 0 and 1.
+    """
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        rate = None
+    if rate is None or not 0 <= rate <= 1:
+        raise ValueError("invalid trace.sample_rate (%s)" % value)
+    return rate
+
+
+class SpanContext(object):
+    """Span identifiers propagated between services."""
+
+    def __init__(self, trace_id, span_id, sampled):
+        """SpanContext constructor.
+
+        Args:
+            trace_id: trace id
+            span_id: span id
+            sampled: True if the trace is sampled
+        """
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def encode(self):
+        """Encode span context as a trace header.
+
+        Returns:
+            trace header string
+        """
+        return "%s:%s:%d" % (self.trace_id, self.span_id, self.sampled)
+
+    @staticmethod
+    def decode(header):
+        """Decode trace header.
+
+        Args:
+            header: trace header string
+        Returns:
+            SpanContext object, or None if header is invalid.
+        """
+        try:
+            trace_id, span_id, sampled = header.split(":")
+            return SpanContext(trace_id, span_id, sampled == "1")
+        except ValueError:
+            return None
+
+
+def inject(request_context, span_context):
+    """Add span context to a copy of a RequestContext.
+
+    The trace header is appended to the RequestContext's context
+    string, so that it's propagated without IDL changes.
+
+    Args:
+        request_context: RequestContext object
+        span_context: SpanContext object
+    Returns:
+        RequestContext copy including the trace header.
+    """
+    context, header = extract(request_context)
+    result = copy.copy(context)
+    result.context = "%s%s%s" % (context.context or "", TRACE_SEPARATOR, span_context.encode())
+    return result
+
+def extract(request_context):
+    """Remove span context from a RequestContext.
+
+    Args:
+        request_context: RequestContext object
+    Returns:
+        (RequestContext, SpanContext) tuple. If the RequestContext
+        includes a trace header, a copy without it is returned, along
+        with its SpanContext. Otherwise, the RequestContext is
+        returned as is, along with None.
+    """
+    context = getattr(request_context, "context", None)
+    if not context or TRACE_SEPARATOR not in context:
+        return request_context, None
+
+    application_context, separator, header = context.rpartition(TRACE_SEPARATOR)
+    result = copy.copy(request_context)
+    result.context = application_context
+    return result, SpanContext.decode(header)
+
+
+class Span(object):
+    """Trace span.
+
+    Records the duration of a server request or client call,
+    identified by its trace and parent span.
+    """
+
+    def __init__(self, tracer, name, kind, trace_id, parent_id=None, sampled=True):
+        """Span constructor.
+
+        Args:
+            tracer: Tracer object
+            name: span name, i.e. service method name
+            kind: "server" or "client"
+            trace_id: trace id
+            parent_id: optional parent span id
+            sampled: True if the span should be exported
+        """
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start = time.time()
+        self.end = None
+        self.error = False
+        self.tags = {}
+
+    @property
+    def context(self):
+        """SpanContext to propagate to child spans."""
+        return SpanContext(self.trace_id, self.span_id, self.sampled)
+
+    def tag(self, key, value):
+        """Add tag to span.
+
+        Args:
+            key: tag name
+            value: tag value
+        """
+        self.tags[key] = value
+
+    def finish(self, error=False):
+        """Finish span, and export it if sampled.
+
+        Args:
+            error: True if the request or call failed
+        """
+        self.end = time.time()
+        self.error = error
+        if self.sampled:
+            self.tracer.export(self)
+
+    def to_dict(self):
+        """Get span as a dict.
+
+        Returns:
+            dict suitable for JSON serialization, with
+            timestamps and duration in microseconds.
+        """
+        return {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "parentId": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": self.tracer.service_name,
+            "timestamp": int(self.start * 1000000),
+            "duration": int(((self.end or time.time()) - self.start) * 1000000),
+            "error": self.error,
+            "tags": self.tags
+        }
+
+
+class Tracer(object):
+    """Distributed request tracer.
+
+    Creates server spans for service requests, and client spans
+    for downstream service calls. Span context is propagated
+    through the RequestContext passed to every service method.
+
+    Sampling decisions are made when a trace begins, with
+    probability sample_rate, and are propagated with the trace,
+    so traces are either recorded across all services or not
+    at all. Sampled spans are exported in batches by the
+    SpanExporter.
+
+    Example usage:
+        tracer = Tracer("chatsvc", SpanExporter(FileSpanSink("/tmp/spans")), sample_rate=0.01)
+        tracer.start()
+        span = tracer.start_span("getVersion", "server", parent=span_context)
+        span.finish()
+    """
+
+    def __init__(self, service_name, exporter, sample_rate=0.01):
+        """Tracer constructor.
+
+        Args:
+            service_name: name of the service recording spans
+            exporter: SpanExporter object
+            sample_rate: probability, between 0 and 1, with
+                which new traces are sampled.
+        """
+        self.service_name = service_name
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def start(self):
+        """Start exporting spans."""
+        self.exporter.start()
+
+    def stop(self):
+        """Stop exporting spans, flushing queued spans."""
+        self.exporter.stop()
+
+    def after_fork(self):
+        """Reinitialize tracer in a forked process.
+
+        The random module is reseeded, since its state is copied
+        from the parent, so that sampling decisions differ
+        between processes.
+        """
+        random.seed()
+        self.exporter.after_fork()
+
+    def start_span(self, name, kind, parent=None):
+        """Start span.
+
+        Args:
+            name: span name, i.e. service method name
+            kind: "server" or "client"
+            parent: optional parent SpanContext or Span. If not
+                provided, a new trace is started, and sampled
+                per sample_rate.
+        Returns:
+            Span object
+        """
+        if parent is None:
+            return Span(self, name, kind, new_id(),
+                    sampled=random.random() < self.sample_rate)
+        return Span(self, name, kind, parent.trace_id,
+                parent_id=parent.span_id,
+                sampled=parent.sampled)
+
+    def export(self, span):
+        """Export finished span.
+
+        Args:
+            span: Span object
+        """
+        self.exporter.export(span.to_dict())
+
+
+def traced_call(name, method, args, kwargs):
+    """Invoke a service client method within a client span.
+
+    The span's context is injected into the RequestContext,
+    which must be the first argument. The span's parent is the
+    server span of the current service request, if any.
+    Otherwise, a new trace is started.
+
+    Args:
+        name: service method name
+        method: service client method
+        args: method positional arguments
+        kwargs: method keyword arguments
+    Returns:
+        method result
+    """
+    tracer = _tracer
+    if tracer is None or not args or not hasattr(args[0], "context"):
+        return method(*args, **kwargs)
+
+    timing = current_request()
+    parent = timing.span if timing is not None else None
+    span = tracer.start_span(name, "client", parent)
+    args = (inject(args[0], span.context),) + tuple(args[1:])
+
+    error = True
+    try:
+        result = method(*args, **kwargs)
+        error = False
+        return result
+    finally:
+        span.finish(error)